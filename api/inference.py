@@ -1,72 +1,193 @@
-from fastapi import APIRouter
-from api.schemas import GenerateRequest, GenerateResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from api.schemas import (
+    GenerateRequest, GenerateResponse, SampleResult, InlineGenerateRequest, InlineGenerateResponse)
 from api.metrics import track_request
 from pathlib import Path
 import os
+import io
+import contextlib
 import sys
+import copy
+import json
+import time
 import uuid
+import base64
+import binascii
+import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from src.generation.generate import generate_music
-from src.evaluation.compare_audio import midi_to_wav
+from src.generation.generate import (
+    generate_tokens, generate_variations, encode_prompt, cached_prefix_state,
+    iter_tokens, save_midi, midi_bytes, stop_criteria)
+from src.generation.stopping import until_stopped
+from src.generation.seed_cache import get_seed_cache
+from src.generation.model_registry import get_model
+from src.generation.scheduler import BatchScheduler
+from src.generation.speculative import SpeculativeDecoder
+from src.generation.render import AudioRenderer, AUDIO_FORMATS
+from src.evaluation.metrics import evaluate_tokens
 from src.preprocessing import tokenizer
 from src.monitoring.latency import measure_latency
+from src.monitoring.generation_metrics import (
+    STREAM_FIRST_TOKENS_LATENCY, STREAM_FIRST_MIDI_LATENCY, STREAM_CANCELLED)
 from src.utils import load_config
+import midi_neural_processor.processor as midi_tokenizer
 
 router = APIRouter()
 
+# Project folder (config, models, outputs); COMPOSER_PROJECT_DIR overrides it, e.g. in tests
+project_dir = Path(os.environ.get("COMPOSER_PROJECT_DIR", "/content/drive/MyDrive/Moroccan-IA-music-composer"))
+
 # Outputs
-output_dir = Path("/content/drive/MyDrive/Moroccan-IA-music-composer/outputs/generated_midi")
+output_dir = project_dir / "outputs" / "generated_midi"
 output_dir.mkdir(parents=True, exist_ok=True)
 
-config = load_config("/content/drive/MyDrive/Moroccan-IA-music-composer/config/generation.yaml")
-model_path = "/content/drive/MyDrive/Moroccan-IA-music-composer/models/final_model.keras"
+config = load_config(project_dir / "config" / "generation.yaml")
+model_path = str(project_dir / "models" / "final_model.keras")
 
-# Generation endpoint
-@router.post("/generate", response_model=GenerateResponse)
-@measure_latency
-@track_request
-def generate_music_api(request: GenerateRequest):
+# Exported TFLite model for CPU serving (continuous batching needs the Keras model)
+backend = config["generation"].get("backend", "keras")
+if backend == "tflite":
+    model_path = config["generation"]["tflite_path"]
+
+# Load the model once at startup (in the configured precision); requests reuse it from the registry
+precision = config["generation"].get("precision", "float32")
+scheduler = None
+if os.path.exists(model_path):
+    serving_config = config.get("serving", {})
+    if serving_config.get("batching", False) and backend == "keras":
+        scheduler = BatchScheduler(
+            get_model(model_path, precision),
+            max_batch_size=serving_config.get("max_batch_size", 8),
+            max_wait_ms=serving_config.get("max_wait_ms", 10),
+            stride=config["generation"].get("context_stride", 1),
+            vocab_size=config["data"].get("vocab_size"),
+            # Follows checkpoint reloads of the registry (see ModelRegistry)
+            resolve=lambda: get_model(model_path, precision),
+        )
+    else:
+        get_model(model_path, precision)
+
+    # A draft that does not match the main model fails here, not on the first request
+    draft_config = config.get("draft_model", {})
+    if backend == "keras" and draft_config.get("enabled", False) and os.path.exists(draft_config["path"]):
+        SpeculativeDecoder(get_model(model_path, precision), get_model(draft_config["path"], precision))
+
+# MIDI -> WAV rendering runs in its own process pool, cached by MIDI content
+render_config = config.get("render", {})
+render_mode = render_config.get("mode", "eager")
+renderer = AudioRenderer(
+    cache_dir=render_config.get("cache_dir", str(project_dir / "cache" / "audio")),
+    fs=render_config.get("sample_rate", 22050),
+    synth=render_config.get("synth", "fluidsynth"),
+    sf2_path=render_config.get("sf2_path"),
+    chunk_seconds=render_config.get("chunk_seconds", 30),
+    max_workers=render_config.get("max_workers", 2),
+    max_disk_mb=render_config.get("max_disk_mb", 4096),
+)
+
+def request_seed(request):
     """
-    Generate a MIDI sequence using the pre-trained Transformer model.
+    Seed MIDI of a request: the decoded seed_midi bytes, else the prompt path.
     """
+    if request.seed_midi:
+        try:
+            return base64.b64decode(request.seed_midi, validate=True)
+        except binascii.Error:
+            raise HTTPException(status_code=400, detail="seed_midi is not valid base64")
+    return request.prompt
 
-    try:
-        # # unique file name generation
-        file_id = uuid.uuid4().hex
-        midi_filename = f"generated_{file_id}.midi"
-        wav_filename = f"generated_{file_id}.wav"
+def request_config_for(request):
+    """
+    Per-request copy of the config with the user parametres (requests run concurrently).
+    """
+    request_config = copy.deepcopy(config)
+    request_config["generation"]["length"] = request.length
+    request_config["generation"]["temperature"] = request.temperature
+    request_config["generation"]["top_k"] = request.top_k
+    request_config["generation"]["seed"] = request.seed
+    if request.max_duration is not None:
+        request_config["generation"]["max_duration"] = request.max_duration
+    if request.time_budget is not None:
+        request_config["generation"]["time_budget"] = request.time_budget
+
+    seed = request_seed(request)
+    if seed:
+        request_config["generation"]["seed_midi_path"] = seed
+    return request_config
 
-        # User parametres
-        config["generation"]["length"] = request.length
-        config["generation"]["temperature"] = request.temperature
-        config["generation"]["top_k"] = request.top_k
+def run_generation(request, progress=None):
+    """
+    Generate MIDI (and render WAV) for a GenerateRequest; raises on failure.
+    progress : optional callable(done, total, stage=None), see Job.report
+    """
+    # # unique file name generation
+    file_id = uuid.uuid4().hex
+    midi_filename = f"generated_{file_id}.midi"
 
-        if request.prompt:
-            config["generation"]["seed_midi_path"] = request.prompt
+    # User parametres
+    request_config = request_config_for(request)
 
-        # Midi generation
-        generate_music(
+    generation_progress = None
+    if progress is not None:
+        generation_progress = lambda done, total: progress(done, total, stage="generating")
+
+    # Midi generation
+    samples = []
+    if request.num_samples > 1:
+        # Seed encoded and prefilled once, variations decoded as one batch
+        results = generate_variations(
             model_path=model_path,
-            config=config,
-            gen_file=midi_filename
+            config=request_config,
+            gen_files=[f"generated_{file_id}_{i}.midi" for i in range(request.num_samples)],
+            progress=generation_progress,
         )
+        samples = [
+            SampleResult(midi_file_path=path, metrics=evaluate_tokens(tokens), stop_reason=stop_reason)
+            for path, tokens, stop_reason in results
+        ]
+        midi_path, _, stop_reason = results[0]
+    else:
+        tokens, stop_reason = generate_tokens(
+            model_path, request_config, scheduler=scheduler, progress=generation_progress)
+        midi_path = save_midi(tokens, config["output"]["midi_dir"], midi_filename)
 
-        midi_path = os.path.join("/content/drive/MyDrive/Moroccan-IA-music-composer","generated_midi",midi_file)
-        wav_path = os.path.join("/content/drive/MyDrive/Moroccan-IA-music-composer", "audio", wav_filename)
-        # Conversion: MIDI to WAV
-        midi_to_wav(
-            midi_path,
-            wav_path
-        )
+    # WAV rendering: now, in the background, or on the first GET /audio/{midi}
+    wav_path = ""
+    if render_mode == "eager":
+        if progress is not None:
+            progress(1, 1, stage="rendering")
+        wav_path = renderer.render(midi_path)
+    elif render_mode == "background":
+        renderer.submit(midi_path)
+        wav_path = renderer.wav_path(midi_path)
+
+    return GenerateResponse(
+        midi_file_path=midi_path,
+        audio_file_path=wav_path,
+        audio_url=f"/api/audio/{os.path.basename(midi_path)}",
+        success=True,
+        message="Music generated successfully.",
+        samples=samples,
+        stop_reason=stop_reason,
+    )
 
-        return GenerateResponse(
-            midi_file_path=midi_path,
-            audio_file_path=wav_path,
-            success=True,
-            message="Music generated successfully."
-        )
+
+# Generation endpoint
+@router.post("/generate", response_model=GenerateResponse)
+@measure_latency
+@track_request
+def generate_music_api(request: GenerateRequest):
+    """
+    Generate a MIDI sequence using the pre-trained Transformer model.
+    Long jobs should use the /jobs endpoints instead (see api/jobs.py).
+    """
+
+    try:
+        return run_generation(request)
 
     except Exception as e:
         return GenerateResponse(
@@ -75,3 +196,160 @@ def generate_music_api(request: GenerateRequest):
             success=False,
             message=str(e)
         )
+
+
+# Rendered audio of a generated MIDI file
+@router.get("/audio/{midi_name}")
+async def get_audio(midi_name: str):
+    """
+    WAV of a generated MIDI file, rendered on first request and cached.
+    """
+    midi_path = os.path.join(config["output"]["midi_dir"], os.path.basename(midi_name))
+    if midi_name != os.path.basename(midi_name) or not os.path.isfile(midi_path):
+        raise HTTPException(status_code=404, detail=f"unknown MIDI file: {midi_name}")
+    wav_path = await run_in_threadpool(renderer.render, midi_path)
+    return FileResponse(wav_path, media_type="audio/wav", filename=midi_name.rsplit(".", 1)[0] + ".wav")
+
+
+# In-memory generation endpoint: seed bytes in, MIDI and audio bytes out
+@router.post("/generate/inline", response_model=InlineGenerateResponse)
+@measure_latency
+@track_request
+def generate_music_inline(request: InlineGenerateRequest, output: str = "json"):
+    """
+    Generate from seed_midi bytes without touching disk: only the memory
+    tiers of the seed and result caches are used.
+    output : "json" (base64 MIDI and audio), or "midi" / "audio" for the raw bytes
+    """
+    if output not in ("json", "midi", "audio") or (output == "audio" and request.audio_format == "none"):
+        raise HTTPException(status_code=400, detail=f"unsupported output: {output}")
+    request_config = request_config_for(request)
+
+    try:
+        tokens, stop_reason = generate_tokens(model_path, request_config, scheduler=scheduler, disk_cache=False)
+        midi_data = midi_tokenizer.decode_midi(tokens)
+        buffer = io.BytesIO()
+        midi_data.write(buffer)
+        midi = buffer.getvalue()
+        audio = None
+        if request.audio_format != "none":
+            audio = renderer.audio_bytes(midi_data, request.audio_format)
+    except Exception as e:
+        return InlineGenerateResponse(
+            midi="", audio_format=request.audio_format, num_tokens=0, success=False, message=str(e))
+
+    if output == "midi":
+        return Response(midi, media_type="audio/midi")
+    if output == "audio":
+        return Response(audio, media_type=AUDIO_FORMATS[request.audio_format][2])
+    return InlineGenerateResponse(
+        midi=base64.b64encode(midi).decode("ascii"),
+        audio=audio and base64.b64encode(audio).decode("ascii"),
+        audio_format=request.audio_format,
+        num_tokens=len(tokens),
+        stop_reason=stop_reason,
+        success=True,
+        message="Music generated successfully.",
+    )
+
+
+def sse_event(event, data):
+    """
+    Format one Server-Sent Event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def midi_fragment(tokens):
+    """
+    Decode tokens to MIDI bytes (base64) without touching disk.
+    """
+    return base64.b64encode(midi_bytes(tokens)).decode("ascii")
+
+
+# Streaming generation endpoint (Server-Sent Events)
+@router.post("/generate/stream")
+async def generate_music_stream(request: GenerateRequest, http_request: Request):
+    """
+    Stream token batches and decoded MIDI fragments while generating.
+    Events: "tokens", "midi" (whole piece so far, base64), "done".
+    Generation stops when the client disconnects (checked before each token).
+    """
+    start_time = time.time()
+    criteria = stop_criteria(request_config_for(request), start_time=time.monotonic())
+    serving_config = config.get("serving", {})
+    token_batch = serving_config.get("stream_token_batch", 16)
+    midi_every = serving_config.get("stream_midi_every", 128)
+
+    loaded = await run_in_threadpool(get_model, model_path, precision)
+    max_seq_len = loaded.model.max_seq_len
+    seed_cache = get_seed_cache(config)
+    rng = np.random.default_rng(request.seed)
+    prompt, seed_key = await run_in_threadpool(
+        encode_prompt, request_seed(request), max_seq_len, loaded.model.vocab_size, seed_cache, rng)
+    prefix_state = await run_in_threadpool(
+        cached_prefix_state, loaded, prompt, seed_key, seed_cache)
+
+    source = iter_tokens(
+        loaded, prompt, criteria.max_new_tokens,
+        temperature=request.temperature,
+        top_k=request.top_k,
+        top_p=config["generation"].get("top_p", 0.9),
+        stride=config["generation"].get("context_stride", 1),
+        prefix_state=prefix_state,
+        rng=rng,
+    )
+    tokens = until_stopped(source, criteria)
+
+    async def event_stream():
+        generated = list(prompt)
+        batch = []
+        first_tokens_sent = False
+        first_midi_sent = False
+
+        try:
+            async for token in iterate_in_threadpool(tokens):
+                # Checked on every token, not only on flushes: a client gone
+                # mid-batch stops the decoding at the next step
+                if await http_request.is_disconnected():
+                    STREAM_CANCELLED.inc()
+                    return
+                generated.append(token)
+                batch.append(token)
+                num_new = len(generated) - len(prompt)
+
+                if len(batch) >= token_batch:
+                    yield sse_event("tokens", {"tokens": batch, "num_tokens": num_new})
+                    batch = []
+                    if not first_tokens_sent:
+                        STREAM_FIRST_TOKENS_LATENCY.observe(time.time() - start_time)
+                        first_tokens_sent = True
+
+                if num_new % midi_every == 0:
+                    fragment = await run_in_threadpool(midi_fragment, generated)
+                    yield sse_event("midi", {"midi": fragment, "num_tokens": num_new})
+                    if not first_midi_sent:
+                        STREAM_FIRST_MIDI_LATENCY.observe(time.time() - start_time)
+                        first_midi_sent = True
+
+            if batch:
+                yield sse_event("tokens", {"tokens": batch, "num_tokens": len(generated) - len(prompt)})
+
+            midi_filename = f"generated_{uuid.uuid4().hex}.midi"
+            midi_path = await run_in_threadpool(
+                save_midi, generated, config["output"]["midi_dir"], midi_filename)
+            yield sse_event("done", {
+                "midi_file_path": midi_path,
+                "midi": await run_in_threadpool(midi_fragment, generated),
+                "num_tokens": len(generated) - len(prompt),
+                "stop_reason": criteria.stop_reason,
+            })
+        except Exception as e:
+            yield sse_event("error", {"message": str(e)})
+        finally:
+            # Stop the token generators (client gone or stream finished)
+            for generator in (tokens, source):
+                with contextlib.suppress(ValueError):
+                    generator.close()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
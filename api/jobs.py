@@ -0,0 +1,62 @@
+from fastapi import APIRouter, HTTPException, status
+from api.schemas import GenerateRequest, JobResponse
+from api.inference import config, run_generation
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.generation.jobs import JobManager, QueueFull
+
+router = APIRouter()
+
+
+def run_job(params, job):
+    """
+    Job runner: generation and rendering, reporting progress to the job.
+    """
+    return run_generation(GenerateRequest(**params), progress=job.report).model_dump()
+
+
+jobs_config = config.get("jobs", {})
+manager = JobManager(
+    run_job,
+    max_workers=jobs_config.get("max_workers", 1),
+    max_queue=jobs_config.get("max_queue", 16),
+    ttl_seconds=jobs_config.get("ttl_seconds", 3600),
+    retry_after_seconds=jobs_config.get("retry_after_seconds", 30),
+)
+
+
+@router.post("/jobs", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+def submit_job(request: GenerateRequest):
+    """
+    Queue a generation job and return its id immediately; poll GET /jobs/{id}.
+    """
+    try:
+        job = manager.submit(request.model_dump())
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+def get_job(job_id: str):
+    """
+    Status, progress and (once succeeded) the result paths of a job.
+    """
+    job = manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"unknown or expired job: {job_id}")
+    return job.to_dict()
+
+
+@router.delete("/jobs/{job_id}", response_model=JobResponse)
+def cancel_job(job_id: str):
+    """
+    Cancel a queued or running job, or delete the record of a finished one.
+    """
+    job = manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"unknown or expired job: {job_id}")
+    return job.to_dict()
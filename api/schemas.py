@@ -1,14 +1,50 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 
 class GenerateRequest(BaseModel):
     prompt: Optional[str] = ""      
     length: Optional[int] = 128     # Number of events/tokens to generate 
     temperature: Optional[float] = 1.0
     top_k: Optional[int] = 5
+    num_samples: Optional[int] = Field(1, ge=1, le=16)   # Variations of the same seed
+    seed_midi: Optional[str] = None # Base64 seed MIDI bytes (used instead of the prompt path)
+    seed: Optional[int] = Field(None, ge=0, lt=2**63)    # Random seed: reproducible (and cached) result
+    max_duration: Optional[float] = Field(None, gt=0)    # Stop after this many seconds of music
+    time_budget: Optional[float] = Field(None, gt=0)     # Stop after this many seconds of wall clock
+
+class SampleResult(BaseModel):
+    midi_file_path: str             # Path to one generated variation
+    metrics: Dict[str, float]       # evaluate_tokens on the generated tokens
+    stop_reason: Optional[str] = None   # length, duration, deadline or end_of_sequence
 
 class GenerateResponse(BaseModel):
     midi_file_path: str             # Path to generated MIDI
-    audio_file_path: str            # Path to generated WAV
+    audio_file_path: str            # Path to generated WAV ("" until rendered in lazy mode)
+    audio_url: Optional[str] = None     # GET it for the WAV (renders on first request)
+    success: bool
+    message: Optional[str] = None
+    samples: List[SampleResult] = []    # All variations when num_samples > 1
+    stop_reason: Optional[str] = None   # Limit that ended generation: length, duration, deadline, end_of_sequence
+
+class InlineGenerateRequest(GenerateRequest):
+    audio_format: Optional[str] = Field("ogg", pattern="^(ogg|flac|wav|none)$")
+
+class InlineGenerateResponse(BaseModel):
+    midi: str                       # Base64 generated MIDI bytes
+    audio: Optional[str] = None     # Base64 encoded audio (audio_format), None for "none"
+    audio_format: str
+    num_tokens: int                 # Tokens in the MIDI (seed and generated)
+    stop_reason: Optional[str] = None   # length, duration, deadline or end_of_sequence
     success: bool
     message: Optional[str] = None
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str                     # queued, running, succeeded, failed, cancelled
+    stage: Optional[str] = None     # generating, rendering
+    progress: float = 0.0           # fraction of tokens generated
+    result: Optional[GenerateResponse] = None   # set once the job has succeeded
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.utils import load_config
+from src.models.attention import MultiHeadSelfAttention, ATTENTION_IMPLEMENTATIONS
+from bench_precision import peak_memory_mb, time_per_call
+
+
+def measure(implementation, seq_len, args):
+    """
+    Forward + backward time of one attention layer at seq_len (run in its own process).
+    """
+    config = load_config(args.config)
+    embed_dim = config["model"]["embed_dim"]
+    layer = MultiHeadSelfAttention(
+        embed_dim, config["model"]["n_heads"], dropout_rate=config["model"]["dropout"],
+        implementation=implementation, block_size=args.block_size)
+    x = tf.random.normal((args.batch_size, seq_len, embed_dim))
+    layer(x)
+
+    @tf.function
+    def step():
+        with tf.GradientTape() as tape:
+            tape.watch(x)
+            loss = tf.reduce_sum(layer(x, training=True))
+        return tape.gradient(loss, [x] + layer.trainable_variables)
+
+    step_ms = time_per_call(lambda: step()[0].numpy(), args.repeats)
+    return {
+        "step_ms": step_ms,
+        "tokens_per_second": args.batch_size * seq_len / step_ms * 1000,
+        "peak_memory_mb": peak_memory_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dense vs chunked attention: step time and memory per sequence length")
+    parser.add_argument("--config", default="config/training.yaml")
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--block-size", type=int, default=256)
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=[256, 512, 1024, 2048])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--implementations", nargs="+", default=list(ATTENTION_IMPLEMENTATIONS))
+    parser.add_argument("--child", nargs=2, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child[0], int(args.child[1]), args)))
+        return
+
+    print(f"batch={args.batch_size}, block={args.block_size}, one attention layer from {args.config}, forward + backward")
+    print(f"{'attention':<10} {'seq_len':>8} {'step ms':>10} {'tokens/sec':>11} {'peak MB':>9}")
+    for seq_len in args.seq_lens:
+        for implementation in args.implementations:
+            # Fresh process per run so peak memory is not shared
+            result = subprocess.run(
+                [sys.executable, __file__, "--child", implementation, str(seq_len),
+                 "--config", args.config, "--batch-size", str(args.batch_size),
+                 "--block-size", str(args.block_size), "--repeats", str(args.repeats)],
+                capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"{implementation:<10} {seq_len:>8} failed: {result.stderr.strip().splitlines()[-1]}")
+                continue
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{implementation:<10} {seq_len:>8} {stats['step_ms']:>10.1f}"
+                  f" {stats['tokens_per_second']:>11.0f} {stats['peak_memory_mb']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
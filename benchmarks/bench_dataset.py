@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.datasets.midi_dataset import MidiDataset, build_dataset
+
+
+def build_consumer(vocab_size):
+    """
+    Small model standing in for the decoder, so the input pipeline is the bottleneck.
+    """
+    model = tf.keras.Sequential([
+        tf.keras.layers.Embedding(vocab_size, 16),
+        tf.keras.layers.Dense(vocab_size),
+    ])
+    model.compile(optimizer="adam",
+                  loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True))
+    return model
+
+
+def batches_per_second(model, dataset, num_batches, epochs):
+    model.fit(dataset, epochs=1, verbose=0)  # warm-up / tracing
+    start = time.perf_counter()
+    model.fit(dataset, epochs=epochs, verbose=0)
+    return num_batches * epochs / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MidiDataset Sequence vs tf.data pipeline throughput in model.fit")
+    parser.add_argument("--num-sequences", type=int, default=1000)
+    parser.add_argument("--max-seq-len", type=int, default=2048)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--epochs", type=int, default=2)
+    args = parser.parse_args()
+
+    vocab_size = 388
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tokens = np.random.randint(0, vocab_size, size=(args.num_sequences, args.max_seq_len)).astype(np.int32)
+        np.savez_compressed(os.path.join(tmp_dir, "train.npz"), x=tokens)
+        num_batches = int(np.ceil(args.num_sequences / args.batch_size))
+
+        pipelines = {
+            "sequence": MidiDataset(tmp_dir, "train.npz", args.batch_size, args.max_seq_len),
+            "tf.data": build_dataset(tmp_dir, "train.npz", args.batch_size, seed=0),
+        }
+
+        print(f"{args.num_sequences} sequences x {args.max_seq_len} tokens, batch={args.batch_size}, "
+              f"{args.epochs} epochs of model.fit")
+        for name, dataset in pipelines.items():
+            rate = batches_per_second(build_consumer(vocab_size), dataset, num_batches, args.epochs)
+            print(f"{name:<14} {rate:10.1f} batches/sec")
+
+
+if __name__ == "__main__":
+    main()
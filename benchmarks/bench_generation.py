@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.utils import load_config
+from src.models.transformer_decoder import TransformerDecoder
+from src.generation.model_registry import LoadedModel
+from src.generation.generate import sample_tokens
+
+
+def build_model(config, vocab_size):
+    """
+    Randomly initialized decoder with the architecture from the config.
+    """
+    model = TransformerDecoder(
+        vocab_size=vocab_size,
+        max_seq_len=config["data"]["max_seq_len"],
+        embed_dim=config["model"]["embed_dim"],
+        num_heads=config["model"]["n_heads"],
+        ff_dim=config["model"]["ff_dim"],
+        num_layers=config["model"]["n_layers"],
+        dropout=0.0,
+        attention=config["model"].get("attention", "dense"),
+        attention_block_size=config["model"].get("attention_block_size", 256)
+    )
+    model(tf.zeros((1, 1), dtype=tf.int32))
+    return model
+
+
+def tokens_per_second(generate, num_tokens, repeats):
+    generate()  # warm-up / tracing
+    start = time.perf_counter()
+    for _ in range(repeats):
+        generate()
+    return num_tokens * repeats / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Eager vs in-graph generation throughput")
+    parser.add_argument("--config", default="config/generation.yaml")
+    parser.add_argument("--prompt-len", type=int, default=64)
+    parser.add_argument("--num-tokens", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    vocab_size = config["model"].get("vocab_size") or config["data"]["max_seq_len"] + 1
+    model = build_model(config, vocab_size)
+    loaded = LoadedModel("benchmark", model, None, None)
+
+    prompt = np.random.randint(1, vocab_size, size=args.prompt_len).tolist()
+    sampling = dict(
+        temperature=config["generation"]["temperature"],
+        top_k=config["generation"]["top_k"],
+        top_p=config["generation"]["top_p"],
+    )
+
+    engines = {
+        "eager loop": lambda: sample_tokens(loaded, prompt, args.num_tokens, **sampling),
+        "graph": lambda: loaded.graph_generator().generate(prompt, args.num_tokens, **sampling),
+        "graph (XLA)": lambda: loaded.graph_generator(jit_compile=True).generate(
+            prompt, args.num_tokens, **sampling),
+    }
+
+    print(f"prompt={args.prompt_len} tokens, generating {args.num_tokens} tokens")
+    for name, generate in engines.items():
+        rate = tokens_per_second(generate, args.num_tokens, args.repeats)
+        print(f"{name:<12} {rate:8.1f} tokens/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import subprocess
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.utils import load_config
+from src.models.precision import set_precision, PRECISIONS
+from src.generation.model_registry import LoadedModel
+from src.training.train_utils import build_optimizer, masked_sparse_categorical_crossentropy
+from bench_generation import build_model
+
+
+def peak_memory_mb():
+    """
+    Peak accelerator memory when a GPU is present, otherwise peak process RSS.
+    """
+    if tf.config.list_physical_devices("GPU"):
+        return tf.config.experimental.get_memory_info("GPU:0")["peak"] / 2**20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def time_per_call(fn, repeats):
+    fn()  # warm-up / tracing
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def measure(precision, args):
+    """
+    Train-step and decode-step time for one policy (run in its own process).
+    """
+    config = load_config(args.config)
+    set_precision(precision)
+    vocab_size = config["model"].get("vocab_size") or config["data"]["max_seq_len"] + 1
+    model = build_model(config, vocab_size)
+    model.compile(optimizer=build_optimizer(1e-4), loss=masked_sparse_categorical_crossentropy)
+
+    seq_len = config["data"]["max_seq_len"]
+    batch = np.random.randint(1, vocab_size, size=(args.batch_size, seq_len + 1)).astype(np.int32)
+    train_ms = time_per_call(
+        lambda: model.train_on_batch(batch[:, :-1], batch[:, 1:]), args.repeats)
+
+    loaded = LoadedModel("benchmark", model, None, None)
+    _, cache = loaded.prefill(batch[:1, :seq_len // 2])
+    token = tf.constant([1], dtype=tf.int32)
+    position = tf.constant([seq_len // 2], dtype=tf.int32)
+    decode_ms = time_per_call(
+        lambda: loaded.decode_step(token, cache, position)[0].numpy(), args.repeats * 10)
+
+    return {"train_step_ms": train_ms, "decode_step_ms": decode_ms, "peak_memory_mb": peak_memory_mb()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Step time and memory per precision policy")
+    parser.add_argument("--config", default="config/training.yaml")
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--precisions", nargs="+", default=list(PRECISIONS))
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args)))
+        return
+
+    print(f"batch={args.batch_size}, max_seq_len from {args.config}")
+    print(f"{'precision':<16} {'train step ms':>14} {'decode step ms':>15} {'peak MB':>9}")
+    for precision in args.precisions:
+        # Fresh process per policy so peak memory is not shared
+        result = subprocess.run(
+            [sys.executable, __file__, "--child", precision, "--config", args.config,
+             "--batch-size", str(args.batch_size), "--repeats", str(args.repeats)],
+            capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"{precision:<16} failed: {result.stderr.strip().splitlines()[-1]}")
+            continue
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{precision:<16} {stats['train_step_ms']:>14.1f} {stats['decode_step_ms']:>15.2f}"
+              f" {stats['peak_memory_mb']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
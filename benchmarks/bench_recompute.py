@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.utils import load_config
+from src.training.train_utils import build_optimizer, masked_sparse_categorical_crossentropy
+from bench_generation import build_model
+from bench_precision import peak_memory_mb, time_per_call
+
+
+def recompute_settings(num_layers):
+    """
+    Settings compared by default: none, every other block, every block.
+    """
+    return {"none": False, "alternate": list(range(0, num_layers, 2)), "all": True}
+
+
+def measure(recompute, args):
+    """
+    Train-step time and peak memory for one recompute setting (run in its own process).
+    """
+    config = load_config(args.config)
+    if args.seq_len:
+        config["data"]["max_seq_len"] = args.seq_len
+    vocab_size = config["model"].get("vocab_size") or config["data"]["max_seq_len"] + 1
+    model = build_model(config, vocab_size)
+    model.set_recompute(recompute)
+    model.compile(optimizer=build_optimizer(1e-4), loss=masked_sparse_categorical_crossentropy)
+
+    seq_len = config["data"]["max_seq_len"]
+    batch = np.random.randint(1, vocab_size, size=(args.batch_size, seq_len + 1)).astype(np.int32)
+    train_ms = time_per_call(
+        lambda: model.train_on_batch(batch[:, :-1], batch[:, 1:]), args.repeats)
+    return {"train_step_ms": train_ms, "peak_memory_mb": peak_memory_mb()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory vs train-step time per activation recompute setting")
+    parser.add_argument("--config", default="config/training.yaml")
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--seq-len", type=int, default=None, help="defaults to data.max_seq_len")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(json.loads(args.child), args)))
+        return
+
+    config = load_config(args.config)
+    seq_len = args.seq_len or config["data"]["max_seq_len"]
+    print(f"batch={args.batch_size}, seq_len={seq_len}, "
+          f"attention={config['model'].get('attention', 'dense')}, model from {args.config}")
+    print(f"{'recompute':<10} {'train step ms':>14} {'peak MB':>9}")
+    for name, recompute in recompute_settings(config["model"]["n_layers"]).items():
+        # Fresh process per setting so peak memory is not shared
+        command = [sys.executable, __file__, "--child", json.dumps(recompute), "--config", args.config,
+                   "--batch-size", str(args.batch_size), "--repeats", str(args.repeats)]
+        if args.seq_len:
+            command += ["--seq-len", str(args.seq_len)]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"{name:<10} failed: {result.stderr.strip().splitlines()[-1]}")
+            continue
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{name:<10} {stats['train_step_ms']:>14.1f} {stats['peak_memory_mb']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
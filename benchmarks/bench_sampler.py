@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.generation.sampler import (
+    apply_temperature, top_k_sampling, top_p_sampling, softmax, sample_next_tokens)
+
+
+def reference_sample(logits, temperature, top_k, top_p):
+    """
+    The original per-row sampler: float64, full argsort for top-p,
+    a fresh -inf mask per filter.
+    """
+    logits = np.asarray(logits).astype(np.float64)
+    logits = apply_temperature(logits, temperature)
+    logits = top_k_sampling(logits, top_k)
+    logits = top_p_sampling(logits, top_p)
+    probs = softmax(logits)
+    return np.random.choice(len(probs), p=probs)
+
+
+def time_per_step(step, repeats):
+    step()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        step()
+    return (time.perf_counter() - start) / repeats * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-step sampling cost")
+    parser.add_argument("--repeats", type=int, default=2000)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--top-p", type=float, default=0.9)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"top_k={args.top_k} top_p={args.top_p}  (microseconds per decode step)")
+    print(f"{'vocab':>6} {'batch':>6} {'per-row loop':>14} {'batched':>10}")
+
+    for vocab_size in (388, 2049):
+        for batch_size in (1, 8):
+            logits = rng.standard_normal((batch_size, vocab_size)).astype(np.float32)
+
+            loop = time_per_step(
+                lambda: [reference_sample(row, 1.0, args.top_k, args.top_p) for row in logits],
+                args.repeats)
+            batched = time_per_step(
+                lambda: sample_next_tokens(logits, 1.0, args.top_k, args.top_p, rng=rng),
+                args.repeats)
+            print(f"{vocab_size:>6} {batch_size:>6} {loop:>14.1f} {batched:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.utils import load_config
+from src.generation.model_registry import LoadedModel, load_model
+from src.generation.generate import sample_tokens
+from src.generation.speculative import SpeculativeDecoder
+from bench_generation import build_model
+
+
+def timed(generate, repeats):
+    generate()  # warm-up / tracing
+    start = time.perf_counter()
+    for _ in range(repeats):
+        generate()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plain vs speculative decoding throughput")
+    parser.add_argument("--config", default="config/generation.yaml")
+    parser.add_argument("--target", default=None, help="trained main model (random if omitted)")
+    parser.add_argument("--draft", default=None, help="trained draft model (random if omitted)")
+    parser.add_argument("--draft-embed-dim", type=int, default=128, help="random draft architecture")
+    parser.add_argument("--draft-heads", type=int, default=4)
+    parser.add_argument("--draft-layers", type=int, default=2)
+    parser.add_argument("--draft-ff-dim", type=int, default=512)
+    parser.add_argument("--prompt-len", type=int, default=64)
+    parser.add_argument("--num-tokens", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    vocab_size = config["model"].get("vocab_size") or config["data"]["max_seq_len"] + 1
+
+    # Untrained models rarely agree, so acceptance is only meaningful with
+    # trained checkpoints; draft = target shows the upper bound.
+    target_model = load_model(args.target) if args.target else build_model(config, vocab_size)
+    draft_model = load_model(args.draft) if args.draft else build_model(
+        {**config, "model": {"embed_dim": args.draft_embed_dim, "n_heads": args.draft_heads,
+                             "n_layers": args.draft_layers, "ff_dim": args.draft_ff_dim}}, vocab_size)
+    target = LoadedModel("target", target_model, None, None)
+    draft = LoadedModel("draft", draft_model, None, None)
+
+    prompt = np.random.randint(1, vocab_size, size=args.prompt_len).tolist()
+    sampling = dict(
+        temperature=config["generation"]["temperature"],
+        top_k=config["generation"]["top_k"],
+        top_p=config["generation"]["top_p"],
+    )
+
+    print(f"prompt={args.prompt_len} tokens, generating {args.num_tokens} tokens")
+    seconds = timed(lambda: sample_tokens(target, prompt, args.num_tokens, **sampling), args.repeats)
+    print(f"{'plain':<22} {args.num_tokens / seconds:8.1f} tokens/sec")
+
+    for name, draft_loaded in (("draft", draft), ("draft = target", target)):
+        for k in (2, 4, 8):
+            decoder = SpeculativeDecoder(target, draft_loaded, num_speculative_tokens=k)
+            seconds = timed(
+                lambda: list(decoder.iter_tokens(prompt, args.num_tokens, **sampling)), args.repeats)
+            print(f"{name + f' k={k}':<22} {args.num_tokens / seconds:8.1f} tokens/sec"
+                  f"  acceptance {decoder.acceptance_rate:.2f}")
+
+
+if __name__ == "__main__":
+    main()
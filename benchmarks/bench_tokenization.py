@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.preprocessing.tokenizer import encode_midi_task, midi_files, save_to_token_store
+
+
+def sequential(input_dir):
+    """
+    Baseline: every file tokenized in turn, no cache.
+    """
+    start = time.perf_counter()
+    for midi_name in midi_files(input_dir):
+        try:
+            encode_midi_task(os.path.join(input_dir, midi_name))
+        except Exception:
+            pass
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sequential vs parallel cached tokenization, and incremental re-runs")
+    parser.add_argument("input_dir", nargs="?", default="data/raw/moroccan_midi/gnawa_midi")
+    parser.add_argument("--num-files", type=int, default=None, help="files of input_dir to use (default: all)")
+    parser.add_argument("--added", type=int, default=10, help="files added before the last run")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of CPUs")
+    args = parser.parse_args()
+
+    names = midi_files(args.input_dir)[:args.num_files]
+    initial, added = names[:len(names) - args.added], names[len(names) - args.added:]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = os.path.join(tmp_dir, "midi")
+        os.makedirs(corpus)
+        for name in initial:
+            shutil.copy(os.path.join(args.input_dir, name), corpus)
+
+        def run():
+            start = time.perf_counter()
+            save_to_token_store(corpus, os.path.join(tmp_dir, "tokens", "train"), max_workers=args.workers)
+            return time.perf_counter() - start
+
+        runs = {"sequential (no cache)": sequential(corpus), "parallel, cold cache": run(),
+                "re-run, unchanged": run()}
+        for name in added:
+            shutil.copy(os.path.join(args.input_dir, name), corpus)
+        runs[f"re-run, {len(added)} files added"] = run()
+
+    print(f"\n{len(initial)} files of {args.input_dir} (+{len(added)}), workers={args.workers or os.cpu_count()}")
+    print(f"{'run':<24} {'seconds':>8} {'files/sec':>10}")
+    for name, seconds in runs.items():
+        num_files = len(names) if "added" in name else len(initial)
+        print(f"{name:<24} {seconds:>8.2f} {num_files / seconds:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
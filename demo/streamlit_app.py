@@ -1,10 +1,13 @@
 import streamlit as st
 import requests
 import os
+import time
+import base64
 
 
 # Configuration
-API_URL = "http://localhost:8000/api/generate"
+API_BASE = "http://localhost:8000"
+API_URL = f"{API_BASE}/api/jobs"
 
 st.set_page_config(page_title="Moroccan Music Transformer", page_icon="🎵")
 
@@ -14,6 +17,7 @@ st.write("Générez de la musique à partir d'un prompt et écoutez le résultat
 # Formulaire utilisateur
 with st.form(key="generate_form"):
     prompt = st.text_input("Seed MIDI / Prompt (optionnel)", "")
+    seed_file = st.file_uploader("Ou envoyer un seed MIDI", type=["mid", "midi"])
     length = st.number_input("Length (number of tokens/events)", min_value=32, max_value=1024, value=128, step=16)
     temperature = st.slider("Temperature", min_value=0.1, max_value=2.0, value=1.0, step=0.1)
     top_k = st.number_input("Top-k", min_value=1, max_value=50, value=5, step=1)
@@ -29,11 +33,25 @@ if submit_button:
         "temperature": float(temperature),
         "top_k": int(top_k)
     }
+    if seed_file is not None:
+        # Sent with the request, no shared filesystem needed
+        payload["seed_midi"] = base64.b64encode(seed_file.getvalue()).decode("ascii")
 
     with st.spinner("Génération en cours..."):
         try:
-            response = requests.post(API_URL, json=payload, timeout=300)
-            data = response.json()
+            # Background job: submit, then poll until it finishes
+            response = requests.post(API_URL, json=payload, timeout=30)
+            if response.status_code == 429:
+                raise requests.exceptions.RequestException(
+                    f"Serveur occupé, réessayez dans {response.headers.get('Retry-After')} s")
+            job = response.json()
+
+            progress_bar = st.progress(0.0)
+            while job["status"] in ("queued", "running"):
+                time.sleep(1)
+                job = requests.get(f"{API_URL}/{job['job_id']}", timeout=30).json()
+                progress_bar.progress(job["progress"])
+            data = job["result"] or {"success": False, "message": job["error"] or job["status"]}
 
             if data.get("success"):
                 st.success(data.get("message", "Music generated!"))
@@ -43,11 +61,15 @@ if submit_button:
 
                 st.write("**MIDI file:**", midi_path)
                 st.write("**WAV file:**", wav_path)
+                st.write("**Stop reason:**", data.get("stop_reason"))
 
-                # Reading Audio
+                # Reading Audio (rendered by the API on first request if needed)
                 if os.path.exists(wav_path):
                     audio_file = open(wav_path, "rb")
                     st.audio(audio_file.read(), format="audio/wav")
+                elif data.get("audio_url"):
+                    audio = requests.get(API_BASE + data["audio_url"], timeout=300)
+                    st.audio(audio.content, format="audio/wav")
                 else:
                     st.warning("Le fichier WAV n'a pas été trouvé.")
 
@@ -1,6 +1,7 @@
 from fastapi import FastAPI
 from prometheus_client import make_asgi_app
 from api.inference import router as inference_router
+from api.jobs import router as jobs_router
 
 app = FastAPI(
     title="Moroccan Music Transformer API",
@@ -14,6 +15,11 @@ app.include_router(
     prefix="/api",
     tags=["Inference"]
 )
+app.include_router(
+    jobs_router,
+    prefix="/api",
+    tags=["Jobs"]
+)
 
 # Prometheus metrics endpoint
 metrics_app = make_asgi_app()
@@ -0,0 +1,49 @@
+import numpy as np
+from src.generation.buckets import bucket_lengths
+
+
+def sequence_buckets(max_seq_len, min_len=64):
+    """
+    Row lengths sequences are padded to when batched by length: powers of
+    two from min_len up to max_seq_len, so at most that many input shapes
+    are ever traced.
+    """
+    return bucket_lengths(max_seq_len, min_len)
+
+
+def assign_buckets(lengths, buckets):
+    """
+    Bucket (row length) of each sequence: the smallest that fits it; longer
+    sequences are truncated to the largest.
+    """
+    buckets = np.asarray(buckets)
+    lengths = np.minimum(np.asarray(lengths), buckets[-1])
+    return buckets[np.searchsorted(buckets, lengths)]
+
+
+def bucket_batches(lengths, buckets, batch_size, rng=None):
+    """
+    One epoch of [(bucket, sequence indexes), ...] batches, each drawn from
+    a single bucket. With rng (np.random.Generator or np.random), sequences
+    are shuffled within buckets and batches across buckets; else in order.
+    """
+    assigned = assign_buckets(lengths, buckets)
+    batches = []
+    for bucket in buckets:
+        members = np.flatnonzero(assigned == bucket)
+        if rng is not None:
+            members = rng.permutation(members)
+        batches += [(bucket, members[i:i + batch_size]) for i in range(0, len(members), batch_size)]
+    if rng is not None:
+        batches = [batches[i] for i in rng.permutation(len(batches))]
+    return batches
+
+
+def padded_tokens(lengths, max_seq_len, buckets=None):
+    """
+    (real tokens, padding tokens) in one epoch of rows padded to
+    max_seq_len, or to each sequence's bucket.
+    """
+    lengths = np.minimum(np.asarray(lengths, dtype=np.int64), max_seq_len)
+    rows = assign_buckets(lengths, buckets) if buckets else np.full(len(lengths), max_seq_len)
+    return int(lengths.sum()), int((rows - lengths).sum())
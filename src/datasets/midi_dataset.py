@@ -1,19 +1,211 @@
 import os
+import itertools
 import numpy as np
+import tensorflow as tf
 from tensorflow.keras.utils import Sequence
 from pathlib import Path
+from src.preprocessing.token_store import TokenStore, is_token_store
+from src.datasets.packing import SAMPLING_MODES, random_windows, packed_rows, split_packed, padding_fraction
+from src.datasets.bucketing import bucket_batches, padded_tokens
+
+
+def load_sequences(tokens_path, data_file):
+    """
+    Token sequences [num_sequences, max_seq_len]: a memory-mapped TokenStore
+    when one exists for data_file (train.npz -> train/, see
+    src/preprocessing/token_store.py), else the arrays of the .npz file.
+    """
+    store_path = Path(tokens_path) / Path(data_file).with_suffix("")
+    if is_token_store(store_path):
+        return TokenStore(store_path)
+
+    dataset_file = Path(tokens_path) / data_file
+    if not os.path.exists(dataset_file):
+        raise FileNotFoundError(f"{dataset_file} not found.")
+
+    loaded = np.load(dataset_file, allow_pickle=True)
+    return loaded["x"]
+
+
+def sequence_lengths(sequences):
+    """
+    True (unpadded) length of each sequence: from the token store index, or
+    from the trailing padding of a padded array (computed in memory, the
+    data folder may be read-only).
+    """
+    if isinstance(sequences, TokenStore):
+        return sequences.lengths()
+    real = sequences != 0
+    return np.where(real.any(axis=1), sequences.shape[1] - np.argmax(real[:, ::-1], axis=1), 0)
+
+
+def load_lengths(tokens_path, data_file):
+    """
+    True length of each sequence of data_file (see sequence_lengths).
+    """
+    return sequence_lengths(load_sequences(tokens_path, data_file))
+
+
+def epoch_tokens(tokens_path, data_file, max_seq_len, sampling="pad", buckets=None):
+    """
+    (real tokens, padding tokens) in one epoch of build_dataset rows.
+    """
+    lengths = load_lengths(tokens_path, data_file)
+    if sampling == "pad":
+        return padded_tokens(lengths, max_seq_len, buckets)
+    fraction, rows = padding_fraction(lengths, max_seq_len, sampling)
+    padding = round(rows * max_seq_len * fraction)
+    return rows * max_seq_len - padding, padding
+
+
+def split_inputs_targets(batch):
+    """
+    (X, y) shift-by-one pairs of a batch of sequences.
+    """
+    return batch[:, :-1], batch[:, 1:]
+
+
+def build_sampled_dataset(store, batch_size, sampling, max_seq_len=None, shuffle=True,
+                          shuffle_buffer=None, seed=None):
+    """
+    tf.data pipeline over the variable-length pieces of a token store, in
+    rows of max_seq_len tokens (default: the store's max_seq_len):
+    "windows" : random windows of each piece, redrawn every epoch
+                (yields (X, y))
+    "packed"  : pieces concatenated with separators and cut into rows,
+                (yields ((X, segment_ids), y), see packing.py)
+    Without shuffle (validation) the rows are the same every epoch.
+    """
+    window = max_seq_len or store.max_seq_len
+    epochs = itertools.count()
+
+    def rows():
+        epoch = next(epochs)
+        if shuffle:
+            rng = np.random.default_rng(None if seed is None else [seed, epoch])
+            order = rng.permutation(len(store))
+        else:
+            rng = np.random.default_rng(0)
+            order = np.arange(len(store))
+        if sampling == "windows":
+            yield from random_windows(store, window, order, rng)
+        else:
+            yield from packed_rows(store, window, order)
+
+    row_spec = tf.TensorSpec((window,), tf.int32)
+    if sampling == "windows":
+        dataset = tf.data.Dataset.from_generator(rows, output_signature=row_spec)
+        parse = split_inputs_targets
+    else:
+        dataset = tf.data.Dataset.from_generator(rows, output_signature=(row_spec, row_spec))
+        parse = lambda tokens, segment_ids: split_packed(tokens, segment_ids, store.pad_token)
+    # Same number of rows every epoch: lets Keras size the epoch
+    _, num_rows = padding_fraction(store.lengths(), window, sampling)
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(num_rows))
+    if shuffle:
+        # Rows of one piece come out together: mix them across pieces
+        dataset = dataset.shuffle(shuffle_buffer or 1024, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(parse, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def build_bucketed_dataset(sequences, lengths, batch_size, buckets, shuffle=True, seed=None):
+    """
+    tf.data pipeline of (X, y) batches of sequences of similar length, each
+    padded only to its bucket (see bucketing.py); batches are planned per
+    epoch, and read from the array / memory-mapped store in the map.
+    """
+    epochs = itertools.count()
+
+    def batches():
+        epoch = next(epochs)
+        rng = np.random.default_rng(None if seed is None else [seed, epoch]) if shuffle else None
+        yield from bucket_batches(lengths, buckets, batch_size, rng)
+
+    def read(bucket, indexes):
+        return sequences[indexes][:, :bucket].astype(np.int32)
+
+    def read_batch(bucket, indexes):
+        batch = tf.numpy_function(read, [bucket, indexes], tf.int32)
+        return split_inputs_targets(tf.ensure_shape(batch, (None, None)))
+
+    dataset = tf.data.Dataset.from_generator(batches, output_signature=(
+        tf.TensorSpec((), tf.int32), tf.TensorSpec((None,), tf.int64)))
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(
+        len(bucket_batches(lengths, buckets, batch_size))))
+    dataset = dataset.map(read_batch, num_parallel_calls=tf.data.AUTOTUNE,
+                          deterministic=seed is not None or not shuffle)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def build_dataset(tokens_path, data_file, batch_size, shuffle=True,
+                  shuffle_buffer=None, seed=None, sampling="pad", max_seq_len=None,
+                  buckets=None):
+    """
+    tf.data pipeline yielding the same (X, y) batches as MidiDataset:
+    shuffled through a buffer, split in a parallel map and prefetched
+    while the model trains.
+    shuffle_buffer : sequences in the shuffle buffer (None: the whole dataset)
+    seed           : fixed seed for a reproducible (and deterministic) order
+    sampling       : "pad" (each sequence padded / truncated to max_seq_len),
+                     or "windows" / "packed" (token stores only, see
+                     build_sampled_dataset)
+    max_seq_len    : row length for "windows" / "packed" (default: the store's)
+    buckets        : row lengths (e.g. bucketing.sequence_buckets) to batch
+                     "pad" sequences by length, each batch padded only to
+                     its bucket (see build_bucketed_dataset)
+    A token store is never loaded whole: sequence indexes are shuffled and
+    each batch is read from the memory-mapped shards in the map.
+    """
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f"sampling must be one of {SAMPLING_MODES}, got {sampling}")
+    sequences = load_sequences(tokens_path, data_file)
+    if sampling != "pad":
+        if not isinstance(sequences, TokenStore):
+            raise ValueError(f"sampling '{sampling}' needs a token store of unpadded pieces "
+                             f"(see src/preprocessing/token_store.py), not {data_file}")
+        if buckets:
+            raise ValueError("buckets only apply to 'pad' sampling")
+        return build_sampled_dataset(sequences, batch_size, sampling, max_seq_len, shuffle,
+                                     shuffle_buffer, seed)
+    if buckets:
+        return build_bucketed_dataset(sequences, sequence_lengths(sequences), batch_size,
+                                      buckets, shuffle, seed)
+
+    if isinstance(sequences, TokenStore):
+        def read_batch(indexes):
+            batch = tf.numpy_function(sequences.__getitem__, [indexes], tf.int32)
+            return split_inputs_targets(tf.ensure_shape(batch, (None, sequences.max_seq_len)))
+
+        dataset = tf.data.Dataset.range(len(sequences))
+        parse = read_batch
+    else:
+        # Already in memory: nothing to gain from a tf.data cache
+        dataset = tf.data.Dataset.from_tensor_slices(sequences)
+        parse = split_inputs_targets
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer or len(sequences), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(parse, num_parallel_calls=tf.data.AUTOTUNE,
+                          deterministic=seed is not None or not shuffle)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
 class MidiDataset(Sequence):
     """
     Keras Sequence for loading MIDI tokenized sequences.
     """
 
-    def __init__(self, tokens_path,  data_file, batch_size, max_seq_len, shuffle=True, **kwargs):
+    def __init__(self, tokens_path,  data_file, batch_size, max_seq_len, shuffle=True, buckets=None, **kwargs):
         """
         Initialize the dataset.
-        tokens_path : path to folder containing dataset.npz and vocab.json
+        tokens_path : path to folder containing dataset.npz (or its token store, see load_sequences)
         batch_size  : number of sequences per batch
         max_seq_len : maximum sequence length (padding)
         shuffle     : whether to shuffle data each epoch
+        buckets     : row lengths to batch sequences by length, each batch
+                      padded only to its bucket (see bucketing.py)
         """
         super().__init__(**kwargs)
         self.tokens_path = tokens_path
@@ -21,39 +213,41 @@ class MidiDataset(Sequence):
         self.batch_size = batch_size
         self.max_seq_len = max_seq_len
         self.shuffle = shuffle
+        self.buckets = buckets
 
         # Load dataset
         self.data = self._load_dataset()
         self.indexes = np.arange(len(self.data))
+        if self.buckets:
+            self.lengths = sequence_lengths(self.data)
+            self.batches = bucket_batches(self.lengths, self.buckets, self.batch_size,
+                                          np.random if self.shuffle else None)
         if self.shuffle:
             np.random.shuffle(self.indexes)
 
     def _load_dataset(self):
-        dataset_file = Path(self.tokens_path) / self.data_file
-        if not os.path.exists(dataset_file):
-            raise FileNotFoundError(f"{dataset_file} not found.")
-        
-        loaded = np.load(dataset_file, allow_pickle=True)
-        sequences = loaded["x"]
-
-        return sequences
+        return load_sequences(self.tokens_path, self.data_file)
                         
     def __len__(self):
+        if self.buckets:
+            return len(self.batches)
         return int(np.ceil(len(self.data) / self.batch_size))
 
     def __getitem__(self, idx):
         """
         Generate one batch of data
         """
+        if self.buckets:
+            bucket, batch_indexes = self.batches[idx]
+            return split_inputs_targets(self.data[batch_indexes][:, :bucket])
         batch_indexes = self.indexes[idx * self.batch_size:(idx + 1) * self.batch_size]
-        batch_sequences = self.data[batch_indexes]
-        X = batch_sequences[:, :-1]
-        y = batch_sequences[:, 1:]
-        return X, y
+        return split_inputs_targets(self.data[batch_indexes])
 
     def on_epoch_end(self):
         """
-        Shuffle indexes after each epoch
+        Shuffle indexes (and bucketed batches) after each epoch
         """
+        if self.shuffle and self.buckets:
+            self.batches = bucket_batches(self.lengths, self.buckets, self.batch_size, np.random)
         if self.shuffle:
             np.random.shuffle(self.indexes)
@@ -0,0 +1,120 @@
+import argparse
+import numpy as np
+import tensorflow as tf
+from midi_neural_processor.processor import START_IDX, RANGE_VEL
+from src.preprocessing.token_store import TokenStore
+
+# First id after the event vocabulary: ends each piece in packed sequences
+SEP_TOKEN = START_IDX["velocity"] + RANGE_VEL
+
+SAMPLING_MODES = ("pad", "windows", "packed")
+
+
+def window_starts(length, window, rng):
+    """
+    Start offsets of the random windows drawn from one piece in an epoch:
+    one per window tokens of the piece (rounded up), or a single window at 0
+    when the piece is not longer than a window.
+    """
+    if length <= window:
+        return np.zeros(1, dtype=np.int64)
+    return rng.integers(0, length - window + 1, size=-(-length // window))
+
+
+def random_windows(store, window, order, rng):
+    """
+    Yields int32 rows of window tokens: random windows of the pieces of
+    the store, in order (shorter pieces are padded).
+    """
+    for i in order:
+        tokens = store.sequence(i)
+        for start in window_starts(len(tokens), window, rng):
+            row = np.full(window, store.pad_token, dtype=np.int32)
+            piece = tokens[start:start + window]
+            row[:len(piece)] = piece
+            yield row
+
+
+def packed_rows(store, window, order, sep_token=SEP_TOKEN):
+    """
+    Yields (tokens, segment_ids) int32 rows of window tokens: the pieces in
+    order, each followed by sep_token, concatenated and cut every window
+    tokens. Neighbouring pieces get different segment ids (a piece cut at
+    the end of a row continues at the start of the next); the padding of
+    the last row is a segment of its own.
+    """
+    def new_row():
+        return np.full(window, store.pad_token, dtype=np.int32), np.zeros(window, dtype=np.int32)
+
+    tokens, segments = new_row()
+    filled = 0
+    segment = 0
+    for i in order:
+        piece = np.append(store.sequence(i), sep_token)
+        while len(piece):
+            n = min(window - filled, len(piece))
+            tokens[filled:filled + n] = piece[:n]
+            segments[filled:filled + n] = segment
+            filled += n
+            piece = piece[n:]
+            if filled == window:
+                yield tokens, segments
+                tokens, segments = new_row()
+                filled = 0
+        segment += 1
+    if filled:
+        segments[filled:] = segment
+        yield tokens, segments
+
+
+def split_packed(tokens, segment_ids, pad_token=0):
+    """
+    ((X, segment_ids), y) shift-by-one pairs of a packed batch. Targets that
+    cross into another segment (the piece after a separator, or padding)
+    are set to pad_token, so the loss ignores them.
+    """
+    targets = tf.where(segment_ids[:, :-1] == segment_ids[:, 1:], tokens[:, 1:], pad_token)
+    return (tokens[:, :-1], segment_ids[:, :-1]), targets
+
+
+def padding_fraction(lengths, window, sampling):
+    """
+    Fraction of the tokens of an epoch that are padding, and the number of
+    rows of window tokens, for pieces of the given lengths.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if sampling == "pad":
+        rows = len(lengths)
+        tokens = np.minimum(lengths, window).sum()
+    elif sampling == "windows":
+        counts = np.maximum(-(-lengths // window), 1)
+        rows = counts.sum()
+        tokens = np.where(lengths > window, counts * window, lengths).sum()
+    elif sampling == "packed":
+        tokens = (lengths + 1).sum()
+        rows = -(-tokens // window)
+    else:
+        raise ValueError(f"sampling must be one of {SAMPLING_MODES}, got {sampling}")
+    return (float(1.0 - tokens / (rows * window)) if rows else 0.0), int(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Padding per sampling mode for the pieces of a token store")
+    parser.add_argument("stores", nargs="+", help="e.g. data/processed/tokens/gnawa/train")
+    parser.add_argument("--max-seq-len", type=int, default=None, help="defaults to the store's max_seq_len")
+    args = parser.parse_args()
+
+    for path in args.stores:
+        store = TokenStore(path)
+        window = args.max_seq_len or store.max_seq_len
+        lengths = store.lengths()
+        print(f"{path}: {len(store)} pieces, {lengths.sum()} tokens, median {int(np.median(lengths))}, "
+              f"window {window}")
+        print(f"{'sampling':<9} {'rows/epoch':>11} {'padding':>8} {'tokens/epoch':>13}")
+        for sampling in SAMPLING_MODES:
+            fraction, rows = padding_fraction(lengths, window, sampling)
+            print(f"{sampling:<9} {rows:>11} {fraction:>8.1%} {round(rows * window * (1 - fraction)):>13}")
+
+
+if __name__ == "__main__":
+    main()
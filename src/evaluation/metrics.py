@@ -2,6 +2,12 @@ import numpy as np
 from collections import Counter
 from midi_neural_processor import processor 
 
+def is_note_on(token):
+    return processor.START_IDX["note_on"] <= token < processor.START_IDX["note_off"]
+
+def is_time_shift(token):
+    return processor.START_IDX["time_shift"] <= token < processor.START_IDX["velocity"]
+
 def token_entropy(tokens):
     """
     Measure diversity of generated tokens (entropy).
@@ -17,7 +23,7 @@ def pitch_range(tokens):
     """
     Compute pitch range from note_on tokens.
     """
-    pitches = [processor.get_pitch(t) for t in tokens if processor.is_note_on(t)]
+    pitches = [t - processor.START_IDX["note_on"] for t in tokens if is_note_on(t)]
     if not pitches:
         return 0
     return max(pitches) - min(pitches)
@@ -26,8 +32,8 @@ def note_density(tokens):
     """
     Compute approximate note density: notes per time_shift token.
     """
-    note_count = sum(1 for t in tokens if processor.is_note_on(t))
-    time_shift_count = sum(1 for t in tokens if processor.is_time_shift(t))
+    note_count = sum(1 for t in tokens if is_note_on(t))
+    time_shift_count = sum(1 for t in tokens if is_time_shift(t))
     return note_count / max(1, time_shift_count)
 
 def evaluate_tokens(tokens):
@@ -35,7 +41,7 @@ def evaluate_tokens(tokens):
     Aggregate metrics for a token sequence.
     """
     return {
-        "entropy": token_entropy(tokens),
+        "entropy": float(token_entropy(tokens)),
         "pitch_range": pitch_range(tokens),
         "note_density": note_density(tokens),
         "num_tokens": len(tokens)
@@ -0,0 +1,91 @@
+from collections import Counter
+import numpy as np
+import tensorflow as tf
+from src.monitoring.generation_metrics import GRAPH_TRACES
+
+# Traces per generation graph in this process (also exported to Prometheus)
+TRACE_COUNTS = Counter()
+
+
+def count_trace(name):
+    """
+    Record a tf.function trace. Call from inside a traced function:
+    Python code only runs while tracing, not on graph executions.
+    """
+    TRACE_COUNTS[name] += 1
+    GRAPH_TRACES.labels(function=name).inc()
+
+
+def bucket_lengths(max_seq_len, min_len=16):
+    """
+    Powers of two from min_len, capped by (and including) max_seq_len.
+    """
+    buckets = []
+    length = min_len
+    while length < max_seq_len:
+        buckets.append(length)
+        length *= 2
+    buckets.append(max_seq_len)
+    return buckets
+
+
+def bucket_for(length, buckets):
+    """
+    Smallest bucket that fits length.
+    """
+    for bucket in buckets:
+        if length <= bucket:
+            return bucket
+    raise ValueError(f"sequence of length {length} exceeds the largest bucket {buckets[-1]}")
+
+
+class BucketedPrefill:
+    """
+    Prompt prefill with inputs padded to a fixed set of lengths.
+    Each bucket has its own input_signature, so the number of traces is
+    bounded by the number of buckets whatever the prompt lengths.
+    Padding goes after the prompt: with causal attention it cannot affect
+    the real positions, and its cache entries are overwritten by decoding.
+    """
+
+    def __init__(self, model, buckets):
+        self.model = model
+        self.buckets = buckets
+        self._functions = {
+            bucket: tf.function(
+                self._prefill,
+                input_signature=[
+                    tf.TensorSpec((None, bucket), tf.int32),
+                    tf.TensorSpec((None,), tf.int32),
+                ],
+            )
+            for bucket in buckets
+        }
+
+    def _prefill(self, tokens, lengths):
+        count_trace("prefill")
+        logits, cache = self.model.prefill(tokens)
+        # Logits at each row's real last position
+        last_logits = tf.gather(logits, lengths - 1, axis=1, batch_dims=1)
+        return last_logits, cache
+
+    def trace_all(self):
+        """
+        Trace every bucket ahead of time (e.g. at server startup).
+        """
+        for function in self._functions.values():
+            function.get_concrete_function()
+
+    def __call__(self, tokens):
+        """
+        tokens : [batch, seq_len] prompt ids (same length per row)
+        Returns the last-position logits [batch, vocab] and the KV cache.
+        """
+        tokens = np.asarray(tokens, dtype=np.int32)
+        batch_size, length = tokens.shape
+        bucket = bucket_for(length, self.buckets)
+
+        padded = np.zeros((batch_size, bucket), dtype=np.int32)
+        padded[:, :length] = tokens
+        lengths = np.full((batch_size,), length, dtype=np.int32)
+        return self._functions[bucket](tf.constant(padded), tf.constant(lengths))
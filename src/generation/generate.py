@@ -1,111 +1,471 @@
 import os
+import io
+import hashlib
+from collections import deque
 import numpy as np
 import tensorflow as tf
 import time
-from src.models.transformer_decoder import TransformerDecoder
+from src.generation.model_registry import get_model, file_checksum
 import midi_neural_processor.processor as midi_tokenizer
-from src.generation.sampler import sample_next_token
+from src.generation.sampler import sample_next_token, sample_next_tokens
+from src.generation.midi_stream import MidiStreamWriter
+from src.generation.speculative import SpeculativeDecoder
+from src.generation.seed_cache import get_seed_cache
+from src.generation.result_cache import get_result_cache, request_fingerprint
+from src.generation.stopping import StopCriteria, until_stopped
 
-def generate_music(model_path, config, gen_file, max_duration=30.0):
+def iter_tokens(loaded, prompt_tokens, max_tokens, temperature=1.0,
+                top_k=None, top_p=None, vocab_size=None, stride=1, prefix_state=None, rng=None):
     """
-    Generate a MIDI file.
+    Autoregressively sample max_tokens after prompt_tokens.
+    Yields each sampled token as soon as it is available.
+    stride       : once the context window is full, re-encode it every `stride`
+                   tokens (keeping the last max_seq_len - stride + 1 tokens) and
+                   use cached single-token steps in between; 1 re-encodes the
+                   full window on every token.
+    prefix_state : (logits, cache) already computed for the prompt
+                   (e.g. from SeedCache); skips the prompt prefill.
+    rng          : np.random.Generator for the draws (fresh entropy if None)
     """
-    start_time = time.time()
-    
-    # Config
-    output_midi_dir = config.get("output", {}).get("midi_dir", "generated_midis")
-    max_seq_len = config["data"]["max_seq_len"]
+    vocab_size = vocab_size or loaded.model.vocab_size
+    rng = rng if rng is not None else np.random.default_rng()
     
-    vocab_size = config["data"].get("vocab_size", max_seq_len + 1)
+    # Cached decoding: the prompt is encoded once, then each step
+    # only runs the newest token through the model.
+    max_seq_len = loaded.model.max_seq_len
+    prefill_step = loaded.prefill
+    decode_step = loaded.decode_step
     
-    seed_midi_path = config["generation"]["seed_midi_path"]
+    # Only the context window is kept, so memory does not grow with the piece
+    generated = deque(prompt_tokens, maxlen=max_seq_len)
+    tokens_generated = 0
+    keep = max_seq_len - max(1, min(stride, max_seq_len)) + 1
     
-    model_load_start = time.time()
+    prompt = list(generated)
+    logits, cache = prefix_state or prefill_step([prompt])
+    next_logits = np.asarray(logits[0])
+    position = len(prompt)
     
-    try:
-        model = tf.keras.models.load_model(
-            model_path,
-            compile=False,
-            custom_objects={'TransformerDecoder': TransformerDecoder}
+    for i in range(max_tokens):
+        
+        # Sampling
+        next_id = sample_next_token(
+            next_logits,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            rng=rng,
         )
-    except:
-        model = tf.keras.models.load_model(model_path, compile=False)
+        
+        # Token validation
+        next_id = int(next_id)
+        if next_id >= vocab_size or next_id < 0:
+            next_id = int(rng.integers(1, vocab_size - 1))
+        
+        generated.append(next_id)
+        tokens_generated += 1
+        yield next_id
+        
+        if tokens_generated == max_tokens:
+            break
+        
+        # Prediction
+        if position < max_seq_len:
+            logits, cache = decode_step(
+                tf.constant([next_id], dtype=tf.int32),
+                cache,
+                tf.constant([position], dtype=tf.int32),
+            )
+            next_logits = np.asarray(logits[0])
+            position += 1
+        else:
+            # Context window is full: re-encode the most recent tokens,
+            # leaving room for stride - 1 cached steps
+            prompt = list(generated)[-keep:]
+            logits, cache = prefill_step([prompt])
+            next_logits = np.asarray(logits[0])
+            position = len(prompt)
+
+def sample_tokens(loaded, prompt_tokens, max_tokens, temperature=1.0,
+                  top_k=None, top_p=None, vocab_size=None, stride=1, prefix_state=None, rng=None):
+    """
+    Autoregressively sample max_tokens after prompt_tokens.
+    Returns the prompt followed by the sampled tokens.
+    """
+    return list(prompt_tokens) + list(iter_tokens(
+        loaded, prompt_tokens, max_tokens,
+        temperature=temperature, top_k=top_k, top_p=top_p,
+        vocab_size=vocab_size, stride=stride, prefix_state=prefix_state, rng=rng,
+    ))
+
+def sample_variations(loaded, prompt_tokens, num_samples, max_tokens, temperature=1.0,
+                      top_k=None, top_p=None, vocab_size=None, stride=1, seed=None,
+                      prefix_state=None, stopping=None, progress=None):
+    """
+    Sample num_samples independent continuations of the same prompt.
+    The prompt is encoded once (or prefix_state is reused); its cache is
+    copied to every row and the continuations are decoded together as one batch.
+    Returns one list (prompt followed by sampled tokens) per sample.
+    stopping : optional StopCriteria per sample; a stopped row takes no more
+               tokens and decoding ends once every row has stopped
+    progress : optional callable(done, total) called after each decoding step;
+               an exception it raises stops decoding
+    """
+    vocab_size = vocab_size or loaded.model.vocab_size
+    max_seq_len = loaded.model.max_seq_len
+    keep = max_seq_len - max(1, min(stride, max_seq_len)) + 1
+    rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(num_samples)]
     
-    model.trainable = False
+    generated = [list(prompt_tokens) for _ in range(num_samples)]
+    # Decoding context of every row; stopped rows keep decoding in step with
+    # the batch, their extra tokens are not part of the output
+    contexts = generated if stopping is None else [list(prompt_tokens) for _ in range(num_samples)]
+    prompt = list(prompt_tokens)[-max_seq_len:]
+    logits, cache = prefix_state or loaded.prefill([prompt])
+    next_logits = np.repeat(np.asarray(logits), num_samples, axis=0)
+    cache = loaded.repeat_cache(cache, num_samples)
+    position = len(prompt)
     
-    generated = []
+    for i in range(max_tokens):
+        next_ids = sample_next_tokens(
+            next_logits,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            uniforms=[rng.random() for rng in rngs],
+        )
+        for row, next_id in enumerate(next_ids):
+            next_id = int(next_id)
+            if next_id >= vocab_size or next_id < 0:
+                next_id = int(rngs[row].integers(1, vocab_size - 1))
+            contexts[row].append(next_id)
+            if stopping is not None and stopping[row].stop_reason is None:
+                if stopping[row].update(next_id) != "end_of_sequence":
+                    generated[row].append(next_id)
+        if progress is not None:
+            progress(i + 1, max_tokens)
+        
+        if i == max_tokens - 1:
+            break
+        if stopping is not None and all(criteria.stop_reason for criteria in stopping):
+            break
+        
+        # All rows share one length, so they reach the window limit together
+        if position < max_seq_len:
+            logits, cache = loaded.decode_step(
+                tf.constant([row[-1] for row in contexts], dtype=tf.int32),
+                cache,
+                tf.fill((num_samples,), position),
+            )
+            next_logits = np.asarray(logits)
+            position += 1
+        else:
+            logits, cache = loaded.prefill([row[-keep:] for row in contexts])
+            next_logits = np.asarray(logits)
+            position = keep
     
-    if seed_midi_path and os.path.exists(seed_midi_path):
-        print(f"Encoding seed MIDI: {seed_midi_path}")
+    return generated
+
+def has_seed(seed_midi):
+    """
+    True for non-empty seed MIDI bytes or the path of an existing seed file.
+    """
+    if isinstance(seed_midi, (bytes, bytearray)):
+        return len(seed_midi) > 0
+    return bool(seed_midi) and os.path.exists(seed_midi)
+
+def open_seed(seed_midi):
+    """
+    Something pretty_midi can read: the path itself, or a buffer over seed bytes.
+    """
+    if isinstance(seed_midi, (bytes, bytearray)):
+        return io.BytesIO(seed_midi)
+    return seed_midi
+
+def seed_digest(seed_midi_path):
+    """
+    Content hash of a seed (file path or MIDI bytes), None without a usable seed.
+    """
+    if not has_seed(seed_midi_path):
+        return None
+    if isinstance(seed_midi_path, (bytes, bytearray)):
+        return hashlib.sha256(seed_midi_path).hexdigest()
+    return file_checksum(seed_midi_path)
+
+def encode_seed(seed_midi_path, max_seq_len, vocab_size, rng=None):
+    """
+    Prompt tokens from a seed MIDI (last max_seq_len tokens),
+    or a single random token (drawn from rng) when there is no usable seed.
+    seed_midi_path : path of the seed MIDI file, or its bytes
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    if has_seed(seed_midi_path):
+        if isinstance(seed_midi_path, str):
+            print(f"Encoding seed MIDI: {seed_midi_path}")
         try:
-            seed_tokens = midi_tokenizer.encode_midi(seed_midi_path)
+            seed_tokens = midi_tokenizer.encode_midi(open_seed(seed_midi_path))
             generated = seed_tokens[-max_seq_len:].copy() if len(seed_tokens) > max_seq_len else seed_tokens.copy()
             print(f"   Using {len(generated)} seed tokens")
+            return generated
         except Exception as e:
             print(f"error encoding seed MIDI: {e}")
-            generated = [np.random.randint(1, vocab_size - 1)]
+            return [int(rng.integers(1, vocab_size - 1))]
+    
+    print("No seed MIDI, starting with random token")
+    return [int(rng.integers(1, vocab_size - 1))]
+
+def encode_prompt(seed_midi_path, max_seq_len, vocab_size, seed_cache=None, rng=None):
+    """
+    encode_seed through the content-addressed seed cache, when given.
+    Returns the prompt tokens and the seed's content key (None when not cached).
+    """
+    if seed_cache is None or not has_seed(seed_midi_path):
+        return encode_seed(seed_midi_path, max_seq_len, vocab_size, rng), None
+    
+    try:
+        seed_key, seed_tokens = seed_cache.tokens(seed_midi_path)
+    except Exception as e:
+        print(f"error encoding seed MIDI: {e}")
+        return encode_seed(None, max_seq_len, vocab_size, rng), None
+    return seed_tokens[-max_seq_len:], seed_key
+
+def cached_prefix_state(loaded, prompt, seed_key, seed_cache):
+    """
+    Prefill state of a cached seed's prompt, or None (prefilled as usual).
+    """
+    if seed_key is None:
+        return None
+    return seed_cache.prefix_state(seed_key, loaded, prompt)
+
+def save_midi(tokens, output_midi_dir, gen_file):
+    """
+    Decode tokens and write them as a MIDI file. Returns the file path.
+    """
+    midi_data = midi_tokenizer.decode_midi(tokens)
+    
+    os.makedirs(output_midi_dir, exist_ok=True)
+    output_path = os.path.join(output_midi_dir, gen_file)
+    
+    if not output_path.lower().endswith(('.mid', '.midi')):
+        output_path += '.mid'
+    
+    midi_data.write(output_path)
+    return output_path
+
+def midi_bytes(tokens):
+    """
+    Decode tokens to Standard MIDI File bytes, in memory.
+    """
+    buffer = io.BytesIO()
+    midi_tokenizer.decode_midi(tokens).write(buffer)
+    return buffer.getvalue()
+
+def report_progress(tokens, total, progress=None):
+    """
+    Pass tokens through, calling progress(done, total) after each one.
+    """
+    for done, token in enumerate(tokens, 1):
+        yield token
+        if progress is not None:
+            progress(done, total)
+
+def stop_criteria(config, max_duration=None, start_time=None):
+    """
+    StopCriteria for one request: the requested generation.length (capped by
+    max_new_tokens), generation.max_duration seconds of music (max_duration
+    overrides it), generation.time_budget seconds of wall clock counted from
+    start_time (time.monotonic()) and generation.eos_token.
+    """
+    generation = config["generation"]
+    max_new_tokens = generation.get("max_new_tokens", 2048)
+    if generation.get("length") is not None:
+        max_new_tokens = min(generation["length"], max_new_tokens)
+    if max_duration is None:
+        max_duration = generation.get("max_duration")
+    deadline = None
+    if generation.get("time_budget") is not None:
+        deadline = (start_time if start_time is not None else time.monotonic()) + generation["time_budget"]
+    return StopCriteria(max_new_tokens, max_duration, deadline, generation.get("eos_token"))
+
+def result_cache_key(config, loaded, criteria, disk_cache=True, **fields):
+    """
+    (result cache, request fingerprint) for a seeded request, or (None, None)
+    when the cache is disabled or the result is not reproducible (no seed).
+    criteria   : StopCriteria of the request (the deadline is not part of the key)
+    disk_cache : False for the memory tier only
+    fields     : what else determines the result (decoding path, sample count, ...)
+    """
+    result_cache = get_result_cache(config)
+    seed = config["generation"].get("seed")
+    if result_cache is None or seed is None or not loaded.checksum:
+        return None, None
+    if not disk_cache:
+        result_cache = result_cache.memory_only()
+    return result_cache, request_fingerprint(
+        model=loaded.checksum,
+        seed_midi=seed_digest(config["generation"]["seed_midi_path"]),
+        max_new_tokens=criteria.max_new_tokens,
+        max_duration=criteria.max_duration,
+        eos_token=criteria.eos_token,
+        temperature=config["generation"].get("temperature", 1.0),
+        top_k=config["generation"].get("top_k", 50),
+        top_p=config["generation"].get("top_p", 0.9),
+        seed=seed,
+        context_stride=config["generation"].get("context_stride", 1),
+        precision=config["generation"].get("precision", "float32"),
+        **fields,
+    )
+
+def generate_tokens(model_path, config, max_duration=None, scheduler=None, progress=None, disk_cache=True):
+    """
+    Generate tokens after the configured seed (a file path or MIDI bytes).
+    Returns (the prompt followed by the generated tokens, stop reason).
+    Generation stops at the first limit reached (see stop_criteria):
+    "length", "duration" (seconds of music), "deadline" (time budget)
+    or "end_of_sequence".
+    max_duration : seconds of music, overrides generation.max_duration
+    scheduler : optional BatchScheduler to batch with concurrent requests
+    progress  : optional callable(done, total) called as tokens are generated
+                (per token, except on the graph engine where it is called once
+                at the end); an exception it raises stops generation
+    disk_cache : False to use only the memory tier of the seed and result
+                 caches (nothing read from or written to their cache_dir)
+    generation.seed in the config makes the result reproducible (for a given
+    engine); without it every call draws fresh entropy.
+    """
+    # The time budget covers everything from here, model loading included
+    criteria = stop_criteria(config, max_duration, time.monotonic())
+    
+    # Config
+    max_seq_len = config["data"]["max_seq_len"]
+    
+    vocab_size = config["data"].get("vocab_size", max_seq_len + 1)
+    
+    seed_midi_path = config["generation"]["seed_midi_path"]
+    
+    backend = config["generation"].get("backend", "keras")
+    if backend == "tflite":
+        # Exported (quantized) CPU model; runs the eager sampling loop only
+        model_path = config["generation"]["tflite_path"]
+        scheduler = None
+    
+    # Warm model and traced functions, loaded once per process and precision
+    precision = config["generation"].get("precision", "float32")
+    if scheduler is not None:
+        # The model the scheduler will decode this request on: cache keys
+        # and the prompt state below must come from it
+        loaded = scheduler.model()
     else:
-        generated = [np.random.randint(1, vocab_size - 1)]
-        print("No seed MIDI, starting with random token")
+        loaded = get_model(model_path, precision)
     
     # Generation parametres
     temperature = config["generation"].get("temperature", 1.0)
     top_k = config["generation"].get("top_k", 50)
     top_p = config["generation"].get("top_p", 0.9)
+    seed = config["generation"].get("seed")
     
-    @tf.function
-    def predict_step(input_tensor):
-        return model(input_tensor, training=False)
+    max_tokens = criteria.max_new_tokens
     
-    print("🎹 Generating music...")
+    engine = config["generation"].get("engine", "eager") if backend == "keras" else "eager"
+    draft_config = config.get("draft_model", {})
+    speculative = backend == "keras" and draft_config.get("enabled", False) and os.path.exists(draft_config["path"])
     
-    tokens_per_second = 15
-    max_tokens = int(max_duration * tokens_per_second)
-    tokens_generated = 0
+    # Seeded requests are deterministic: identical ones reuse the stored result
+    result_cache, result_key = result_cache_key(
+        config, loaded, criteria, disk_cache,
+        # Each decoding path consumes the RNG differently
+        decoder="batched" if scheduler is not None else "speculative" if speculative else engine,
+        draft_model=get_model(draft_config["path"], precision).checksum if speculative else None,
+    )
+    if result_key is not None:
+        cached = result_cache.get(result_key)
+        if cached is not None:
+            print("Result cache hit, skipping generation")
+            if progress is not None:
+                progress(max_tokens, max_tokens)
+            samples, stop_reasons = cached
+            return samples[0], stop_reasons[0]
     
-    estimated_time_per_token = 0.1
+    # Per-request RNG: nothing below touches the global numpy state
+    rng = np.random.default_rng(seed)
     
-    for i in range(max_tokens):
-        
-        if len(generated) > max_seq_len:
-            input_seq = generated[-max_seq_len:]
-        else:
-            input_seq = generated
-        
-        input_tensor = tf.constant([input_seq], dtype=tf.int32)
-        
-        # Prediction
-        logits = predict_step(input_tensor)
-        next_logits = logits[0, -1].numpy()
-        
-        # Sampling
-        next_id = sample_next_token(
-            next_logits,
-            temperature=temperature,
-            top_k=top_k,
-            top_p=top_p,
+    # Known seeds skip tokenization (and prefill below) through the seed cache
+    seed_cache = get_seed_cache(config)
+    if seed_cache is not None and not disk_cache:
+        seed_cache = seed_cache.memory_only()
+    generated, seed_key = encode_prompt(seed_midi_path, max_seq_len, vocab_size, seed_cache, rng)
+    
+    print("🎹 Generating music...")
+    
+    if scheduler is not None:
+        # Batched with concurrent requests; the row frees its slot once criteria stops it
+        generated = scheduler.submit(
+            generated, max_tokens,
+            temperature=temperature, top_k=top_k, top_p=top_p,
+            seed=int(rng.integers(2**31 - 1)),
+            prefix_state=cached_prefix_state(loaded, generated, seed_key, seed_cache),
+            stop=criteria,
+            progress=progress,
+            loaded=loaded,
+        ).result()
+    elif speculative:
+        # Small draft model proposes tokens, the main model verifies them in one pass
+        decoder = SpeculativeDecoder(
+            loaded, get_model(draft_config["path"], precision),
+            num_speculative_tokens=draft_config.get("num_speculative_tokens", 4),
+            stride=config["generation"].get("context_stride", 1),
         )
-        
-        # Token validation
-        next_id = int(next_id)
-        if next_id >= vocab_size or next_id < 0:
-            next_id = np.random.randint(1, vocab_size - 1)
-        
-        generated.append(next_id)
-        tokens_generated += 1
+        generated = generated + list(report_progress(until_stopped(decoder.iter_tokens(
+            generated, max_tokens,
+            temperature=temperature, top_k=top_k, top_p=top_p, rng=rng,
+        ), criteria), max_tokens, progress))
+        print(f"Speculative acceptance rate: {decoder.acceptance_rate}")
+    elif engine == "graph":
+        # Whole decode loop in one compiled tf.function: it cannot be
+        # interrupted, duration and end of sequence are applied afterwards
+        generator = loaded.graph_generator(
+            jit_compile=config["generation"].get("jit_compile", False))
+        prompt_length = len(generated)
+        generated = generator.generate(
+            generated, max_tokens,
+            temperature=temperature, top_k=top_k, top_p=top_p,
+            seed=int(rng.integers(2**31 - 1)),
+            stride=config["generation"].get("context_stride", 1),
+        )
+        criteria.deadline = None
+        generated = generated[:prompt_length] + list(until_stopped(generated[prompt_length:], criteria))
+    else:
+        generated = generated + list(report_progress(until_stopped(iter_tokens(
+            loaded, generated, max_tokens,
+            temperature=temperature, top_k=top_k, top_p=top_p,
+            vocab_size=vocab_size,
+            stride=config["generation"].get("context_stride", 1),
+            prefix_state=cached_prefix_state(loaded, generated, seed_key, seed_cache),
+            rng=rng,
+        ), criteria), max_tokens, progress))
+    
+    print(f"Generation stopped: {criteria.stop_reason} "
+          f"({criteria.num_tokens} tokens, {criteria.duration:.1f} s of music)")
+    if progress is not None:
+        progress(max_tokens, max_tokens)
+    # A deadline stop depends on load, not on the request: do not reuse it
+    if result_key is not None and criteria.stop_reason != "deadline":
+        result_cache.put(result_key, [generated], [criteria.stop_reason])
+    
+    return generated, criteria.stop_reason
+
+def generate_music(model_path, config, gen_file, max_duration=None, scheduler=None, progress=None):
+    """
+    Generate a MIDI file (see generate_tokens for the arguments).
+    """
+    start_time = time.time()
+    output_midi_dir = config.get("output", {}).get("midi_dir", "generated_midis")
+    generated, _ = generate_tokens(model_path, config, max_duration, scheduler, progress)
     
     # 6. Decoding & Saving
     print("🎼 Decoding to MIDI...")
     try:
-        midi_data = midi_tokenizer.decode_midi(generated)
-        
-        os.makedirs(output_midi_dir, exist_ok=True)
-        output_path = os.path.join(output_midi_dir, gen_file)
-        
-        if not output_path.lower().endswith(('.mid', '.midi')):
-            output_path += '.mid'
-        
-        midi_data.write(output_path)
+        output_path = save_midi(generated, output_midi_dir, gen_file)
         
         total_time = time.time() - start_time
         print(f"Music generated and saved: {output_path}")
@@ -114,4 +474,99 @@ def generate_music(model_path, config, gen_file, max_duration=30.0):
         
     except Exception as e:
         print(f"error saving MIDI: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def generate_variations(model_path, config, gen_files, max_duration=None, progress=None):
+    """
+    Generate one MIDI file per name in gen_files, all continuing the same seed.
+    Returns a list of (midi_path, generated_tokens, stop_reason) triples.
+    progress : optional callable(done, total) called after each decoding step;
+               an exception it raises stops generation
+    """
+    start_time = time.monotonic()
+    output_midi_dir = config.get("output", {}).get("midi_dir", "generated_midis")
+    max_seq_len = config["data"]["max_seq_len"]
+    vocab_size = config["data"].get("vocab_size", max_seq_len + 1)
+    
+    if config["generation"].get("backend", "keras") == "tflite":
+        model_path = config["generation"]["tflite_path"]
+    loaded = get_model(model_path, config["generation"].get("precision", "float32"))
+    stopping = [stop_criteria(config, max_duration, start_time) for _ in gen_files]
+    max_tokens = stopping[0].max_new_tokens
+    rng = np.random.default_rng(config["generation"].get("seed"))
+    seed_cache = get_seed_cache(config)
+    prompt, seed_key = encode_prompt(
+        config["generation"]["seed_midi_path"], max_seq_len, vocab_size, seed_cache, rng)
+    
+    result_cache, result_key = result_cache_key(
+        config, loaded, stopping[0], decoder="variations", num_samples=len(gen_files))
+    cached = result_cache.get(result_key) if result_key is not None else None
+    if cached is not None:
+        print("Result cache hit, skipping generation")
+        if progress is not None:
+            progress(max_tokens, max_tokens)
+        samples, stop_reasons = cached
+    else:
+        print(f"🎹 Generating {len(gen_files)} variations...")
+        samples = sample_variations(
+            loaded, prompt, len(gen_files), max_tokens,
+            temperature=config["generation"].get("temperature", 1.0),
+            top_k=config["generation"].get("top_k", 50),
+            top_p=config["generation"].get("top_p", 0.9),
+            vocab_size=vocab_size,
+            stride=config["generation"].get("context_stride", 1),
+            seed=int(rng.integers(2**31 - 1)),
+            prefix_state=cached_prefix_state(loaded, prompt, seed_key, seed_cache),
+            stopping=stopping,
+            progress=progress,
+        )
+        stop_reasons = [criteria.stop_reason or "length" for criteria in stopping]
+        if result_key is not None and "deadline" not in stop_reasons:
+            result_cache.put(result_key, samples, stop_reasons)
+    
+    return [
+        (save_midi(tokens, output_midi_dir, gen_file), tokens[len(prompt):], stop_reason)
+        for tokens, gen_file, stop_reason in zip(samples, gen_files, stop_reasons)
+    ]
+
+def generate_long_form(model_path, config, gen_file, num_tokens):
+    """
+    Generate a long piece (beyond max_seq_len) straight to a MIDI file.
+    The context is re-encoded every `context_stride` tokens with cached steps
+    in between, and the MIDI is written as tokens arrive, so memory stays
+    bounded whatever num_tokens is.
+    """
+    output_midi_dir = config.get("output", {}).get("midi_dir", "generated_midis")
+    loaded = get_model(model_path, config["generation"].get("precision", "float32"))
+    rng = np.random.default_rng(config["generation"].get("seed"))
+    
+    seed_cache = get_seed_cache(config)
+    prompt, seed_key = encode_prompt(
+        config["generation"]["seed_midi_path"],
+        loaded.model.max_seq_len,
+        loaded.model.vocab_size,
+        seed_cache,
+        rng,
+    )
+    tokens = iter_tokens(
+        loaded, prompt, num_tokens,
+        temperature=config["generation"].get("temperature", 1.0),
+        top_k=config["generation"].get("top_k", 50),
+        top_p=config["generation"].get("top_p", 0.9),
+        stride=config["generation"].get("context_stride", 256),
+        prefix_state=cached_prefix_state(loaded, prompt, seed_key, seed_cache),
+        rng=rng,
+    )
+    
+    os.makedirs(output_midi_dir, exist_ok=True)
+    output_path = os.path.join(output_midi_dir, gen_file)
+    if not output_path.lower().endswith(('.mid', '.midi')):
+        output_path += '.mid'
+    
+    print(f"🎹 Generating {num_tokens} tokens to {output_path}...")
+    with MidiStreamWriter(output_path) as writer:
+        writer.write(prompt)
+        for token in tokens:
+            writer.write([token])
+    
+    return output_path
@@ -0,0 +1,121 @@
+import numpy as np
+import tensorflow as tf
+from src.generation.buckets import bucket_for, bucket_lengths, count_trace
+
+
+def filter_logits(logits, temperature, top_k, top_p):
+    """
+    Temperature, top-k and top-p filtering in TensorFlow.
+    logits      : [batch, vocab]
+    temperature : [batch] float
+    top_k       : [batch] int (0 disables)
+    top_p       : [batch] float (1.0 disables)
+    """
+    logits = logits / temperature[:, tf.newaxis]
+    vocab_size = tf.shape(logits)[-1]
+    neg_inf = tf.fill(tf.shape(logits), tf.constant(-np.inf, dtype=logits.dtype))
+
+    # Tokens by rank: filters keep a number of ranks, so tied logits
+    # cannot let more than top_k tokens through
+    sorted_logits, order = tf.math.top_k(logits, k=vocab_size)
+    ranks = tf.range(vocab_size)[tf.newaxis, :]
+
+    # top-k: keep the first k ranks
+    k = tf.where(top_k > 0, tf.minimum(top_k, vocab_size), vocab_size)
+    keep = ranks < k[:, tf.newaxis]
+    sorted_logits = tf.where(keep, sorted_logits, neg_inf)
+
+    # top-p on the top-k survivors; always keep at least one token
+    # (1.0 disables it: the cumulative sum can round above 1)
+    cumulative = tf.cumsum(tf.nn.softmax(sorted_logits, axis=-1), axis=-1)
+    nucleus = tf.logical_or(cumulative <= top_p[:, tf.newaxis], ranks == 0)
+    keep = tf.logical_and(keep, tf.logical_or(nucleus, top_p[:, tf.newaxis] >= 1.0))
+
+    # Back to vocabulary order
+    keep = tf.gather(keep, tf.argsort(order, axis=-1), batch_dims=1)
+    return tf.where(keep, logits, neg_inf)
+
+
+class GraphGenerator:
+    """
+    Autoregressive decoding inside one compiled tf.function.
+    Prefill, the sampling loop (tf.while_loop) and temperature/top-k/top-p
+    sampling all stay in the graph; generated ids are written into a
+    preallocated buffer and returned at once.
+    """
+
+    def __init__(self, model, jit_compile=False):
+        self.model = model
+        self.max_seq_len = model.max_seq_len
+        self.buckets = bucket_lengths(model.max_seq_len)
+        self._generate = tf.function(self._generate_fn, jit_compile=jit_compile)
+
+    def _generate_fn(self, prompt, prompt_len, num_tokens, temperature, top_k, top_p, seed):
+        count_trace("graph_generate")
+        logits, cache = self.model.prefill(prompt)
+        next_logits = tf.gather(logits, prompt_len - 1, axis=1)
+
+        buffer = tf.zeros((self.max_seq_len,), dtype=tf.int32)
+
+        def body(i, next_logits, cache, buffer):
+            filtered = filter_logits(next_logits, temperature, top_k, top_p)
+            step_seed = tf.random.experimental.stateless_fold_in(seed, i)
+            token = tf.random.stateless_categorical(
+                filtered, 1, seed=step_seed, dtype=tf.int32)[:, 0]
+            buffer = tf.tensor_scatter_nd_update(buffer, [[i]], token)
+
+            # A full window's last step runs at a clamped position: its logits are never sampled
+            position = tf.reshape(tf.minimum(prompt_len + i, self.max_seq_len - 1), (1,))
+            next_logits, cache = self.model.decode_step(token, cache, position)
+            return i + 1, next_logits, cache, buffer
+
+        _, _, _, buffer = tf.while_loop(
+            lambda i, *_: i < num_tokens,
+            body,
+            (tf.constant(0), next_logits, cache, buffer),
+        )
+        return buffer
+
+    def _run(self, prompt_tokens, num_tokens, temperature, top_k, top_p, seed):
+        # Pad the prompt to a bucket so prompts of similar length share a trace
+        prompt_len = len(prompt_tokens)
+        padded_len = bucket_for(prompt_len, self.buckets)
+        prompt = np.zeros((1, padded_len), dtype=np.int32)
+        prompt[0, :prompt_len] = prompt_tokens
+
+        buffer = self._generate(
+            tf.constant(prompt),
+            tf.constant(prompt_len, dtype=tf.int32),
+            tf.constant(num_tokens, dtype=tf.int32),
+            tf.constant([temperature], dtype=tf.float32),
+            tf.constant([top_k or 0], dtype=tf.int32),
+            tf.constant([top_p or 1.0], dtype=tf.float32),
+            tf.constant(seed, dtype=tf.int32),
+        )
+        return buffer.numpy()[:num_tokens].tolist()
+
+    def generate(self, prompt_tokens, max_tokens, temperature=1.0, top_k=None, top_p=None, seed=None,
+                 stride=1):
+        """
+        Returns the prompt followed by max_tokens sampled tokens.
+        stride : once the window is full, decoding restarts from the last
+                 max_seq_len - stride + 1 tokens, as in iter_tokens
+        """
+        if seed is None:
+            seed = np.random.randint(0, 2**31 - 1)
+        seed = [seed, 0]
+        keep = self.max_seq_len - max(1, min(stride, self.max_seq_len)) + 1
+
+        generated = list(prompt_tokens[-self.max_seq_len:])
+        prompt = generated
+        remaining = max_tokens
+        while remaining > 0:
+            # Tokens until the window is full, plus the one sampled from it
+            num_tokens = min(remaining, self.max_seq_len - len(prompt) + 1)
+
+            generated += self._run(prompt, num_tokens, temperature, top_k, top_p, seed)
+            remaining -= num_tokens
+            seed = [seed[0], seed[1] + 1]
+            prompt = generated[-keep:]
+
+        return list(prompt_tokens[:-self.max_seq_len]) + generated
@@ -0,0 +1,182 @@
+import math
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from src.monitoring.generation_metrics import JOBS_QUEUED, JOBS_RUNNING, JOBS_FINISHED
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a running job (from its progress hook) once it is cancelled.
+    """
+
+
+class QueueFull(Exception):
+    """
+    Raised by JobManager.submit when max_queue jobs are already waiting.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"job queue is full, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class Job:
+    """
+    One background generation job and its status.
+    """
+
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = "queued"      # queued, running, succeeded, failed, cancelled
+        self.stage = None           # set by the runner, e.g. "generating", "rendering"
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def report(self, done, total, stage=None):
+        """
+        Progress hook for the runner; raises JobCancelled once the job is cancelled.
+        """
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+        self.progress = min(1.0, done / total) if total else 1.0
+        if stage is not None:
+            self.stage = stage
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    In-process job queue: a bounded thread pool runs `runner(params, job)`
+    for each submitted job. At most max_queue jobs wait for a worker;
+    finished jobs are kept for ttl_seconds, then forgotten.
+    """
+
+    def __init__(self, runner, max_workers=1, max_queue=16, ttl_seconds=3600, retry_after_seconds=30):
+        self.runner = runner
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.ttl_seconds = ttl_seconds
+        self.retry_after_seconds = retry_after_seconds
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._durations = []
+
+    def _expire(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.ttl_seconds:
+                del self._jobs[job_id]
+
+    def _num_queued(self):
+        return sum(job.status == "queued" for job in self._jobs.values())
+
+    def retry_after(self):
+        """
+        Seconds until a queue slot is likely free, from recent job durations.
+        """
+        if not self._durations:
+            return self.retry_after_seconds
+        mean_duration = sum(self._durations) / len(self._durations)
+        return max(1, math.ceil(mean_duration / self.max_workers))
+
+    def submit(self, params):
+        """
+        Queue a job and return it immediately; raises QueueFull when max_queue jobs are waiting.
+        """
+        with self._lock:
+            self._expire()
+            if self._num_queued() >= self.max_queue:
+                raise QueueFull(self.retry_after())
+            job = Job(params)
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(self._run, job)
+        JOBS_QUEUED.inc()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a job: a queued job never starts, a running job stops at its next
+        progress report. A finished job's record is removed. Returns the job or None.
+        """
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.finished_at is not None:
+                del self._jobs[job_id]
+                return job
+            job._cancel.set()
+            if job.future.cancel():
+                self._finish(job, "cancelled")
+                JOBS_QUEUED.dec()
+        return job
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        JOBS_FINISHED.labels(status=status).inc()
+
+    def _run(self, job):
+        with self._lock:
+            if job.cancelled:
+                # Cancelled after the worker picked it up, before it started
+                self._finish(job, "cancelled")
+                JOBS_QUEUED.dec()
+                return
+            job.status = "running"
+            job.started_at = time.time()
+        JOBS_QUEUED.dec()
+        JOBS_RUNNING.inc()
+
+        try:
+            job.result = self.runner(job.params, job)
+            status = "succeeded"
+            job.progress = 1.0
+        except JobCancelled:
+            status = "cancelled"
+        except Exception as e:
+            print(f"job {job.id} failed: {e}")
+            job.error = str(e)
+            status = "failed"
+        finally:
+            JOBS_RUNNING.dec()
+
+        with self._lock:
+            self._finish(job, status)
+            self._durations = (self._durations + [job.finished_at - job.started_at])[-20:]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,95 @@
+import struct
+from midi_neural_processor.processor import START_IDX, RANGE_VEL
+
+TICKS_PER_BEAT = 480
+TICKS_PER_SECOND = TICKS_PER_BEAT * 2   # 120 bpm
+PROGRAM = 1                             # same instrument as decode_midi
+
+
+def _var_len(value):
+    """
+    MIDI variable-length quantity.
+    """
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(data))
+
+
+class MidiStreamWriter:
+    """
+    Decode event tokens to a MIDI file incrementally.
+    Messages are written as soon as each token is seen; only the currently
+    sounding notes are kept in memory, so pieces of any length use constant
+    memory. Unlike decode_midi, a re-triggered or never-released note is
+    ended (at the re-trigger or at close) rather than dropped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._time = 0.0
+        self._last_tick = 0
+        self._velocity = 0
+        self._sounding = set()
+        self.num_tokens = 0
+
+        # Header (format 0, one track) and a track with a placeholder length
+        self._file.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, TICKS_PER_BEAT))
+        self._file.write(b"MTrk")
+        self._length_offset = self._file.tell()
+        self._file.write(struct.pack(">I", 0))
+        self._track_start = self._file.tell()
+        self._message(bytes([0xC0, PROGRAM]))
+
+    def _message(self, data):
+        tick = int(round(self._time * TICKS_PER_SECOND))
+        self._file.write(_var_len(tick - self._last_tick) + data)
+        self._last_tick = tick
+
+    def _note_off(self, pitch):
+        self._message(bytes([0x80, pitch, 0]))
+        self._sounding.discard(pitch)
+
+    def write(self, tokens):
+        """
+        Append event tokens (ids outside the event vocabulary are ignored).
+        """
+        for token in tokens:
+            token = int(token)
+            self.num_tokens += 1
+            if token < START_IDX["note_off"]:
+                if token in self._sounding:
+                    self._note_off(token)
+                self._message(bytes([0x90, token, max(1, min(127, self._velocity))]))
+                self._sounding.add(token)
+            elif token < START_IDX["time_shift"]:
+                pitch = token - START_IDX["note_off"]
+                if pitch in self._sounding:
+                    self._note_off(pitch)
+            elif token < START_IDX["velocity"]:
+                self._time += (token - START_IDX["time_shift"] + 1) / 100
+            elif token < START_IDX["velocity"] + RANGE_VEL:
+                self._velocity = (token - START_IDX["velocity"]) * 4
+
+    def close(self):
+        """
+        Release sounding notes, end the track and patch its length.
+        """
+        for pitch in sorted(self._sounding):
+            self._note_off(pitch)
+        self._message(b"\xff\x2f\x00")
+
+        end = self._file.tell()
+        self._file.seek(self._length_offset)
+        self._file.write(struct.pack(">I", end - self._track_start))
+        self._file.close()
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,208 @@
+import os
+import hashlib
+import threading
+import numpy as np
+import tensorflow as tf
+from src.models.transformer_decoder import TransformerDecoder
+from src.models.precision import precision_scope
+from src.generation.graph_generate import GraphGenerator
+from src.generation.buckets import BucketedPrefill, bucket_lengths, count_trace
+
+
+def load_model(model_path):
+    """
+    Load a trained TransformerDecoder for inference.
+    """
+    try:
+        model = tf.keras.models.load_model(
+            model_path,
+            compile=False,
+            custom_objects={'TransformerDecoder': TransformerDecoder}
+        )
+    except Exception:
+        model = tf.keras.models.load_model(model_path, compile=False)
+
+    model.trainable = False
+    return model
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """
+    sha256 of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checkpoint_key(model_path):
+    """
+    Cheap identity of a checkpoint file: (mtime, size).
+    """
+    stat = os.stat(model_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class LoadedModel:
+    """
+    A warm model together with its traced inference functions.
+    """
+
+    def __init__(self, model_path, model, key, checksum):
+        self.model_path = model_path
+        self.model = model
+        self.key = key
+        self.checksum = checksum
+
+        self.predict = tf.function(lambda x: model(x, training=False), reduce_retracing=True)
+
+        # Fixed signatures: prompts are padded to buckets, decoding has one shape
+        self.buckets = bucket_lengths(model.max_seq_len)
+        self.prefill = BucketedPrefill(model, self.buckets)
+        cache_spec = tf.TensorSpec(
+            (None, model.num_heads, model.max_seq_len, model.embed_dim // model.num_heads),
+            model.cache_dtype)
+        self.decode_step = tf.function(
+            self._decode_step,
+            input_signature=[
+                tf.TensorSpec((None,), tf.int32),
+                [(cache_spec, cache_spec)] * model.num_layers,
+                tf.TensorSpec((None,), tf.int32),
+            ],
+        )
+        self.extend = tf.function(
+            self._extend,
+            input_signature=[
+                tf.TensorSpec((None, None), tf.int32),
+                [(cache_spec, cache_spec)] * model.num_layers,
+                tf.TensorSpec((None,), tf.int32),
+            ],
+        )
+        self._graph_generators = {}
+
+    def _decode_step(self, token, cache, position):
+        count_trace("decode_step")
+        return self.model.decode_step(token, cache, position)
+
+    def _extend(self, tokens, cache, position):
+        count_trace("extend")
+        return self.model.extend(tokens, cache, position)
+
+    def repeat_cache(self, cache, num_rows):
+        """
+        Copy a single-row cache to num_rows rows.
+        """
+        return [(tf.repeat(k, num_rows, axis=0), tf.repeat(v, num_rows, axis=0)) for k, v in cache]
+
+    def trim_cache(self, cache, length):
+        """
+        Cache as numpy arrays [k0, v0, k1, v1, ...] holding the first `length` positions.
+        """
+        return [np.asarray(tensor[:, :, :length]) for kv in cache for tensor in kv]
+
+    def restore_cache(self, arrays):
+        """
+        Inverse of trim_cache: pad back to max_seq_len.
+        """
+        tensors = [
+            tf.cast(tf.pad(a, [[0, 0], [0, 0], [0, self.model.max_seq_len - a.shape[2]], [0, 0]]),
+                    self.model.cache_dtype)
+            for a in arrays
+        ]
+        return list(zip(tensors[0::2], tensors[1::2]))
+
+    def graph_generator(self, jit_compile=False):
+        """
+        In-graph generator for this model, built on first use.
+        """
+        if jit_compile not in self._graph_generators:
+            self._graph_generators[jit_compile] = GraphGenerator(self.model, jit_compile=jit_compile)
+        return self._graph_generators[jit_compile]
+
+    def warmup(self):
+        """
+        Trace the inference functions once so the first request does not pay for it.
+        """
+        self.prefill.trace_all()
+        _, cache = self.prefill([[1]])
+        self.decode_step(tf.ones((1,), dtype=tf.int32), cache, tf.ones((1,), dtype=tf.int32))
+        return self
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models, keyed by checkpoint path and
+    precision (the dtype policy is applied while loading, never globally
+    per request). A model is reloaded when its file changes (mtime or size); the new
+    model is fully loaded and warmed before it replaces the old one, so
+    in-flight requests keep using the model they started with.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path_locks = {}
+        self._models = {}
+
+    def _path_lock(self, name):
+        with self._lock:
+            return self._path_locks.setdefault(name, threading.Lock())
+
+    def get(self, model_path, precision="float32"):
+        """
+        Return the LoadedModel for model_path, loading it if needed
+        (a TFLiteModel for exported .tflite files, which ignore precision).
+        precision : "float32", "mixed_bfloat16" or "mixed_float16"
+        """
+        path = os.path.abspath(model_path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"model file not found: {model_path}")
+        if path.endswith(".tflite"):
+            precision = None
+        name = (path, precision)
+
+        entry = self._models.get(name)
+        if entry is not None and entry.key == checkpoint_key(path):
+            return entry
+
+        # One loader per path and precision; others are not blocked
+        with self._path_lock(name):
+            entry = self._models.get(name)
+            key = checkpoint_key(path)
+            if entry is not None and entry.key == key:
+                return entry
+
+            print(f"Loading model: {path}")
+            try:
+                if path.endswith(".tflite"):
+                    from src.generation.tflite_backend import TFLiteModel
+                    new_entry = TFLiteModel(path, key, file_checksum(path)).warmup()
+                else:
+                    with precision_scope(precision):
+                        new_entry = LoadedModel(path, load_model(path), key, file_checksum(path)).warmup()
+            except Exception as e:
+                # Checkpoint may be mid-write: keep serving the previous model
+                if entry is None:
+                    raise
+                print(f"error reloading model, keeping previous version: {e}")
+                return entry
+
+            with self._lock:
+                self._models[name] = new_entry
+            return new_entry
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+_registry = ModelRegistry()
+
+
+def get_model(model_path, precision="float32"):
+    """
+    Return the warm model for model_path (at the given precision) from the
+    process-wide registry.
+    """
+    return _registry.get(model_path, precision)
@@ -0,0 +1,205 @@
+import os
+import io
+import time
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pretty_midi
+import soundfile as sf
+from src.utils import evict_oldest_files
+from src.monitoring.generation_metrics import RENDER_LATENCY, RENDER_CACHE_LOOKUPS, RENDER_CHUNKS
+
+
+# format name -> (soundfile format, subtype, media type)
+AUDIO_FORMATS = {
+    "ogg": ("OGG", "VORBIS", "audio/ogg"),
+    "flac": ("FLAC", "PCM_16", "audio/flac"),
+    "wav": ("WAV", "PCM_16", "audio/wav"),
+}
+
+
+def split_midi(midi_data, chunk_samples, fs):
+    """
+    Split a PrettyMIDI into time chunks of chunk_samples samples.
+    Returns (sample offset, instruments) pairs: notes starting in a chunk,
+    shifted by the chunk offset on the sample grid, with the controller / pitch bend state at the
+    chunk start and the events up to the chunk's last note-off. Each chunk
+    keeps every instrument so unnormalized renders share one scale.
+    Chunks without notes are dropped.
+    """
+    chunk_seconds = chunk_samples / fs
+    num_chunks = int(midi_data.get_end_time() // chunk_seconds) + 1
+    chunks = []
+    for k in range(num_chunks):
+        start = k * chunk_samples / fs
+        offset = k * chunk_samples
+
+        def shift(time):
+            # Same sample index as in the whole file, minus the chunk offset
+            # (half a sample of margin so float error cannot round it down)
+            return max(0.0, (int(fs * time) - offset + 0.5) / fs)
+
+        instruments = []
+        for instrument in midi_data.instruments:
+            notes = [note for note in instrument.notes if int(note.start // chunk_seconds) == k]
+            end = max((note.end for note in notes), default=start)
+
+            chunk = pretty_midi.Instrument(instrument.program, instrument.is_drum, instrument.name)
+            chunk.notes = [
+                pretty_midi.Note(note.velocity, note.pitch, shift(note.start), shift(note.end))
+                for note in notes
+            ]
+            # Controller state at the chunk start, then the changes while its notes sound
+            state = {}
+            for cc in instrument.control_changes:
+                if cc.time < start:
+                    state[cc.number] = cc.value
+            chunk.control_changes = [pretty_midi.ControlChange(number, value, 0.0)
+                                     for number, value in state.items()]
+            chunk.control_changes += [
+                pretty_midi.ControlChange(cc.number, cc.value, shift(cc.time))
+                for cc in instrument.control_changes if start <= cc.time <= end
+            ]
+            bends = [bend for bend in instrument.pitch_bends if bend.time < start]
+            chunk.pitch_bends = [pretty_midi.PitchBend(bends[-1].pitch, 0.0)] if bends else []
+            chunk.pitch_bends += [
+                pretty_midi.PitchBend(bend.pitch, shift(bend.time))
+                for bend in instrument.pitch_bends if start <= bend.time <= end
+            ]
+            instruments.append(chunk)
+
+        if any(instrument.notes for instrument in instruments):
+            chunks.append((offset, instruments))
+    return chunks
+
+
+def render_chunk(instruments, fs, synth="fluidsynth", sf2_path=None):
+    """
+    Unnormalized waveform of a list of instruments (runs in a worker process).
+    synth : "fluidsynth" (sf2_path soundfont, pretty_midi's default if None)
+            or "sine" (pretty_midi's sine synthesis, no soundfont needed)
+    """
+    midi_data = pretty_midi.PrettyMIDI()
+    midi_data.instruments = instruments
+    if synth == "sine":
+        waveforms = [instrument.synthesize(fs) for instrument in instruments]
+        audio = np.zeros(max(len(w) for w in waveforms))
+        for waveform in waveforms:
+            audio[:len(waveform)] += waveform
+        return audio
+    return midi_data.fluidsynth(fs=fs, synthesizer=sf2_path, normalize=False)
+
+
+class AudioRenderer:
+    """
+    MIDI -> WAV rendering as a pipeline stage of its own.
+    Long MIDIs are split into chunks rendered in parallel in a process pool
+    and overlap-added at their sample offsets (audio ringing past a chunk
+    boundary is summed into the next one), then normalized once.
+    WAVs are cached in cache_dir by MIDI content hash, sample rate and synth;
+    concurrent requests for the same MIDI share one render.
+    """
+
+    def __init__(self, cache_dir, fs=22050, synth="fluidsynth", sf2_path=None,
+                 chunk_seconds=30.0, max_workers=2, max_disk_mb=4096):
+        self.cache_dir = cache_dir
+        self.fs = fs
+        self.synth = synth
+        self.sf2_path = sf2_path
+        self.chunk_samples = int(chunk_seconds * fs)
+        self.max_workers = max_workers
+        self.max_disk_bytes = int(max_disk_mb * 2**20)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Workers are spawned, not forked, so they do not inherit TensorFlow's threads
+        self._processes = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self._threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def wav_path(self, midi_path):
+        """
+        Cache path of the WAV for a MIDI file (it may not be rendered yet).
+        """
+        with open(midi_path, "rb") as f:
+            checksum = hashlib.sha256(f.read()).hexdigest()
+        return os.path.join(self.cache_dir, f"{checksum}.{self.fs}.{self.synth}.wav")
+
+    def submit(self, midi_path):
+        """
+        Start rendering midi_path in the background; the Future resolves to the WAV path.
+        """
+        wav_path = self.wav_path(midi_path)
+        with self._lock:
+            if wav_path in self._in_flight:
+                return self._in_flight[wav_path]
+            if os.path.exists(wav_path):
+                RENDER_CACHE_LOOKUPS.labels(result="hit").inc()
+                os.utime(wav_path)   # recency for eviction
+                future = Future()
+                future.set_result(wav_path)
+                return future
+            RENDER_CACHE_LOOKUPS.labels(result="miss").inc()
+            future = self._threads.submit(self._render, midi_path, wav_path)
+            self._in_flight[wav_path] = future
+
+        future.add_done_callback(lambda _: self._done(wav_path))
+        return future
+
+    def render(self, midi_path):
+        """
+        WAV path for midi_path, rendering it now if it is not cached.
+        """
+        return self.submit(midi_path).result()
+
+    def _done(self, wav_path):
+        with self._lock:
+            self._in_flight.pop(wav_path, None)
+
+    def synthesize(self, midi_data):
+        """
+        Normalized waveform of a PrettyMIDI, rendered chunk by chunk in the process pool.
+        """
+        chunks = split_midi(midi_data, self.chunk_samples, self.fs)
+        RENDER_CHUNKS.observe(len(chunks))
+        futures = [
+            (offset, self._processes.submit(render_chunk, instruments, self.fs, self.synth, self.sf2_path))
+            for offset, instruments in chunks
+        ]
+        parts = [(offset, future.result()) for offset, future in futures]
+
+        audio = np.zeros(max((offset + len(part) for offset, part in parts), default=0))
+        for offset, part in parts:
+            audio[offset:offset + len(part)] += part
+        peak = np.abs(audio).max() if len(audio) else 0
+        return audio / peak if peak > 0 else audio
+
+    def audio_bytes(self, midi_data, audio_format="ogg"):
+        """
+        Render a PrettyMIDI straight to encoded audio bytes (no files, no cache).
+        """
+        sf_format, subtype, _ = AUDIO_FORMATS[audio_format]
+        start_time = time.time()
+        buffer = io.BytesIO()
+        sf.write(buffer, self.synthesize(midi_data), self.fs, format=sf_format, subtype=subtype)
+        RENDER_LATENCY.observe(time.time() - start_time)
+        return buffer.getvalue()
+
+    def _render(self, midi_path, wav_path):
+        start_time = time.time()
+        audio = self.synthesize(pretty_midi.PrettyMIDI(midi_path))
+
+        tmp_path = f"{wav_path}.{threading.get_ident()}.tmp"
+        sf.write(tmp_path, audio, self.fs, format="WAV")
+        os.replace(tmp_path, wav_path)
+        evict_oldest_files(self.cache_dir, self.max_disk_bytes, ".wav")
+
+        RENDER_LATENCY.observe(time.time() - start_time)
+        return wav_path
+
+    def shutdown(self):
+        self._threads.shutdown(wait=True)
+        self._processes.shutdown(wait=True)
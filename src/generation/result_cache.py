@@ -0,0 +1,132 @@
+import os
+import copy
+import json
+import contextlib
+import time
+import hashlib
+import threading
+import numpy as np
+from src.generation.seed_cache import LRUCache
+from src.utils import evict_oldest_files
+from src.monitoring.generation_metrics import RESULT_CACHE_LOOKUPS, RESULT_CACHE_HIT_RATIO
+
+
+def request_fingerprint(**fields):
+    """
+    sha256 of everything that determines a generation result
+    (model checksum, seed content hash, sampling parameters, random seed, ...).
+    """
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed cache of generated token sequences (and the reason
+    each one stopped), keyed by request fingerprint. Entries live in an in-memory LRU and as .npz files in
+    cache_dir (bounded by max_disk_mb); both expire ttl_seconds after
+    they were generated.
+    """
+
+    def __init__(self, max_memory_mb=64, cache_dir=None, max_disk_mb=1024, ttl_seconds=7 * 24 * 3600):
+        self.memory = LRUCache(int(max_memory_mb * 2**20))
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = int(max_disk_mb * 2**20)
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            RESULT_CACHE_HIT_RATIO.set(self.hits / (self.hits + self.misses))
+        RESULT_CACHE_LOOKUPS.labels(result="hit" if hit else "miss").inc()
+
+    def _load_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = os.path.join(self.cache_dir, f"{key}.npz")
+        try:
+            with np.load(path) as data:
+                stop_reasons = data["stop_reasons"].tolist()
+                entry = (float(data["created_at"]),
+                         [data[f"sample_{i}"].tolist() for i in range(len(stop_reasons))],
+                         stop_reasons)
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(path)   # recency for disk eviction
+        return entry
+
+    def get(self, key):
+        """
+        (samples, stop reasons) stored for a fingerprint, or None.
+        Samples are lists of token ids.
+        """
+        entry = self.memory.get(key) or self._load_disk(key)
+        if entry is not None and time.time() - entry[0] > self.ttl_seconds:
+            entry = None
+            if self.cache_dir:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.cache_dir, f"{key}.npz"))
+        self._record(entry is not None)
+        if entry is None:
+            return None
+        self.memory.put(key, entry, sum(len(sample) for sample in entry[1]) * 8)
+        return [list(sample) for sample in entry[1]], list(entry[2])
+
+    def put(self, key, samples, stop_reasons=None):
+        stop_reasons = stop_reasons or ["length"] * len(samples)
+        entry = (time.time(), [list(map(int, sample)) for sample in samples], list(stop_reasons))
+        self.memory.put(key, entry, sum(len(sample) for sample in samples) * 8)
+        if not self.cache_dir:
+            return
+
+        path = os.path.join(self.cache_dir, f"{key}.npz")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        arrays = {f"sample_{i}": np.asarray(sample, dtype=np.int32) for i, sample in enumerate(entry[1])}
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, created_at=np.float64(entry[0]), stop_reasons=np.asarray(entry[2]), **arrays)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"error writing result cache entry: {e}")
+            return
+        evict_oldest_files(self.cache_dir, self.max_disk_bytes, ".npz")
+
+    def memory_only(self):
+        """
+        View of this cache without the disk tier: shares the in-memory LRU,
+        never reads or writes cache_dir.
+        """
+        view = copy.copy(self)
+        view.cache_dir = None
+        return view
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache(config=None):
+    """
+    Process-wide ResultCache, created from the `result_cache` config section
+    on first use; None when the section is not enabled.
+    """
+    global _result_cache
+    config = (config or {}).get("result_cache", {})
+    if not config.get("enabled", False):
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(
+                max_memory_mb=config.get("max_memory_mb", 64),
+                cache_dir=config.get("cache_dir"),
+                max_disk_mb=config.get("max_disk_mb", 1024),
+                ttl_seconds=config.get("ttl_seconds", 7 * 24 * 3600),
+            )
+        return _result_cache
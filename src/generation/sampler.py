@@ -54,31 +54,139 @@ def top_p_sampling(logits, p):
     return mask
 
 
-def sample_next_token(
+def _per_row(value, default, dtype, batch_size):
+    """
+    Broadcast a scalar or per-row sampling parameter to shape [batch].
+    """
+    value = np.asarray(default if value is None else value, dtype=dtype)
+    if value.ndim == 0:
+        return np.full((batch_size,), value, dtype=dtype)
+    return value
+
+
+def _candidate_probs(logits, temperature, top_k, top_p):
+    """
+    Filtered sampling distribution restricted to the top-k candidates.
+    Returns candidates [batch, k_max] (sorted by logit) and their probabilities
+    (unnormalized after top-p; rows sum to at most 1).
+    """
+    logits = np.asarray(logits, dtype=np.float32)
+    batch_size, vocab_size = logits.shape
+    rows = np.arange(batch_size)[:, None]
+
+    temperature = _per_row(temperature, 1.0, np.float32, batch_size)
+    if (temperature <= 0).any():
+        raise ValueError("temperature must be > 0")
+
+    top_k = _per_row(top_k, 0, np.int64, batch_size)
+    top_k = np.where((top_k <= 0) | (top_k > vocab_size), vocab_size, top_k)
+
+    top_p = _per_row(top_p, 1.0, np.float32, batch_size)
+    if ((top_p <= 0) | (top_p > 1)).any():
+        raise ValueError("top_p must be in (0, 1]")
+
+    # top-k candidates (unordered), then sort only those.
+    # Temperature is positive, so it can be applied after selection.
+    k_max = int(top_k.max())
+    if k_max < vocab_size:
+        candidates = np.argpartition(-logits, k_max - 1, axis=1)[:, :k_max]
+    else:
+        candidates = np.broadcast_to(np.arange(vocab_size), (batch_size, vocab_size))
+    candidate_logits = logits[rows, candidates]
+
+    order = np.argsort(-candidate_logits, axis=1)
+    candidates = candidates[rows, order]
+    candidate_logits = candidate_logits[rows, order] / temperature[:, None]
+
+    # rows with a smaller k drop their extra candidates
+    ranks = np.arange(k_max)[None, :]
+    candidate_logits[ranks >= top_k[:, None]] = -np.inf
+
+    probs = np.exp(candidate_logits - candidate_logits[:, :1])
+    probs /= probs.sum(axis=1, keepdims=True)
+
+    # top-p (always keep at least one token)
+    drop = (np.cumsum(probs, axis=1) > top_p[:, None]) & (ranks > 0)
+    probs[drop] = 0.0
+    return candidates, probs
+
+
+def token_probs(logits, temperature=1.0, top_k=None, top_p=None):
+    """
+    Dense [batch, vocab] sampling distribution after temperature, top-k and top-p.
+    """
+    logits = np.asarray(logits, dtype=np.float32)
+    candidates, probs = _candidate_probs(logits, temperature, top_k, top_p)
+
+    dense = np.zeros(logits.shape, dtype=np.float32)
+    np.put_along_axis(dense, candidates, probs, axis=1)
+    return dense / dense.sum(axis=1, keepdims=True)
+
+
+def sample_next_tokens(
     logits,
     temperature=1.0,
     top_k=None,
-    top_p=None
+    top_p=None,
+    rng=None,
+    uniforms=None
 ):
     """
-    Sample next token from logits using temperature, top-k and/or top-p.
+    Batched sampling over [batch, vocab] logits.
+    temperature, top_k, top_p : scalars or per-row arrays
+                                (top_k <= 0 / None and top_p = 1 / None disable the filter)
+    rng      : np.random.Generator used for the draw (defaults to the global numpy state)
+    uniforms : optional [batch] uniform draws in [0, 1), e.g. from per-row generators
+    Works in float32, sorts only the top-k candidates, and samples every row
+    with one vectorized inverse-CDF draw.
     """
-    logits = np.asarray(logits).astype(np.float64)
+    candidates, probs = _candidate_probs(logits, temperature, top_k, top_p)
+    return sample_from_probs(probs, candidates, rng=rng, uniforms=uniforms)
 
-    # temperature
-    logits = apply_temperature(logits, temperature)
 
-    # top-k
-    if top_k is not None:
-        logits = top_k_sampling(logits, top_k)
+def sample_from_probs(probs, candidates=None, rng=None, uniforms=None):
+    """
+    Vectorized inverse-CDF draw from [batch, n] (possibly unnormalized) probabilities.
+    candidates : optional [batch, n] token ids for each column
+    """
+    batch_size = probs.shape[0]
 
-    # top-p
-    if top_p is not None:
-        logits = top_p_sampling(logits, top_p)
+    cdf = np.cumsum(probs, axis=1)
+    total = cdf[:, -1]
+    if not (total > 0).all():
+        raise ValueError("invalid probability distribution during sampling")
 
-    probs = softmax(logits)
+    if uniforms is None:
+        if rng is None:
+            rng = np.random
+        uniforms = rng.random(batch_size)
+    uniforms = np.asarray(uniforms, dtype=np.float32) * total
 
-    if np.any(np.isnan(probs)) or np.sum(probs) == 0:
-        raise ValueError("invalid probability distribution during sampling")
+    # Never land on a zero-probability entry when u * total rounds up to total
+    index = (cdf <= uniforms[:, None]).sum(axis=1)
+    last = probs.shape[1] - 1 - np.argmax(probs[:, ::-1] > 0, axis=1)
+    index = np.minimum(index, last)
 
-    return np.random.choice(len(probs), p=probs)
+    if candidates is None:
+        return index
+    return candidates[np.arange(batch_size), index]
+
+
+def sample_next_token(
+    logits,
+    temperature=1.0,
+    top_k=None,
+    top_p=None,
+    rng=None
+):
+    """
+    Sample next token from logits using temperature, top-k and/or top-p.
+    rng : optional np.random.Generator (defaults to the global numpy state)
+    """
+    return sample_next_tokens(
+        np.asarray(logits)[None, :],
+        temperature=temperature,
+        top_k=top_k,
+        top_p=top_p,
+        rng=rng,
+    )[0]
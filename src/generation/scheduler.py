@@ -0,0 +1,292 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+import tensorflow as tf
+from src.generation.sampler import sample_next_tokens
+from src.monitoring.generation_metrics import (
+    SCHEDULER_QUEUE_DEPTH, SCHEDULER_ACTIVE_ROWS, SCHEDULER_BATCH_OCCUPANCY)
+
+
+class GenerationJob:
+    """
+    One generation request waiting for (or holding) a batch slot.
+    """
+
+    def __init__(self, prompt_tokens, max_new_tokens, temperature, top_k, top_p, seed=None,
+                 prefix_state=None, stop=None, progress=None, loaded=None):
+        self.tokens = list(prompt_tokens)
+        self.loaded = loaded
+        self.max_new_tokens = max_new_tokens
+        self.remaining = max_new_tokens
+        self.stop = stop
+        self.progress = progress
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.rng = np.random.default_rng(seed)
+        self.prefix_state = prefix_state
+        self.future = Future()
+
+        self.slot = None
+        self.position = 0
+        self.next_logits = None
+
+
+class BatchScheduler:
+    """
+    Continuous batching for autoregressive generation.
+    Concurrent requests share one batched decode step over the occupied
+    slots only; each row keeps its own sampling parameters, length and RNG.
+    Finished rows free their slot and waiting requests are admitted between
+    steps.
+    Every request decodes on the model it was submitted for. When that is
+    a different model (e.g. the registry reloaded a changed checkpoint), the
+    batch is drained first, then the scheduler switches to it.
+    resolve    : optional callable returning the current LoadedModel, e.g.
+                 lambda: get_model(path, precision); used for requests
+                 submitted without a model
+    vocab_size : sampled ids outside [0, vocab_size) are replaced, as in
+                 iter_tokens (defaults to the model's vocab_size)
+    """
+
+    def __init__(self, loaded_model, max_batch_size=8, max_wait_ms=10, stride=1, vocab_size=None,
+                 resolve=None):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.stride = stride
+        self.resolve = resolve
+        self._vocab_size = vocab_size
+        self._switch(loaded_model)
+
+        self._queue = queue.Queue()
+        self._held = []
+        self._rows = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _switch(self, loaded):
+        """
+        Decode on loaded from now on (the batch must be empty): fresh cache
+        buffers for its architecture.
+        """
+        self.loaded = loaded
+        model = loaded.model
+        self.vocab_size = self._vocab_size or model.vocab_size
+        self.max_seq_len = model.max_seq_len
+        # Tokens kept when a full context window is re-encoded (see iter_tokens)
+        self.keep = model.max_seq_len - max(1, min(self.stride, model.max_seq_len)) + 1
+        self.cache = [
+            (tf.zeros(shape, dtype=model.cache_dtype), tf.zeros(shape, dtype=model.cache_dtype))
+            for shape in [(self.max_batch_size, model.num_heads, model.max_seq_len,
+                           model.embed_dim // model.num_heads)] * model.num_layers
+        ]
+
+    def model(self):
+        """
+        The model new requests decode on: from resolve when given, else the
+        current one.
+        """
+        return self.resolve() if self.resolve is not None else self.loaded
+
+    def submit(self, prompt_tokens, max_new_tokens, temperature=1.0, top_k=None, top_p=None, seed=None,
+               prefix_state=None, stop=None, progress=None, loaded=None):
+        """
+        Queue a request; the returned Future resolves to the prompt plus generated tokens.
+        loaded       : LoadedModel to decode on (default: model()); prefix_state
+                       and any cache key of the request must come from it
+        prefix_state : optional (logits, cache) already computed for the prompt
+        stop         : optional StopCriteria; the row finishes (and frees its slot)
+                       as soon as it reports a stop reason
+        progress     : optional callable(done, total) called after each token;
+                       an exception it raises (e.g. JobCancelled) frees the
+                       slot and is set on the Future
+        """
+        job = GenerationJob(prompt_tokens, max_new_tokens, temperature, top_k, top_p, seed, prefix_state, stop,
+                            progress, loaded or self.model())
+        if max_new_tokens <= 0:
+            if stop is not None:
+                stop.stop_reason = "length"
+            job.future.set_result(job.tokens)
+            return job.future
+
+        self._queue.put(job)
+        SCHEDULER_QUEUE_DEPTH.set(self._queue.qsize())
+        return job.future
+
+    def shutdown(self):
+        self._stop.set()
+        self._thread.join()
+
+    @staticmethod
+    @tf.function
+    def _insert_row(cache, row_cache, slot):
+        index = tf.reshape(slot, (1, 1))
+        return [
+            (tf.tensor_scatter_nd_update(k, index, row_k),
+             tf.tensor_scatter_nd_update(v, index, row_v))
+            for (k, v), (row_k, row_v) in zip(cache, row_cache)
+        ]
+
+    @staticmethod
+    @tf.function(reduce_retracing=True)
+    def _update_rows(cache, rows_cache, slots):
+        index = tf.reshape(slots, (-1, 1))
+        return [
+            (tf.tensor_scatter_nd_update(k, index, rows_k),
+             tf.tensor_scatter_nd_update(v, index, rows_v))
+            for (k, v), (rows_k, rows_v) in zip(cache, rows_cache)
+        ]
+
+    def _decode(self, decoding):
+        """
+        One decode step for the decoding rows only: their cache rows are
+        gathered into a compact batch and written back afterwards, so idle
+        slots cost nothing.
+        """
+        decoding = sorted(decoding, key=lambda job: job.slot)
+        tokens = tf.constant([job.tokens[-1] for job in decoding], dtype=tf.int32)
+        positions = tf.constant([job.position for job in decoding], dtype=tf.int32)
+        if len(decoding) == self.max_batch_size:
+            logits, self.cache = self.loaded.decode_step(tokens, self.cache, positions)
+        else:
+            slots = tf.constant([job.slot for job in decoding], dtype=tf.int32)
+            rows_cache = [(tf.gather(k, slots), tf.gather(v, slots)) for k, v in self.cache]
+            logits, rows_cache = self.loaded.decode_step(tokens, rows_cache, positions)
+            self.cache = self._update_rows(self.cache, rows_cache, slots)
+        logits = np.asarray(logits)
+        for row, job in enumerate(decoding):
+            job.next_logits = logits[row]
+            job.position += 1
+
+    def _prefill(self, job, keep=None):
+        prompt = job.tokens[-(keep or self.max_seq_len):]
+        if job.prefix_state is not None and keep is None:
+            logits, row_cache = job.prefix_state
+            job.prefix_state = None
+        else:
+            logits, row_cache = self.loaded.prefill([prompt])
+        self.cache = self._insert_row(self.cache, row_cache, tf.constant(job.slot, dtype=tf.int32))
+        job.next_logits = np.asarray(logits[0])
+        job.position = len(prompt)
+
+    def _admit(self):
+        free = self.max_batch_size - len(self._rows)
+        if free == 0:
+            return
+
+        # Requests held back for another model come first
+        pending, self._held = self._held, []
+        if not self._rows and not pending:
+            # Idle: block for the first request, then wait briefly to fill the batch
+            try:
+                pending.append(self._queue.get(timeout=0.1))
+            except queue.Empty:
+                return
+            deadline = time.monotonic() + self.max_wait
+            while len(pending) < free:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        else:
+            while len(pending) < free:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+        # A request for another model waits until the batch drains, then the
+        # scheduler switches; requests behind it wait too, in order
+        if pending and not self._rows and pending[0].loaded is not self.loaded:
+            self._switch(pending[0].loaded)
+        admitted = []
+        for job in pending:
+            if job.loaded is not self.loaded or len(admitted) == free:
+                break
+            admitted.append(job)
+        self._held = pending[len(admitted):]
+
+        used = {job.slot for job in self._rows.values()}
+        free_slots = [slot for slot in range(self.max_batch_size) if slot not in used]
+        for job, slot in zip(admitted, free_slots):
+            job.slot = slot
+            try:
+                self._prefill(job)
+            except Exception as e:
+                job.future.set_exception(e)
+                continue
+            self._rows[slot] = job
+
+        SCHEDULER_QUEUE_DEPTH.set(self._queue.qsize() + len(self._held))
+
+    def _step(self):
+        decoding = []
+        refill = []
+
+        # Sampling: one vectorized draw, per-row parameters and RNG
+        jobs = list(self._rows.values())
+        next_ids = sample_next_tokens(
+            np.stack([job.next_logits for job in jobs]),
+            temperature=[job.temperature for job in jobs],
+            top_k=[job.top_k or 0 for job in jobs],
+            top_p=[job.top_p or 1.0 for job in jobs],
+            uniforms=[job.rng.random() for job in jobs],
+        )
+
+        for job, next_id in zip(jobs, next_ids):
+            next_id = int(next_id)
+            if next_id >= self.vocab_size or next_id < 0:
+                next_id = int(job.rng.integers(1, self.vocab_size - 1))
+            reason = job.stop.update(next_id) if job.stop is not None else None
+            if reason != "end_of_sequence":
+                job.tokens.append(next_id)
+            job.remaining -= 1
+
+            if job.progress is not None:
+                try:
+                    job.progress(job.max_new_tokens - job.remaining, job.max_new_tokens)
+                except Exception as e:
+                    # Cancelled (or failing) request: give its slot back now
+                    del self._rows[job.slot]
+                    job.future.set_exception(e)
+                    continue
+
+            if job.remaining == 0 or reason is not None:
+                if job.stop is not None:
+                    job.stop.stop_reason = job.stop.stop_reason or "length"
+                del self._rows[job.slot]
+                job.future.set_result(job.tokens)
+            elif job.position < self.max_seq_len:
+                decoding.append(job)
+            else:
+                refill.append(job)
+
+        # One batched forward pass for every decoding row
+        if decoding:
+            SCHEDULER_BATCH_OCCUPANCY.observe(len(decoding) / self.max_batch_size)
+            self._decode(decoding)
+
+        # Context window is full: re-encode the most recent tokens
+        for job in refill:
+            self._prefill(job, keep=self.keep)
+
+        SCHEDULER_ACTIVE_ROWS.set(len(self._rows))
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._admit()
+            if not self._rows:
+                continue
+            try:
+                self._step()
+            except Exception as e:
+                for job in self._rows.values():
+                    job.future.set_exception(e)
+                self._rows.clear()
+                SCHEDULER_ACTIVE_ROWS.set(0)
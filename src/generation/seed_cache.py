@@ -0,0 +1,188 @@
+import os
+import io
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import midi_neural_processor.processor as midi_tokenizer
+from src.generation.model_registry import file_checksum
+from src.utils import evict_oldest_files
+from src.monitoring.generation_metrics import SEED_CACHE_LOOKUPS
+
+
+class LRUCache:
+    """
+    Thread-safe LRU map bounded by the total size (bytes) of its values.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, num_bytes):
+        if num_bytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.num_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, num_bytes)
+            self.num_bytes += num_bytes
+            while self.num_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.num_bytes -= evicted_bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.num_bytes = 0
+
+
+class SeedCache:
+    """
+    Content-addressed cache for seed MIDI files.
+    Entries are keyed by the sha256 of the file content, so renamed or
+    re-uploaded copies of a seed share them. For each seed it holds the
+    token ids and, per model checksum, the prefill state of the prompt
+    (next-token logits and the KV cache trimmed to the prompt length).
+    Two tiers: an in-memory LRU bounded in bytes, and .npz files in
+    cache_dir bounded by max_disk_mb (least recently used files removed first).
+    """
+
+    def __init__(self, max_memory_mb=256, cache_dir=None, max_disk_mb=2048, cache_prefix_state=True):
+        self.memory = LRUCache(int(max_memory_mb * 2**20))
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = int(max_disk_mb * 2**20)
+        self.cache_prefix_state = cache_prefix_state
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # Disk tier
+    def _disk_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.npz")
+
+    def _load_disk(self, name):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(name)
+        try:
+            with np.load(path) as data:
+                arrays = [data[f"arr_{i}"] for i in range(len(data.files))]
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(path)   # recency for disk eviction
+        return arrays
+
+    def _save_disk(self, name, arrays):
+        if not self.cache_dir:
+            return
+        # bfloat16 has no portable .npy representation
+        arrays = [a.astype(np.float32) if a.dtype.name == "bfloat16" else a for a in arrays]
+        path = self._disk_path(name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, *arrays)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"error writing seed cache entry: {e}")
+            return
+        evict_oldest_files(self.cache_dir, self.max_disk_bytes, ".npz")
+
+    def _lookup(self, kind, name, compute):
+        """
+        Arrays for name from memory, then disk, else compute() and store in both tiers.
+        """
+        arrays = self.memory.get(name)
+        if arrays is not None:
+            SEED_CACHE_LOOKUPS.labels(kind=kind, result="memory").inc()
+            return arrays
+
+        arrays = self._load_disk(name)
+        if arrays is not None:
+            SEED_CACHE_LOOKUPS.labels(kind=kind, result="disk").inc()
+        else:
+            SEED_CACHE_LOOKUPS.labels(kind=kind, result="miss").inc()
+            arrays = compute()
+            self._save_disk(name, arrays)
+
+        self.memory.put(name, arrays, sum(a.nbytes for a in arrays))
+        return arrays
+
+    def tokens(self, seed_path):
+        """
+        Returns (content key, token ids) for a seed MIDI file path or MIDI bytes.
+        """
+        if isinstance(seed_path, (bytes, bytearray)):
+            key = hashlib.sha256(seed_path).hexdigest()
+            source = lambda: io.BytesIO(seed_path)
+        else:
+            key = file_checksum(seed_path)
+            source = lambda: seed_path
+        arrays = self._lookup(
+            "tokens", f"{key}.tokens",
+            lambda: [np.asarray(midi_tokenizer.encode_midi(source()), dtype=np.int32)])
+        return key, arrays[0].tolist()
+
+    def prefix_state(self, key, loaded, prompt):
+        """
+        Prefill state (last logits [1, vocab], cache) of prompt for the seed
+        with content key `key`. Computed once per seed, model checksum and
+        cache dtype (the same checkpoint loaded in another precision has its
+        own entries).
+        """
+        def compute():
+            logits, cache = loaded.prefill([prompt])
+            return [np.asarray(logits)] + loaded.trim_cache(cache, len(prompt))
+
+        if not self.cache_prefix_state or loaded.checksum is None:
+            return loaded.prefill([prompt])
+
+        name = f"{key}.{loaded.checksum[:16]}.{loaded.model.cache_dtype}.{len(prompt)}.state"
+        arrays = self._lookup("state", name, compute)
+        return arrays[0], loaded.restore_cache(arrays[1:])
+
+    def clear(self):
+        self.memory.clear()
+
+    def memory_only(self):
+        """
+        View of this cache without the disk tier: shares the in-memory LRU,
+        never reads or writes cache_dir.
+        """
+        view = copy.copy(self)
+        view.cache_dir = None
+        return view
+
+
+_seed_cache = None
+_seed_cache_lock = threading.Lock()
+
+
+def get_seed_cache(config=None):
+    """
+    Process-wide SeedCache, created from the `seed_cache` config section on
+    first use; None when the section is not enabled.
+    """
+    global _seed_cache
+    config = (config or {}).get("seed_cache", {})
+    if not config.get("enabled", False):
+        return None
+    with _seed_cache_lock:
+        if _seed_cache is None:
+            _seed_cache = SeedCache(
+                max_memory_mb=config.get("max_memory_mb", 256),
+                cache_dir=config.get("cache_dir"),
+                max_disk_mb=config.get("max_disk_mb", 2048),
+                cache_prefix_state=config.get("cache_prefix_state", True),
+            )
+        return _seed_cache
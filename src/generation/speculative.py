@@ -0,0 +1,118 @@
+import numpy as np
+from src.generation.sampler import token_probs, sample_from_probs, sample_next_tokens
+from src.monitoring.generation_metrics import (
+    SPECULATIVE_DRAFT_TOKENS, SPECULATIVE_ACCEPTED_TOKENS, SPECULATIVE_ACCEPTANCE_RATE)
+
+
+def speculative_accept(target_probs, draft_probs, draft_tokens, rng):
+    """
+    Speculative-sampling acceptance rule.
+    target_probs : [n + 1, vocab] target distributions at each drafted position, plus one
+    draft_probs  : [n, vocab] draft distributions the tokens were sampled from
+    draft_tokens : [n] drafted tokens
+    Draft token i is kept with probability min(1, p_i(x) / q_i(x)). At the first
+    rejection a token is drawn from max(0, p_i - q_i) instead; if every token
+    is kept, a bonus token is drawn from p_n. Outputs follow the target distribution.
+    """
+    for i, token in enumerate(draft_tokens):
+        if rng.random() * draft_probs[i, token] < target_probs[i, token]:
+            continue
+        residual = np.maximum(target_probs[i] - draft_probs[i], 0.0)
+        if residual.sum() <= 0:
+            residual = target_probs[i]
+        return list(draft_tokens[:i]) + [int(sample_from_probs(residual[None], rng=rng)[0])]
+
+    return list(draft_tokens) + [int(sample_from_probs(target_probs[-1:], rng=rng)[0])]
+
+
+class SpeculativeDecoder:
+    """
+    Speculative decoding with a small draft model.
+    Each round the draft proposes up to k tokens one by one, the target scores
+    them all in a single cached forward pass, and the acceptance rule keeps
+    a prefix of them plus one target token.
+    Between rounds both caches hold every token except the last one.
+    The draft must share the target's vocabulary and max_seq_len (ValueError otherwise).
+    """
+
+    def __init__(self, target, draft, num_speculative_tokens=4, stride=1):
+        for field in ("vocab_size", "max_seq_len"):
+            target_value, draft_value = getattr(target.model, field), getattr(draft.model, field)
+            if draft_value != target_value:
+                raise ValueError(f"draft model {field} ({draft_value}) does not match "
+                                 f"the target's ({target_value})")
+        self.target = target
+        self.draft = draft
+        self.k = num_speculative_tokens
+        self.max_seq_len = target.model.max_seq_len
+        # Tokens kept when the window is re-encoded; leaves room for a full round
+        self.keep = max(2, self.max_seq_len - max(stride, self.k + 1) + 1)
+        self.acceptance_rate = None
+
+    def iter_tokens(self, prompt_tokens, max_tokens, temperature=1.0, top_k=None, top_p=None, rng=None):
+        """
+        Yields max_tokens tokens sampled after prompt_tokens.
+        """
+        if max_tokens <= 0:
+            return
+        rng = rng or np.random.default_rng()
+        sampling = dict(temperature=temperature, top_k=top_k, top_p=top_p)
+        proposed = accepted = 0
+
+        # First token straight from the target
+        context = list(prompt_tokens)[-self.max_seq_len:]
+        logits, target_cache = self.target.prefill([context])
+        _, draft_cache = self.draft.prefill([context])
+        token = int(sample_next_tokens(logits.numpy(), rng=rng, **sampling)[0])
+        context.append(token)
+        draft_len = len(context) - 1
+        generated = 1
+        yield token
+
+        while generated < max_tokens:
+            n = min(self.k, max_tokens - generated - 1)
+
+            # Not enough room for a round: re-encode the most recent tokens
+            if len(context) + n > self.max_seq_len:
+                context = context[-self.keep:]
+                _, target_cache = self.target.prefill([context[:-1]])
+                _, draft_cache = self.draft.prefill([context[:-1]])
+                draft_len = len(context) - 1
+
+            # Draft: catch up on tokens it has not seen, then propose n tokens
+            draft_tokens, draft_probs = [], []
+            if n > 0:
+                draft_logits, draft_cache = self.draft.extend(
+                    [context[draft_len:]], draft_cache, [draft_len])
+                draft_logits = draft_logits[:, -1]
+                for i in range(n):
+                    probs = token_probs(draft_logits.numpy(), **sampling)
+                    draft_tokens.append(int(sample_from_probs(probs, rng=rng)[0]))
+                    draft_probs.append(probs[0])
+                    if i < n - 1:
+                        draft_logits, draft_cache = self.draft.decode_step(
+                            [draft_tokens[-1]], draft_cache, [len(context) + i])
+                draft_len = len(context) + n - 1
+
+            # Target: score the last token and all drafts in one pass
+            target_logits, target_cache = self.target.extend(
+                [context[-1:] + draft_tokens], target_cache, [len(context) - 1])
+            target_probs = token_probs(target_logits[0].numpy(), **sampling)
+
+            new_tokens = speculative_accept(
+                target_probs, np.array(draft_probs).reshape(n, target_probs.shape[-1]), draft_tokens, rng)
+            proposed += n
+            accepted += len(new_tokens) - 1
+
+            # Caches stay valid up to the accepted prefix; later entries are overwritten
+            context += new_tokens
+            draft_len = min(draft_len, len(context) - 1)
+            for token in new_tokens:
+                generated += 1
+                yield token
+
+        SPECULATIVE_DRAFT_TOKENS.inc(proposed)
+        SPECULATIVE_ACCEPTED_TOKENS.inc(accepted)
+        if proposed:
+            self.acceptance_rate = accepted / proposed
+            SPECULATIVE_ACCEPTANCE_RATE.observe(self.acceptance_rate)
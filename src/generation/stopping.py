@@ -0,0 +1,68 @@
+import time
+from midi_neural_processor.processor import START_IDX
+
+
+def token_seconds(token):
+    """
+    Musical time a token advances: time-shift tokens move 10 ms per step.
+    """
+    if START_IDX["time_shift"] <= token < START_IDX["velocity"]:
+        return (token - START_IDX["time_shift"] + 1) / 100
+    return 0.0
+
+
+class StopCriteria:
+    """
+    Stopping rule for one generated sequence: ends at whichever limit comes
+    first among the end-of-sequence token, max_new_tokens, max_duration
+    seconds of music (summed incrementally from time-shift tokens) and a
+    wall-clock deadline (time.monotonic() value).
+    """
+
+    def __init__(self, max_new_tokens, max_duration=None, deadline=None, eos_token=None):
+        self.max_new_tokens = max_new_tokens
+        self.max_duration = max_duration
+        self.deadline = deadline
+        self.eos_token = eos_token
+
+        self.num_tokens = 0
+        self.duration = 0.0
+        self.stop_reason = None
+
+    def update(self, token):
+        """
+        Record a sampled token. Returns the stop reason once a limit is reached
+        (the end-of-sequence token itself is not part of the output), else None.
+        """
+        if self.stop_reason is not None:
+            return self.stop_reason
+        self.num_tokens += 1
+        self.duration += token_seconds(token)
+
+        if self.eos_token is not None and token == self.eos_token:
+            self.stop_reason = "end_of_sequence"
+        elif self.num_tokens >= self.max_new_tokens:
+            self.stop_reason = "length"
+        elif self.max_duration is not None and self.duration >= self.max_duration:
+            self.stop_reason = "duration"
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            self.stop_reason = "deadline"
+        return self.stop_reason
+
+
+def until_stopped(tokens, criteria):
+    """
+    Pass tokens through until criteria says stop. The source iterator is not
+    advanced past that point, so no token is computed that will not be used.
+    """
+    if criteria.max_new_tokens <= 0:
+        criteria.stop_reason = "length"
+        return
+    for token in tokens:
+        reason = criteria.update(token)
+        if reason != "end_of_sequence":
+            yield token
+        if reason is not None:
+            return
+    # Source ran out first (it was asked for at most max_new_tokens)
+    criteria.stop_reason = criteria.stop_reason or "length"
@@ -1,23 +1,172 @@
 import tensorflow as tf
 from tensorflow.keras import layers
 
+# Masked score; applied to float32 scores, so it is finite whatever the compute dtype
+MASK_VALUE = -1e9
+
+ATTENTION_IMPLEMENTATIONS = ("dense", "chunked")
+
+
+def _to_blocks(x, num_blocks, block_size):
+    # [batch, heads, seq_len, dim] -> float32 [batch, heads, num_blocks, block_size, dim]
+    shape = tf.shape(x)
+    x = tf.pad(tf.cast(x, tf.float32), [[0, 0], [0, 0], [0, num_blocks * block_size - shape[2]], [0, 0]])
+    return tf.reshape(x, (shape[0], shape[1], num_blocks, block_size, shape[3]))
+
+
+def _from_blocks(blocks, seq_len):
+    # Stacked TensorArray [num_blocks, batch, heads, block_size, dim] -> [batch, heads, seq_len, dim]
+    blocks = tf.transpose(blocks, perm=[1, 2, 0, 3, 4])
+    shape = tf.shape(blocks)
+    return tf.reshape(blocks, (shape[0], shape[1], shape[2] * shape[3], shape[4]))[:, :, :seq_len]
+
+
+def chunked_causal_attention(q, k, v, block_size=256, dropout_rate=0.0, seed=None, segment_ids=None):
+    """
+    Causal softmax(q k^T / sqrt(head_dim)) v computed in query / key blocks
+    with an online softmax: only [block_size, block_size] scores exist at a
+    time and blocks above the diagonal are skipped. The backward pass
+    recomputes the block scores from the saved softmax normalizer, so
+    neither pass builds the [seq_len, seq_len] matrix.
+    q, k, v      : [batch, heads, seq_len, head_dim]
+    dropout_rate : attention dropout, drawn per block from the stateless
+                   seed ([2] int32), identically in the backward pass
+    segment_ids  : optional [batch, seq_len] ids; tokens only attend within
+                   their own segment (packed sequences)
+    """
+    dtype = v.dtype
+    seq_len = tf.shape(q)[2]
+    num_blocks = (seq_len + block_size - 1) // block_size
+    scale = tf.math.sqrt(tf.cast(tf.shape(q)[3], tf.float32))
+    positions = tf.range(block_size)
+    if segment_ids is not None:
+        segment_blocks = tf.reshape(
+            tf.pad(segment_ids, [[0, 0], [0, num_blocks * block_size - seq_len]], constant_values=-1),
+            (tf.shape(q)[0], num_blocks, block_size))
+
+    def scores(q_block, k_block, i, j):
+        s = tf.matmul(q_block, k_block, transpose_b=True) / scale
+        mask = (i * block_size + positions)[:, tf.newaxis] >= (j * block_size + positions)[tf.newaxis, :]
+        if segment_ids is not None:
+            q_segments = tf.gather(segment_blocks, i, axis=1)[:, tf.newaxis, :, tf.newaxis]
+            k_segments = tf.gather(segment_blocks, j, axis=1)[:, tf.newaxis, tf.newaxis, :]
+            mask = tf.logical_and(mask, tf.equal(q_segments, k_segments))
+        return tf.where(mask, s, MASK_VALUE)
+
+    def dropout(p, i, j):
+        if not dropout_rate:
+            return p
+        keep = tf.random.stateless_uniform(
+            tf.shape(p), tf.random.experimental.stateless_fold_in(seed, i * num_blocks + j)) >= dropout_rate
+        return tf.where(keep, p / (1.0 - dropout_rate), 0.0)
+
+    @tf.custom_gradient
+    def attention(q, k, v):
+        q_blocks = _to_blocks(q, num_blocks, block_size)
+        k_blocks = _to_blocks(k, num_blocks, block_size)
+        v_blocks = _to_blocks(v, num_blocks, block_size)
+        row_shape = tf.shape(q_blocks)[:2]
+        row_shape = tf.concat([row_shape, [block_size]], axis=0)
+
+        def query_block(i, out, lse):
+            q_block = tf.gather(q_blocks, i, axis=2)
+
+            def key_block(j, m, l, acc):
+                s = scores(q_block, tf.gather(k_blocks, j, axis=2), i, j)
+                m_new = tf.maximum(m, tf.reduce_max(s, axis=-1))
+                p = tf.exp(s - m_new[..., tf.newaxis])
+                correction = tf.exp(m - m_new)
+                l = l * correction + tf.reduce_sum(p, axis=-1)
+                acc = acc * correction[..., tf.newaxis] + tf.matmul(dropout(p, i, j), tf.gather(v_blocks, j, axis=2))
+                return j + 1, m_new, l, acc
+
+            # Key blocks after the diagonal are fully masked: never computed
+            _, m, l, acc = tf.while_loop(
+                lambda j, *_: j <= i, key_block,
+                (0, tf.fill(row_shape, float("-inf")), tf.zeros(row_shape), tf.zeros_like(q_block)))
+            return i + 1, out.write(i, acc / l[..., tf.newaxis]), lse.write(i, m + tf.math.log(l))
+
+        _, out, lse = tf.while_loop(
+            lambda i, *_: i < num_blocks, query_block,
+            (0, tf.TensorArray(tf.float32, size=num_blocks), tf.TensorArray(tf.float32, size=num_blocks)))
+        out = _from_blocks(out.stack(), seq_len)
+        lse = tf.transpose(lse.stack(), perm=[1, 2, 0, 3])   # [batch, heads, num_blocks, block_size]
+
+        def grad(d_out):
+            d_out = tf.cast(d_out, tf.float32)
+            do_blocks = _to_blocks(d_out, num_blocks, block_size)
+            delta = _to_blocks(tf.reduce_sum(d_out * out, axis=-1, keepdims=True), num_blocks, block_size)
+
+            def probabilities(i, j):
+                # Recomputed softmax weights (p) and their gradient (ds) for one block pair
+                q_block = tf.gather(q_blocks, i, axis=2)
+                do_block = tf.gather(do_blocks, i, axis=2)
+                s = scores(q_block, tf.gather(k_blocks, j, axis=2), i, j)
+                p = tf.exp(s - tf.gather(lse, i, axis=2)[..., tf.newaxis])
+                dp = dropout(tf.matmul(do_block, tf.gather(v_blocks, j, axis=2), transpose_b=True), i, j)
+                ds = p * (dp - tf.gather(delta, i, axis=2))
+                return p, ds, q_block, do_block
+
+            def key_gradients(j, dk, dv):
+                def query_block(i, dk_j, dv_j):
+                    p, ds, q_block, do_block = probabilities(i, j)
+                    dv_j += tf.matmul(dropout(p, i, j), do_block, transpose_a=True)
+                    dk_j += tf.matmul(ds, q_block, transpose_a=True) / scale
+                    return i + 1, dk_j, dv_j
+
+                zeros = tf.zeros_like(tf.gather(k_blocks, j, axis=2))
+                _, dk_j, dv_j = tf.while_loop(lambda i, *_: i < num_blocks, query_block, (j, zeros, zeros))
+                return j + 1, dk.write(j, dk_j), dv.write(j, dv_j)
+
+            def query_gradients(i, dq):
+                def key_block(j, dq_i):
+                    _, ds, _, _ = probabilities(i, j)
+                    return j + 1, dq_i + tf.matmul(ds, tf.gather(k_blocks, j, axis=2)) / scale
+
+                _, dq_i = tf.while_loop(
+                    lambda j, *_: j <= i, key_block, (0, tf.zeros_like(tf.gather(q_blocks, i, axis=2))))
+                return i + 1, dq.write(i, dq_i)
+
+            _, dk, dv = tf.while_loop(
+                lambda j, *_: j < num_blocks, key_gradients,
+                (0, tf.TensorArray(tf.float32, size=num_blocks), tf.TensorArray(tf.float32, size=num_blocks)))
+            _, dq = tf.while_loop(
+                lambda i, *_: i < num_blocks, query_gradients,
+                (0, tf.TensorArray(tf.float32, size=num_blocks)))
+            return (tf.cast(_from_blocks(dq.stack(), seq_len), q.dtype),
+                    tf.cast(_from_blocks(dk.stack(), seq_len), k.dtype),
+                    tf.cast(_from_blocks(dv.stack(), seq_len), v.dtype))
+
+        return tf.cast(out, dtype), grad
+
+    return attention(q, k, v)
+
 @tf.keras.utils.register_keras_serializable()
 class MultiHeadSelfAttention(layers.Layer):
     """
     Multi-head self-attention with causal masking for sequential generation.
     Includes dropout on attention weights.
+    implementation : "dense" (full score matrix) or "chunked" (block_size
+                     query / key blocks, see chunked_causal_attention) for
+                     full-sequence calls; cached decoding is the same for both
+    Full-sequence calls take optional segment_ids so that packed pieces do
+    not attend to each other.
     """
 
-    def __init__(self, embed_dim, num_heads, dropout_rate=0.1):
+    def __init__(self, embed_dim, num_heads, dropout_rate=0.1, implementation="dense", block_size=256):
         super().__init__()
 
         if embed_dim % num_heads != 0:
             raise ValueError("embed_dim must be divisible by num_heads")
+        if implementation not in ATTENTION_IMPLEMENTATIONS:
+            raise ValueError(f"implementation must be one of {ATTENTION_IMPLEMENTATIONS}, got {implementation}")
 
         self.embed_dim = embed_dim
         self.num_heads = num_heads
         self.head_dim = embed_dim // num_heads
         self.dropout_rate = dropout_rate
+        self.implementation = implementation
+        self.block_size = block_size
 
         self.qkv_dense = layers.Dense(embed_dim * 3)
         self.output_dense = layers.Dense(embed_dim)
@@ -29,6 +178,8 @@ class MultiHeadSelfAttention(layers.Layer):
             "embed_dim": self.embed_dim,
             "num_heads": self.num_heads,
             "dropout_rate": self.dropout_rate,
+            "implementation": self.implementation,
+            "block_size": self.block_size,
         })
         return config
     
@@ -46,41 +197,48 @@ class MultiHeadSelfAttention(layers.Layer):
         )
         return tf.transpose(x, perm=[0, 2, 1, 3])
 
-    def _causal_mask(self, seq_len, dtype):
+    def _causal_mask(self, seq_len, segment_ids=None):
         mask = tf.linalg.band_part(
-            tf.ones((seq_len, seq_len), dtype=dtype), -1, 0
+            tf.ones((seq_len, seq_len), dtype=tf.bool), -1, 0
         )
         mask = tf.reshape(mask, (1, 1, seq_len, seq_len))
+        if segment_ids is not None:
+            same_segment = segment_ids[:, tf.newaxis, :, tf.newaxis] == segment_ids[:, tf.newaxis, tf.newaxis, :]
+            mask = tf.logical_and(mask, same_segment)
         return mask
 
-    def call(self, x, training=False):
-        batch_size = tf.shape(x)[0]
-        seq_len = tf.shape(x)[1]
-
+    def _project(self, x):
         # QKV projection
         qkv = self.qkv_dense(x)
         q, k, v = tf.split(qkv, 3, axis=-1)
 
         # Split heads
-        q = self._split_heads(q)
-        k = self._split_heads(k)
-        v = self._split_heads(v)
+        return self._split_heads(q), self._split_heads(k), self._split_heads(v)
 
-        # Scaled dot-product attention
+    def _attend(self, q, k, v, mask, training=False, seed=None):
+        # Scaled dot-product attention; scores and softmax in float32
+        # so mixed precision (bfloat16 / float16) stays stable
         scale = tf.math.sqrt(tf.cast(self.head_dim, tf.float32))
-        scores = tf.matmul(q, k, transpose_b=True) / scale
+        scores = tf.cast(tf.matmul(q, k, transpose_b=True), tf.float32) / scale
 
-        # Causal mask
-        mask = self._causal_mask(seq_len, scores.dtype)
-        scores = scores * mask + (1.0 - mask) * -1e9
+        # Mask (boolean, so no large constant is multiplied in low precision)
+        scores = tf.where(mask, scores, MASK_VALUE)
 
         # Attention weights
-        weights = tf.nn.softmax(scores, axis=-1)
-        weights = self.attn_dropout(weights, training=training)
+        weights = tf.cast(tf.nn.softmax(scores, axis=-1), v.dtype)
+        if seed is not None and training and self.dropout_rate:
+            weights = tf.nn.experimental.stateless_dropout(weights, self.dropout_rate, seed)
+        else:
+            weights = self.attn_dropout(weights, training=training)
 
         attention = tf.matmul(weights, v)
 
-        # Merge heads
+        # Merge heads and project
+        return self._merge_heads(attention)
+
+    def _merge_heads(self, attention):
+        batch_size = tf.shape(attention)[0]
+        seq_len = tf.shape(attention)[2]
         attention = tf.transpose(attention, perm=[0, 2, 1, 3])
         attention = tf.reshape(
             attention, (batch_size, seq_len, self.embed_dim)
@@ -88,3 +246,74 @@ class MultiHeadSelfAttention(layers.Layer):
 
         # Final projection
         return self.output_dense(attention)
+
+    def _attend_causal(self, q, k, v, training=False, seed=None, segment_ids=None):
+        if self.implementation == "chunked":
+            if seed is None and training and self.dropout_rate:
+                seed = tf.random.uniform((2,), maxval=2**31 - 1, dtype=tf.int32)
+            attention = chunked_causal_attention(
+                q, k, v, self.block_size,
+                dropout_rate=self.dropout_rate if training else 0.0, seed=seed, segment_ids=segment_ids)
+            return self._merge_heads(attention)
+
+        # Causal mask (within each segment)
+        mask = self._causal_mask(tf.shape(q)[2], segment_ids)
+        return self._attend(q, k, v, mask, training=training, seed=seed)
+
+    def call(self, x, training=False, seed=None, segment_ids=None):
+        """
+        seed        : optional stateless seed ([2] int32) for the attention dropout
+                      mask, so a recomputed pass draws the same mask
+        segment_ids : optional [batch, seq_len] ids of the packed piece of each token
+        """
+        q, k, v = self._project(x)
+        return self._attend_causal(q, k, v, training=training, seed=seed, segment_ids=segment_ids)
+
+    def prefill(self, x, max_len):
+        """
+        Causal attention over a whole prompt.
+        Returns the output and the (key, value) cache padded to max_len.
+        """
+        seq_len = tf.shape(x)[1]
+
+        q, k, v = self._project(x)
+        out = self._attend_causal(q, k, v)
+
+        padding = [[0, 0], [0, 0], [0, max_len - seq_len], [0, 0]]
+        return out, (tf.pad(k, padding), tf.pad(v, padding))
+
+    def extend(self, x, cache, position):
+        """
+        Attention for new tokens appended after the cached ones.
+        x        : [batch, new_len, embed_dim]
+        cache    : (key, value), each [batch, heads, max_len, head_dim]
+        position : [batch] index where the first new token is written
+        """
+        k_cache, v_cache = cache
+        max_len = tf.shape(k_cache)[2]
+        new_len = tf.shape(x)[1]
+
+        q, k, v = self._project(x)
+
+        # Write the new keys/values at position, position + 1, ...
+        positions = position[:, tf.newaxis] + tf.range(new_len)[tf.newaxis, :]
+        write = tf.one_hot(positions, max_len, dtype=k.dtype)
+        written = tf.reduce_sum(write, axis=1)[:, tf.newaxis, :, tf.newaxis]
+        k_cache = k_cache * (1.0 - written) + tf.einsum("btl,bhtd->bhld", write, k)
+        v_cache = v_cache * (1.0 - written) + tf.einsum("btl,bhtd->bhld", write, v)
+
+        # Each new token attends to the cache up to its own position
+        mask = tf.range(max_len)[tf.newaxis, tf.newaxis, :] <= positions[:, :, tf.newaxis]
+        mask = mask[:, tf.newaxis, :, :]
+
+        out = self._attend(q, k_cache, v_cache, mask)
+        return out, (k_cache, v_cache)
+
+    def decode_step(self, x, cache, position):
+        """
+        Attention for a single new token per row.
+        x        : [batch, 1, embed_dim]
+        cache    : (key, value), each [batch, heads, max_len, head_dim]
+        position : [batch] index where the new token is written
+        """
+        return self.extend(x, cache, position)
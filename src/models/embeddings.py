@@ -58,5 +58,13 @@ class TokenEmbedding(layers.Layer):
     def call(self, x):
         seq_len = tf.shape(x)[1]
         x = self.token_embedding(x)
-        x = x + self.positional_encoding[:, :seq_len, :]    
-        return x 
\ No newline at end of file
+        x = x + tf.cast(self.positional_encoding[:, :seq_len, :], x.dtype)
+        return x
+
+    def embed_at(self, x, positions):
+        """
+        Token embedding with explicit positions (used for cached decoding).
+        """
+        x = self.token_embedding(x)
+        x = x + tf.cast(tf.gather(self.positional_encoding[0], positions), x.dtype)
+        return x
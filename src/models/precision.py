@@ -0,0 +1,38 @@
+import threading
+from contextlib import contextmanager
+import tensorflow as tf
+
+PRECISIONS = ("float32", "mixed_bfloat16", "mixed_float16")
+
+
+def set_precision(precision="float32"):
+    """
+    Set the global Keras dtype policy. Models built (or loaded) afterwards
+    compute in the policy's dtype and keep float32 variables; attention
+    softmax and logits stay float32 (see MultiHeadSelfAttention, TransformerDecoder).
+    precision : "float32", "mixed_bfloat16" or "mixed_float16" (needs loss scaling)
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {PRECISIONS}, got {precision}")
+
+    tf.keras.mixed_precision.set_global_policy(precision)
+    return tf.keras.mixed_precision.global_policy()
+
+
+_policy_lock = threading.Lock()
+
+
+@contextmanager
+def precision_scope(precision="float32"):
+    """
+    Global dtype policy set to precision for the models built (or loaded)
+    inside the block, and restored afterwards. Scopes run one at a time, so
+    models loaded concurrently with different precisions do not mix policies.
+    """
+    with _policy_lock:
+        previous = tf.keras.mixed_precision.global_policy()
+        set_precision(precision)
+        try:
+            yield
+        finally:
+            tf.keras.mixed_precision.set_global_policy(previous)
@@ -1,24 +1,59 @@
 import tensorflow as tf
 from tensorflow.keras import layers, Model
 from src.models.embeddings import TokenEmbedding
-from src.models.attention import MultiHeadSelfAttention
+from src.models.attention import MultiHeadSelfAttention, ATTENTION_IMPLEMENTATIONS
+
+
+def recompute_layers(recompute, num_layers):
+    """
+    Per-block recompute flags from True / False or a list of block indices.
+    """
+    if isinstance(recompute, bool):
+        return [recompute] * num_layers
+    recompute = list(recompute)
+    if any(not 0 <= i < num_layers for i in recompute):
+        raise ValueError(f"recompute layer indices must be in [0, {num_layers}), got {recompute}")
+    return [i in recompute for i in range(num_layers)]
+
+
+def segment_positions(segment_ids):
+    """
+    Position of each token within its segment ([batch, seq_len] ids, each
+    segment contiguous), so every packed piece starts at position 0.
+    """
+    batch_size = tf.shape(segment_ids)[0]
+    seq_len = tf.shape(segment_ids)[1]
+    positions = tf.broadcast_to(tf.range(seq_len)[tf.newaxis, :], (batch_size, seq_len))
+
+    starts = tf.concat([tf.ones_like(segment_ids[:, :1], dtype=tf.bool),
+                        segment_ids[:, 1:] != segment_ids[:, :-1]], axis=1)
+    # Run number of each token, offset per row, -> index of the run's first token
+    runs = tf.cumsum(tf.cast(starts, tf.int32), axis=1) - 1 + tf.range(batch_size)[:, tf.newaxis] * seq_len
+    first = tf.math.unsorted_segment_min(positions, runs, batch_size * seq_len)
+    return positions - tf.gather(first, runs)
 
 
 @tf.keras.utils.register_keras_serializable()
 class TransformerDecoderBlock(layers.Layer):
     """
     Single Transformer decoder block.
+    recompute : when training, keep only the block input and recompute its
+                activations during the backward pass (tf.recompute_grad)
     """
 
-    def __init__(self, embed_dim, num_heads, ff_dim, dropout, **kwargs):
+    def __init__(self, embed_dim, num_heads, ff_dim, dropout, attention="dense", attention_block_size=256,
+                 recompute=False, **kwargs):
         super().__init__(**kwargs)
         
         self.embed_dim = embed_dim
         self.num_heads = num_heads
         self.ff_dim = ff_dim
         self.dropout = dropout
+        self.recompute = recompute
 
-        self.attention = MultiHeadSelfAttention(embed_dim, num_heads, dropout_rate=dropout)
+        self.attention = MultiHeadSelfAttention(
+            embed_dim, num_heads, dropout_rate=dropout,
+            implementation=attention, block_size=attention_block_size)
 
         self.ffn = tf.keras.Sequential([
             layers.Dense(ff_dim, activation="relu"),
@@ -38,6 +73,9 @@ class TransformerDecoderBlock(layers.Layer):
             "num_heads": self.num_heads,
             "ff_dim": self.ff_dim,
             "dropout": self.dropout,
+            "attention": self.attention.implementation,
+            "attention_block_size": self.attention.block_size,
+            "recompute": self.recompute,
         })
         return config
     
@@ -45,19 +83,53 @@ class TransformerDecoderBlock(layers.Layer):
     def from_config(cls, config):
         return cls(**config)
 
-    def call(self, x, training=False):
-        attn_out = self.attention(x)
-        attn_out = self.dropout1(attn_out, training=training)
+    def call(self, x, training=False, segment_ids=None):
+        if training and self.recompute:
+            # Dropout masks come from one stateless seed drawn here, so the
+            # recomputation in the backward pass draws the same masks
+            seed = tf.random.uniform((2,), maxval=2**31 - 1, dtype=tf.int32)
+            return tf.recompute_grad(lambda x: self._forward(x, training, seed, segment_ids))(x)
+        return self._forward(x, training, segment_ids=segment_ids)
+
+    def _dropout(self, layer, x, training, seed, index):
+        if seed is None or not training or not self.dropout:
+            return layer(x, training=training)
+        return tf.nn.experimental.stateless_dropout(
+            x, self.dropout, tf.random.experimental.stateless_fold_in(seed, index))
+
+    def _forward(self, x, training=False, seed=None, segment_ids=None):
+        attention_seed = None if seed is None else tf.random.experimental.stateless_fold_in(seed, 0)
+        attn_out = self.attention(x, training=training, seed=attention_seed, segment_ids=segment_ids)
+        attn_out = self._dropout(self.dropout1, attn_out, training, seed, 1)
         x = self.norm1(x + attn_out)
 
         ffn_out = self.ffn(x)
-        ffn_out = self.dropout2(ffn_out, training=training)
+        ffn_out = self._dropout(self.dropout2, ffn_out, training, seed, 2)
         return self.norm2(x + ffn_out)
 
+    def prefill(self, x, max_len):
+        attn_out, cache = self.attention.prefill(x, max_len)
+        x = self.norm1(x + attn_out)
+        return self.norm2(x + self.ffn(x)), cache
+
+    def extend(self, x, cache, position):
+        attn_out, cache = self.attention.extend(x, cache, position)
+        x = self.norm1(x + attn_out)
+        return self.norm2(x + self.ffn(x)), cache
+
+    def decode_step(self, x, cache, position):
+        return self.extend(x, cache, position)
+
 @tf.keras.utils.register_keras_serializable()
 class TransformerDecoder(Model):
     """
     Autoregressive Transformer decoder for symbolic music generation.
+    attention : "dense" or "chunked" self-attention (see MultiHeadSelfAttention),
+                with attention_block_size query / key blocks
+    recompute : recompute block activations in the backward pass instead of
+                storing them: True (every block), False, or a list of block indices
+    Called on tokens [batch, seq_len], or on (tokens, segment_ids) for packed
+    sequences: each segment attends only to itself and restarts at position 0.
     """
 
     def __init__(
@@ -68,7 +140,10 @@ class TransformerDecoder(Model):
         num_heads,
         ff_dim,
         num_layers,
-        dropout,**kwargs
+        dropout,
+        attention="dense",
+        attention_block_size=256,
+        recompute=False,**kwargs
     ):
         super().__init__(**kwargs)
 
@@ -79,7 +154,9 @@ class TransformerDecoder(Model):
         self.ff_dim = ff_dim
         self.num_layers = num_layers
         self.dropout = dropout
-        
+        self.attention = attention
+        self.attention_block_size = attention_block_size
+        self.recompute = recompute
 
         self.embedding = TokenEmbedding(
             vocab_size=vocab_size,
@@ -89,12 +166,15 @@ class TransformerDecoder(Model):
 
         self.blocks = [
             TransformerDecoderBlock(
-                embed_dim, num_heads, ff_dim, dropout
+                embed_dim, num_heads, ff_dim, dropout,
+                attention=attention, attention_block_size=attention_block_size,
+                recompute=block_recompute
             )
-            for _ in range(num_layers)
+            for block_recompute in recompute_layers(recompute, num_layers)
         ]
 
-        self.output_layer = layers.Dense(vocab_size)
+        # Logits stay float32 under a mixed-precision policy (stable softmax / loss)
+        self.output_layer = layers.Dense(vocab_size, dtype="float32")
         
     def get_config(self):
         """Nécessaire pour la sérialisation"""
@@ -107,6 +187,9 @@ class TransformerDecoder(Model):
             "ff_dim": self.ff_dim,
             "num_layers": self.num_layers,
             "dropout": self.dropout,
+            "attention": self.attention,
+            "attention_block_size": self.attention_block_size,
+            "recompute": self.recompute,
         })
         return config
     
@@ -116,10 +199,84 @@ class TransformerDecoder(Model):
         return cls(**config)
 
 
+    def set_attention(self, attention, block_size=256):
+        """
+        Switch the self-attention implementation of every block
+        (e.g. train a loaded checkpoint with chunked attention); weights are shared.
+        """
+        if attention not in ATTENTION_IMPLEMENTATIONS:
+            raise ValueError(f"attention must be one of {ATTENTION_IMPLEMENTATIONS}, got {attention}")
+        for block in self.blocks:
+            block.attention.implementation = attention
+            block.attention.block_size = block_size
+        self.attention = attention
+        self.attention_block_size = block_size
+
+    def set_recompute(self, recompute):
+        """
+        Choose which blocks recompute their activations in the backward pass
+        (True, False or a list of block indices).
+        """
+        for block, block_recompute in zip(self.blocks, recompute_layers(recompute, self.num_layers)):
+            block.recompute = block_recompute
+        self.recompute = recompute
+
+    @property
+    def cache_dtype(self):
+        """
+        dtype of the key/value cache (the attention compute dtype).
+        """
+        return self.blocks[0].attention.compute_dtype
+
     def call(self, x, training=False):
-        x = self.embedding(x)
+        segment_ids = None
+        if isinstance(x, (tuple, list)):
+            x, segment_ids = x
+            x = self.embedding.embed_at(x, segment_positions(segment_ids))
+        else:
+            x = self.embedding(x)
 
         for block in self.blocks:
-            x = block(x, training=training)
+            x = block(x, training=training, segment_ids=segment_ids)
 
         return self.output_layer(x)
+
+    def prefill(self, x):
+        """
+        Run a prompt [batch, seq_len] through the decoder.
+        Returns the logits and the per-layer key/value cache.
+        """
+        x = self.embedding(x)
+
+        cache = []
+        for block in self.blocks:
+            x, layer_cache = block.prefill(x, self.max_seq_len)
+            cache.append(layer_cache)
+
+        return self.output_layer(x), cache
+
+    def extend(self, tokens, cache, position):
+        """
+        Run new tokens [batch, new_len] after the cached ones.
+        position : [batch] position of the first new token
+        Returns the logits [batch, new_len, vocab_size] and the updated cache.
+        """
+        positions = position[:, tf.newaxis] + tf.range(tf.shape(tokens)[1])[tf.newaxis, :]
+        x = self.embedding.embed_at(tokens, positions)
+
+        new_cache = []
+        for block, layer_cache in zip(self.blocks, cache):
+            x, layer_cache = block.extend(x, layer_cache, position)
+            new_cache.append(layer_cache)
+
+        return self.output_layer(x), new_cache
+
+    def decode_step(self, token, cache, position):
+        """
+        Decode one token per row using the key/value cache.
+        token    : [batch] token ids
+        position : [batch] position of the token in the sequence
+        Returns the next-token logits [batch, vocab_size] and the updated cache.
+        """
+        logits, cache = self.extend(token[:, tf.newaxis], cache, position)
+        return logits[:, 0], cache
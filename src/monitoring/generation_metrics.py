@@ -0,0 +1,83 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Batching scheduler
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    "generation_scheduler_queue_depth",
+    "Generation requests waiting for a batch slot")
+SCHEDULER_ACTIVE_ROWS = Gauge(
+    "generation_scheduler_active_rows",
+    "Generation requests currently decoding in the batch")
+SCHEDULER_BATCH_OCCUPANCY = Histogram(
+    "generation_scheduler_batch_occupancy",
+    "Fraction of batch slots in use per decode step",
+    buckets=(0.125, 0.25, 0.375, 0.5, 0.625, 0.75, 0.875, 1.0))
+
+# tf.function tracing
+GRAPH_TRACES = Counter(
+    "generation_graph_traces_total",
+    "Number of tf.function traces of generation graphs",
+    ["function"])
+
+# Streaming endpoint
+STREAM_FIRST_TOKENS_LATENCY = Histogram(
+    "generation_stream_first_tokens_seconds",
+    "Time from request to the first streamed token batch")
+STREAM_FIRST_MIDI_LATENCY = Histogram(
+    "generation_stream_first_midi_seconds",
+    "Time from request to the first streamed MIDI fragment")
+STREAM_CANCELLED = Counter(
+    "generation_stream_cancelled_total",
+    "Streaming generations stopped because the client disconnected")
+
+# Speculative decoding
+SPECULATIVE_DRAFT_TOKENS = Counter(
+    "generation_speculative_draft_tokens_total",
+    "Tokens proposed by the draft model")
+SPECULATIVE_ACCEPTED_TOKENS = Counter(
+    "generation_speculative_accepted_tokens_total",
+    "Draft tokens accepted by the target model")
+SPECULATIVE_ACCEPTANCE_RATE = Histogram(
+    "generation_speculative_acceptance_rate",
+    "Fraction of draft tokens accepted per request",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+
+# Seed cache
+SEED_CACHE_LOOKUPS = Counter(
+    "generation_seed_cache_lookups_total",
+    "Seed cache lookups by entry kind and the tier that served them",
+    ["kind", "result"])
+
+# Background jobs
+JOBS_QUEUED = Gauge(
+    "generation_jobs_queued",
+    "Background generation jobs waiting for a worker")
+JOBS_RUNNING = Gauge(
+    "generation_jobs_running",
+    "Background generation jobs currently running")
+JOBS_FINISHED = Counter(
+    "generation_jobs_finished_total",
+    "Background generation jobs by final status",
+    ["status"])
+
+# Audio rendering
+RENDER_LATENCY = Histogram(
+    "generation_render_seconds",
+    "Time to render a MIDI file to WAV (cache misses)",
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 40, 80, 160))
+RENDER_CACHE_LOOKUPS = Counter(
+    "generation_render_cache_lookups_total",
+    "Render cache lookups by result (hit or miss)",
+    ["result"])
+RENDER_CHUNKS = Histogram(
+    "generation_render_chunks",
+    "Time chunks rendered in parallel per MIDI file",
+    buckets=(1, 2, 4, 8, 16, 32))
+
+# Result cache
+RESULT_CACHE_LOOKUPS = Counter(
+    "generation_result_cache_lookups_total",
+    "Result cache lookups for seeded requests by result (hit or miss)",
+    ["result"])
+RESULT_CACHE_HIT_RATIO = Gauge(
+    "generation_result_cache_hit_ratio",
+    "Fraction of result cache lookups served from the cache since startup")
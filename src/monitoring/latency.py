@@ -1,10 +1,12 @@
 import time
+from functools import wraps
 
 def measure_latency(func):
     """
     Decorator to measure execution latency of a function.
     """
 
+    @wraps(func)
     def wrapper(*args, **kwargs):
         start_time = time.time()
         result = func(*args, **kwargs)
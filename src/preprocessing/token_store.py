@@ -0,0 +1,177 @@
+import json
+import itertools
+import argparse
+from pathlib import Path
+import numpy as np
+
+MANIFEST = "manifest.json"
+INDEX = "index.npy"
+TOKEN_DTYPE = np.uint16
+
+
+class TokenStoreWriter:
+    """
+    Streams token sequences to a token store directory:
+    uncompressed uint16 shards of at most shard_tokens tokens, an index of
+    (shard, start, length) per sequence and a JSON manifest, written on close.
+    Memory stays flat whatever the corpus size.
+    """
+
+    def __init__(self, output_dir, max_seq_len=None, shard_tokens=2**26, pad_token=0):
+        self.output_dir = Path(output_dir)
+        self.max_seq_len = max_seq_len
+        self.shard_tokens = shard_tokens
+        self.pad_token = pad_token
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        self.shards = []
+        self.index = []
+        self.names = []
+        self._file = None
+        self._shard_size = 0
+
+    def _next_shard(self):
+        if self._file is not None:
+            self._file.close()
+        name = f"shard_{len(self.shards):05d}.bin"
+        self.shards.append({"file": name, "num_tokens": 0})
+        self._file = open(self.output_dir / name, "wb")
+        self._shard_size = 0
+
+    def append(self, tokens, name=None):
+        """
+        Add one sequence (name: e.g. its source file); returns its index in the store.
+        """
+        tokens = np.asarray(tokens)
+        if len(tokens) and (tokens.min() < 0 or tokens.max() > np.iinfo(TOKEN_DTYPE).max):
+            raise ValueError(f"token ids must fit in {np.dtype(TOKEN_DTYPE).name}")
+        if self._file is None or (self._shard_size and self._shard_size + len(tokens) > self.shard_tokens):
+            self._next_shard()
+
+        self.index.append((len(self.shards) - 1, self._shard_size, len(tokens)))
+        self.names.append(name)
+        self._file.write(tokens.astype(TOKEN_DTYPE).tobytes())
+        self._shard_size += len(tokens)
+        self.shards[-1]["num_tokens"] = self._shard_size
+        return len(self.index) - 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        np.save(self.output_dir / INDEX, np.asarray(self.index, dtype=np.int64).reshape(-1, 3))
+        manifest = {
+            "dtype": np.dtype(TOKEN_DTYPE).name,
+            "num_sequences": len(self.index),
+            "num_tokens": sum(shard["num_tokens"] for shard in self.shards),
+            "max_seq_len": self.max_seq_len,
+            "pad_token": self.pad_token,
+            "shards": self.shards,
+            "names": self.names,
+        }
+        # Manifest last: a store without one is incomplete
+        with open(self.output_dir / MANIFEST, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def is_token_store(path):
+    return (Path(path) / MANIFEST).is_file()
+
+
+class TokenStore:
+    """
+    Read-only view of a token store: shards and index are memory-mapped, so
+    opening is instant and only the sequences read are paged in.
+    store[i] is sequence i (uint16 view); store[[i, j, ...]] is an int32 batch
+    padded (or truncated) to max_seq_len, or to its longest sequence.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / MANIFEST) as f:
+            self.manifest = json.load(f)
+        self.max_seq_len = self.manifest["max_seq_len"]
+        self.pad_token = self.manifest["pad_token"]
+        self.index = np.load(self.path / INDEX, mmap_mode="r")
+        self.shards = [
+            np.memmap(self.path / shard["file"], dtype=self.manifest["dtype"], mode="r",
+                      shape=(shard["num_tokens"],)) if shard["num_tokens"] else np.zeros(0, TOKEN_DTYPE)
+            for shard in self.manifest["shards"]
+        ]
+
+    def __len__(self):
+        return self.manifest["num_sequences"]
+
+    def lengths(self):
+        return np.asarray(self.index[:, 2])
+
+    def sequence(self, i):
+        shard, start, length = self.index[i]
+        return self.shards[shard][start:start + length]
+
+    def __getitem__(self, indexes):
+        if np.isscalar(indexes):
+            return self.sequence(int(indexes))
+        sequences = [self.sequence(int(i)) for i in indexes]
+        max_len = self.max_seq_len or max((len(s) for s in sequences), default=0)
+        batch = np.full((len(sequences), max_len), self.pad_token, dtype=np.int32)
+        for row, tokens in enumerate(sequences):
+            tokens = tokens[:max_len]
+            batch[row, :len(tokens)] = tokens
+        return batch
+
+
+def write_token_store(sequences, output_dir, max_seq_len=None, shard_tokens=2**26, pad_token=0, names=None):
+    """
+    Write an iterable of token sequences (and optional names) to a token store; returns its path.
+    """
+    with TokenStoreWriter(output_dir, max_seq_len, shard_tokens, pad_token) as writer:
+        for tokens, name in zip(sequences, names if names is not None else itertools.repeat(None)):
+            writer.append(tokens, name)
+    return Path(output_dir)
+
+
+def strip_padding(tokens, pad_token=0):
+    """
+    tokens without their trailing pad tokens.
+    """
+    kept = np.flatnonzero(np.asarray(tokens) != pad_token)
+    return tokens[:kept[-1] + 1 if len(kept) else 0]
+
+
+def convert_npz(npz_path, output_dir=None, shard_tokens=2**26, strip=False):
+    """
+    Convert a tokenized .npz (padded sequences under "x") to a token store
+    next to it (train.npz -> train/). Rows are kept as they are, padding
+    included, unless strip (trailing pad tokens removed, for windows / packing).
+    """
+    npz_path = Path(npz_path)
+    output_dir = Path(output_dir) if output_dir else npz_path.with_suffix("")
+    loaded = np.load(npz_path, allow_pickle=True)
+    sequences = loaded["x"]
+    names = loaded["file_names"].tolist() if "file_names" in loaded.files else None
+    rows = (strip_padding(row) for row in sequences) if strip else sequences
+    write_token_store(rows, output_dir, max_seq_len=sequences.shape[1], shard_tokens=shard_tokens,
+                      names=names)
+    print(f"Converted {len(sequences)} sequences from {npz_path} to {output_dir}")
+    return output_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert tokenized .npz files to memory-mapped token stores")
+    parser.add_argument("npz_files", nargs="+", help="e.g. data/processed/tokens/maestro/train.npz")
+    parser.add_argument("--shard-tokens", type=int, default=2**26, help="tokens per shard file")
+    parser.add_argument("--strip-padding", action="store_true", help="store rows without trailing padding")
+    args = parser.parse_args()
+
+    for npz_path in args.npz_files:
+        convert_npz(npz_path, shard_tokens=args.shard_tokens, strip=args.strip_padding)
+
+
+if __name__ == "__main__":
+    main()
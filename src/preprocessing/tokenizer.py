@@ -1,46 +1,212 @@
 import os
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import numpy as np
 import midi_neural_processor.processor as midi_tokenizer
+from src.preprocessing.token_store import TokenStoreWriter, TOKEN_DTYPE
+
+# Bump when encode_midi output changes: invalidates every token cache
+TOKENIZER_VERSION = 1
+CACHE_MANIFEST = "manifest.json"
 
 def encode_midi_task(midi_path):
     """Tokenizing a MIDI file."""
     return midi_tokenizer.encode_midi(midi_path)
 
 
-def save_to_npz(input_dir, output_dir, npz_file, max_seq_len=2048):
+def midi_files(input_dir):
+    """
+    Names of the MIDI files in input_dir, sorted.
+    """
+    return sorted(f for f in os.listdir(input_dir) if f.endswith(".mid") or f.endswith(".midi"))
+
+
+def cache_tokens(midi_path, cache_dir):
+    """
+    Worker: sha256 of a MIDI file, tokenized into cache_dir/<sha256>.npy
+    unless a copy of the same content already is. Returns (sha256, error).
+    """
+    try:
+        with open(midi_path, "rb") as f:
+            checksum = hashlib.sha256(f.read()).hexdigest()
+        cache_path = Path(cache_dir) / f"{checksum}.npy"
+        if not cache_path.exists():
+            tokens = np.asarray(encode_midi_task(midi_path), dtype=TOKEN_DTYPE)
+            # Written under a temporary name, so a cache file is always complete
+            tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, tokens)
+            os.replace(tmp_path, cache_path)
+        return checksum, None
+    except Exception as e:
+        return None, str(e)
+
+
+class CorpusTokenizer:
+    """
+    Incremental, parallel tokenization of MIDI folders.
+    Token arrays are cached in cache_dir by file content (<sha256>.npy),
+    with a manifest of path -> (size, mtime, sha256): files unchanged since
+    the last run are neither re-hashed nor re-tokenized. Changed and new
+    files are hashed and tokenized by max_workers processes, chunk_size
+    files per work unit. After each run, stats holds the file counts,
+    failures and files/sec.
+    """
+
+    def __init__(self, cache_dir, max_workers=None, chunk_size=8):
+        self.cache_dir = Path(cache_dir)
+        self.max_workers = max_workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.stats = {}
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _load_manifest(self):
+        try:
+            with open(self.cache_dir / CACHE_MANIFEST) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get("tokenizer_version") != TOKENIZER_VERSION:
+            return {}
+        return manifest["files"]
+
+    def _save_manifest(self, files):
+        tmp_path = self.cache_dir / f"{CACHE_MANIFEST}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"tokenizer_version": TOKENIZER_VERSION, "files": files}, f, indent=1)
+        os.replace(tmp_path, self.cache_dir / CACHE_MANIFEST)
+
+    def _cached(self, entry, stat):
+        return (entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+                and (self.cache_dir / f"{entry['sha256']}.npy").exists())
+
+    def tokenize(self, input_dir, names=None):
+        """
+        Yields (midi_name, tokens) for the MIDI files of input_dir in name
+        order, as they are ready; files that fail are skipped and reported.
+        names : files of input_dir to tokenize (default: midi_files(input_dir))
+        """
+        start = time.perf_counter()
+        files = self._load_manifest()
+        names = midi_files(input_dir) if names is None else list(names)
+        paths = [os.path.abspath(os.path.join(input_dir, name)) for name in names]
+        stats = {path: os.stat(path) for path in paths}
+        stale = [path for path in paths if not self._cached(files.get(path), stats[path])]
+        failures = []
+
+        executor = None
+        results = iter(())
+        if stale:
+            # Workers are spawned, not forked, so they do not inherit the parent's threads
+            executor = ProcessPoolExecutor(
+                max_workers=min(self.max_workers, len(stale)), mp_context=multiprocessing.get_context("spawn"))
+            results = executor.map(cache_tokens, stale, [str(self.cache_dir)] * len(stale),
+                                   chunksize=self.chunk_size)
+        stale = set(stale)
+        try:
+            for name, path in zip(names, paths):
+                if path in stale:
+                    checksum, error = next(results)
+                    if error is not None:
+                        print(f"Skipping {name}: {error}")
+                        failures.append((name, error))
+                        continue
+                    files[path] = {"size": stats[path].st_size, "mtime_ns": stats[path].st_mtime_ns,
+                                   "sha256": checksum}
+                yield name, np.load(self.cache_dir / f"{files[path]['sha256']}.npy")
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            self._save_manifest(files)
+            seconds = time.perf_counter() - start
+            self.stats = {
+                "files": len(names),
+                "cached": len(names) - len(stale),
+                "tokenized": len(stale) - len(failures),
+                "failures": failures,
+                "seconds": seconds,
+                "files_per_sec": len(names) / seconds if seconds else 0.0,
+            }
+            print(f"{input_dir}: {len(names)} files ({self.stats['cached']} cached, "
+                  f"{self.stats['tokenized']} tokenized, {len(failures)} failed) in {seconds:.1f}s, "
+                  f"{self.stats['files_per_sec']:.1f} files/sec")
+
+
+def default_cache_dir(output_dir):
+    """
+    Token cache shared by the outputs written under the same parent folder.
+    """
+    return Path(output_dir).parent / ".token_cache"
+
+
+def save_to_npz(input_dir, output_dir, npz_file, max_seq_len=2048, cache_dir=None, max_workers=None):
     """
     Tokenize all MIDI files in input_dir and save to a .npz file.
+    Files are tokenized in parallel and cached (see CorpusTokenizer; cache_dir
+    defaults to output_dir/.token_cache), rows filled as they arrive.
     """
     os.makedirs(output_dir, exist_ok=True)
 
     output_dir = Path(output_dir)
     npz_file = Path(npz_file)
-    midi_files = [f for f in os.listdir(input_dir) if f.endswith(".mid") or f.endswith(".midi")]
+    output_path = output_dir / npz_file
+    tokenizer = CorpusTokenizer(cache_dir or default_cache_dir(output_path), max_workers)
 
-    all_tokens = []
+    # Listed once: files added while tokenizing are left for the next run
+    names = midi_files(input_dir)
+
+    # 0 = PAD token
+    all_tokens = np.zeros((len(names), max_seq_len), dtype=np.int32)
     file_names = []
 
-    for midi_name in midi_files:
-        midi_path = os.path.join(input_dir, midi_name)
-        try:
-            tokens = encode_midi_task(midi_path)
+    for midi_name, tokens in tokenizer.tokenize(input_dir, names):
+        tokens = tokens[:max_seq_len]
+        all_tokens[len(file_names), :len(tokens)] = tokens
+        file_names.append(midi_name)
+    all_tokens = all_tokens[:len(file_names)]
 
-            if len(tokens) > max_seq_len:
-                tokens = tokens[:max_seq_len]
+    # Save npz
+    np.savez_compressed(output_path, x=all_tokens, file_names=np.array(file_names))
+    print(f"Saved {len(all_tokens)} sequences to {output_path}")
 
-            elif len(tokens) < max_seq_len:
-                tokens += [0] * (max_seq_len - len(tokens))  # 0 = PAD token
 
-            all_tokens.append(tokens)
-            file_names.append(midi_name)
-        except Exception as e:
-            print(f"Skipping {midi_name}: {e}")
+def save_to_token_store(input_dir, output_dir, max_seq_len=2048, cache_dir=None, max_workers=None):
+    """
+    Tokenize all MIDI files in input_dir into a memory-mapped token store
+    (see token_store.py), streamed one file at a time as the workers of
+    CorpusTokenizer finish them (cache_dir defaults to .token_cache next to
+    output_dir). Pieces are stored whole and unpadded; readers pad /
+    truncate them to max_seq_len, or sample windows / pack them (see
+    src/datasets/packing.py).
+    """
+    tokenizer = CorpusTokenizer(cache_dir or default_cache_dir(output_dir), max_workers)
 
-    # Convert to numpy array
-    all_tokens = np.array(all_tokens, dtype=np.int32)
+    with TokenStoreWriter(output_dir, max_seq_len=max_seq_len) as writer:
+        for midi_name, tokens in tokenizer.tokenize(input_dir):
+            writer.append(tokens, name=midi_name)
+    print(f"Saved {len(writer.index)} sequences to {output_dir}")
 
-    # Save npz
-    output_path = output_dir/ npz_file
-    np.savez_compressed(output_path, x=all_tokens, file_names=np.array(file_names))
-    print(f"Saved {len(all_tokens)} sequences to {output_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenize MIDI folders (parallel, cached per file)")
+    parser.add_argument("input_dir", help="e.g. data/raw/moroccan_midi/train")
+    parser.add_argument("output", help="token store folder, or an .npz file")
+    parser.add_argument("--max-seq-len", type=int, default=2048)
+    parser.add_argument("--cache-dir", default=None, help="defaults to .token_cache next to the output")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of CPUs")
+    args = parser.parse_args()
+
+    output = Path(args.output)
+    if output.suffix == ".npz":
+        save_to_npz(args.input_dir, output.parent, output.name, args.max_seq_len, args.cache_dir, args.workers)
+    else:
+        save_to_token_store(args.input_dir, output, args.max_seq_len, args.cache_dir, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,59 @@ import mlflow.tensorflow
 import mlflow.pyfunc
 from pathlib import Path
 
-from src.datasets.midi_dataset import MidiDataset
+from src.datasets.midi_dataset import MidiDataset, build_dataset, epoch_tokens
+from src.datasets.bucketing import sequence_buckets
 from src.models.transformer_decoder import TransformerDecoder
-from src.training.train_utils import build_optimizer, masked_sparse_categorical_crossentropy, CustomSchedule
+from src.models.precision import set_precision
+from src.training.train_utils import (
+    build_optimizer, masked_sparse_categorical_crossentropy, CustomSchedule, TokenThroughput)
+
+def data_buckets(config):
+    """
+    Bucket row lengths when training.data_pipeline.bucketing is on, else None.
+    """
+    pipeline_config = config["training"].get("data_pipeline", {})
+    if not pipeline_config.get("bucketing", False):
+        return None
+    return sequence_buckets(config["data"]["max_seq_len"], pipeline_config.get("bucket_min_len", 64))
+
+
+def token_throughput(config, tokens_path, train_file):
+    """
+    TokenThroughput callback for the training data of this config.
+    """
+    pipeline_config = config["training"].get("data_pipeline", {})
+    sampling = pipeline_config.get("sampling", "pad")
+    if config["training"].get("pipeline", "tf.data") == "sequence":
+        sampling = "pad"
+    tokens, padding = epoch_tokens(tokens_path, train_file, config["data"]["max_seq_len"],
+                                   sampling, data_buckets(config))
+    return TokenThroughput(tokens, padding)
+
+
+def load_datasets(config, tokens_path, train_file, val_file):
+    """
+    (train, val) datasets: tf.data pipelines, or the MidiDataset Sequence
+    when training.pipeline is "sequence".
+    """
+    batch_size = config["training"]["batch_size"]
+    max_seq_len = config["data"]["max_seq_len"]
+    buckets = data_buckets(config)
+    if config["training"].get("pipeline", "tf.data") == "sequence":
+        return (MidiDataset(tokens_path, train_file, batch_size, max_seq_len, shuffle=True, buckets=buckets),
+                MidiDataset(tokens_path, val_file, batch_size, max_seq_len, shuffle=False, buckets=buckets))
+
+    pipeline_config = config["training"].get("data_pipeline", {})
+    sampling = pipeline_config.get("sampling", "pad")
+    train_dataset = build_dataset(
+        tokens_path, train_file, batch_size, shuffle=True,
+        shuffle_buffer=pipeline_config.get("shuffle_buffer"),
+        seed=pipeline_config.get("seed"),
+        sampling=sampling, max_seq_len=max_seq_len, buckets=buckets)
+    val_dataset = build_dataset(
+        tokens_path, val_file, batch_size, shuffle=False,
+        sampling=sampling, max_seq_len=max_seq_len, buckets=buckets)
+    return train_dataset, val_dataset
 
 def maestro_train(config):
     """
@@ -23,6 +73,7 @@ def maestro_train(config):
     weight_decay = config["training"]["weight_decay"]
     patience = config["training"]["patience"]
     checkpoint_dir = config["training"]["checkpoint_dir"]
+    precision = config["training"].get("precision", "float32")
 
 
     maestro_path = Path(tokens_dir) / "maestro"
@@ -31,23 +82,20 @@ def maestro_train(config):
     checkpoint_maestro = config["training"]["checkpoint_maestro"]
 
     # Load datasets
-    train_dataset = MidiDataset(
-        maestro_path, train_file,
-        batch_size, max_seq_len,shuffle=True)
-
-    val_dataset = MidiDataset(
-        maestro_path, val_file,
-        batch_size, max_seq_len, shuffle=False)
+    train_dataset, val_dataset = load_datasets(config, maestro_path, train_file, val_file)
+    throughput = token_throughput(config, maestro_path, train_file)
 
     # Load vocabulary
     vocab_size = max_seq_len + 1
 
-    # Build model
+    # Build model (layers pick up the dtype policy when created)
+    set_precision(precision)
     embed_dim = config["model"]["embed_dim"]
     num_heads = config["model"]["n_heads"]
     num_layers = config["model"]["n_layers"]
     ff_dim = config["model"]["ff_dim"]
     dropout = config["model"]["dropout"]
+    attention = config["model"].get("attention", "dense")
 
     model = TransformerDecoder(
         vocab_size=vocab_size,
@@ -56,7 +104,10 @@ def maestro_train(config):
         num_heads=num_heads,
         ff_dim=ff_dim,
         num_layers=num_layers,
-        dropout=dropout
+        dropout=dropout,
+        attention=attention,
+        attention_block_size=config["model"].get("attention_block_size", 256),
+        recompute=config["model"].get("recompute", False)
     )
 
     # Compile
@@ -84,6 +135,10 @@ def maestro_train(config):
         mlflow.log_param("warmup_steps", warmup_steps)
         mlflow.log_param("weight_decay", weight_decay)
         mlflow.log_param("patience", patience)
+        mlflow.log_param("precision", precision)
+        mlflow.log_param("attention", attention)
+        mlflow.log_param("recompute", config["model"].get("recompute", False))
+        mlflow.log_param("bucketing", config["training"].get("data_pipeline", {}).get("bucketing", False))
 
         patience_counter = 0
         best_epoch = 0
@@ -93,7 +148,8 @@ def maestro_train(config):
             print(f"\nEpoch {epoch}/{epochs}")
             history = model.fit(train_dataset,
                                 validation_data=val_dataset,
-                                epochs=1)
+                                epochs=1,
+                                callbacks=[throughput])
 
             val_loss = history.history["val_loss"][-1]
             train_loss = history.history["loss"][-1]
@@ -105,6 +161,8 @@ def maestro_train(config):
             mlflow.log_metric("val_loss", val_loss, step=epoch)
             mlflow.log_metric("train_accuracy", train_acc, step=epoch)
             mlflow.log_metric("val_accuracy", val_acc, step=epoch)
+            mlflow.log_metric("tokens_per_sec", history.history["tokens_per_sec"][-1], step=epoch)
+            mlflow.log_metric("padding_fraction", history.history["padding_fraction"][-1], step=epoch)
 
             # Save checkpoint if validation improves
             if val_loss < best_val_loss:
@@ -147,16 +205,14 @@ def train(config):
 
     checkpoint_maestro = config["training"]["checkpoint_maestro"]
     final_model_path = config["training"]["final_model_path"]
+    precision = config["training"].get("precision", "float32")
     gnawa_path = Path(tokens_dir) / "gnawa"
     train_file = "train.npz"
     val_file = "val.npz"
 
     # Load dataset
-    train_dataset = MidiDataset(gnawa_path, train_file,
-                                batch_size, max_seq_len,shuffle=True)
-
-    val_dataset = MidiDataset(gnawa_path, val_file,
-                            batch_size, max_seq_len, shuffle=False)
+    train_dataset, val_dataset = load_datasets(config, gnawa_path, train_file, val_file)
+    throughput = token_throughput(config, gnawa_path, train_file)
 
     # Build model
     
@@ -167,12 +223,17 @@ def train(config):
     ff_dim=config["model"]["ff_dim"]
     dropout=config["model"]["dropout"]
 
+    set_precision(precision)
     model = tf.keras.models.load_model(
                             checkpoint_maestro,
                             custom_objects={
                         'CustomSchedule': CustomSchedule,
                         'masked_sparse_categorical_crossentropy': masked_sparse_categorical_crossentropy},
                         compile=False)
+    # Attention implementation from this config, whatever the checkpoint used
+    attention = config["model"].get("attention", "dense")
+    model.set_attention(attention, config["model"].get("attention_block_size", 256))
+    model.set_recompute(config["model"].get("recompute", False))
 
     scheduler = CustomSchedule(embed_dim, warmup_steps)
 
@@ -195,6 +256,10 @@ def train(config):
         mlflow.log_param("warmup_steps", warmup_steps)
         mlflow.log_param("weight_decay", weight_decay)
         mlflow.log_param("patience", patience)
+        mlflow.log_param("precision", precision)
+        mlflow.log_param("attention", attention)
+        mlflow.log_param("recompute", config["model"].get("recompute", False))
+        mlflow.log_param("bucketing", config["training"].get("data_pipeline", {}).get("bucketing", False))
 
         patience_counter = 0
         best_epoch = 0
@@ -203,7 +268,7 @@ def train(config):
         for epoch in range(1, epochs + 1):
             print(f"\nEpoch {epoch}/{epochs}")
             history = model.fit(train_dataset, validation_data=val_dataset,
-                                epochs=1)
+                                epochs=1, callbacks=[throughput])
 
             val_loss = history.history["val_loss"][-1]
             train_loss = history.history["loss"][-1]
@@ -215,6 +280,8 @@ def train(config):
             mlflow.log_metric("val_loss", val_loss, step=epoch)
             mlflow.log_metric("train_accuracy", train_acc, step=epoch)
             mlflow.log_metric("val_accuracy", val_acc, step=epoch)
+            mlflow.log_metric("tokens_per_sec", history.history["tokens_per_sec"][-1], step=epoch)
+            mlflow.log_metric("padding_fraction", history.history["padding_fraction"][-1], step=epoch)
 
             # Save checkpoint if validation improves
             if val_loss < best_val_loss:
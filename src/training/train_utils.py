@@ -1,3 +1,4 @@
+import time
 import tensorflow as tf
 @tf.keras.utils.register_keras_serializable()
 class CustomSchedule(tf.keras.optimizers.schedules.LearningRateSchedule):
@@ -33,17 +34,54 @@ def build_optimizer(scheduler, weight_decay=0.0):
         learning_rate=scheduler,
         weight_decay=weight_decay
     )
+    # float16 gradients underflow without dynamic loss scaling (bfloat16 does not need it)
+    if tf.keras.mixed_precision.global_policy().name == "mixed_float16":
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
     return optimizer
 
 def masked_sparse_categorical_crossentropy(y_true, y_pred):
     """
     Ignore padding tokens (0) in loss computation.
+    Computed in float32 whatever the precision policy.
     """
     loss = tf.keras.losses.sparse_categorical_crossentropy(
-        y_true, y_pred, from_logits=True
+        y_true, tf.cast(y_pred, tf.float32), from_logits=True
     )
 
     mask = tf.cast(tf.not_equal(y_true, 0), tf.float32)
     loss = loss * mask
 
-    return tf.reduce_sum(loss) / tf.maximum(tf.reduce_sum(mask), 1.0)
\ No newline at end of file
+    return tf.reduce_sum(loss) / tf.maximum(tf.reduce_sum(mask), 1.0)
+
+
+class TokenThroughput(tf.keras.callbacks.Callback):
+    """
+    Per-epoch token stats: real (non-padding) tokens trained on per second
+    and the fraction of padding, added to the epoch logs as tokens_per_sec
+    and padding_fraction.
+    tokens, padding : real and padding tokens in one epoch of training data
+    """
+
+    def __init__(self, tokens, padding):
+        super().__init__()
+        self.tokens = tokens
+        self.padding = padding
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+        self._seconds = None
+
+    def on_test_begin(self, logs=None):
+        # Validation runs inside the epoch: stop the clock before it
+        if self._seconds is None:
+            self._seconds = time.perf_counter() - self._start
+
+    def on_epoch_end(self, epoch, logs=None):
+        seconds = self._seconds or time.perf_counter() - self._start
+        tokens_per_sec = self.tokens / seconds
+        padding_fraction = self.padding / max(self.tokens + self.padding, 1)
+        print(f"{self.tokens} tokens + {self.padding} padding ({padding_fraction:.1%}), "
+              f"{tokens_per_sec:.0f} tokens/sec")
+        if logs is not None:
+            logs["tokens_per_sec"] = tokens_per_sec
+            logs["padding_fraction"] = padding_fraction
@@ -62,6 +62,30 @@ def load_vocab(vocab_path):
     except Exception as e:
         raise IOError(f"Failed to load vocab from {vocab_path}: {e}")
     
+def evict_oldest_files(directory, max_bytes, suffix=""):
+    """
+    Delete the least recently modified files ending in suffix until the
+    directory holds at most max_bytes of them.
+    """
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith(suffix):
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except FileNotFoundError:
+                # Evicted or replaced by another worker since the listing
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
 def split_midi_dataset(
     dataset_dir,train_dir,
     val_dir
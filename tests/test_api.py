@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import asyncio
+import importlib
+import pytest
+import yaml
+import tensorflow as tf
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.utils import load_config
+from src.models.transformer_decoder import TransformerDecoder
+
+@pytest.fixture(scope="module")
+def inference(tmp_path_factory):
+    """
+    api.inference imported against a project folder with a tiny model and
+    a test config (no batching, caches or rendering).
+    """
+    project = tmp_path_factory.mktemp("project")
+    config = load_config("config/generation.yaml")
+    config["data"].update(max_seq_len=16, vocab_size=390)
+    config["generation"]["context_stride"] = 4
+    config["seed_cache"]["enabled"] = False
+    config["result_cache"]["enabled"] = False
+    config["serving"].update(batching=False, stream_token_batch=4, stream_midi_every=8)
+    config["render"].update(mode="lazy", synth="sine", cache_dir=str(project / "cache" / "audio"))
+    config["output"]["midi_dir"] = str(project / "outputs" / "generated_midi")
+    (project / "config").mkdir()
+    with open(project / "config" / "generation.yaml", "w") as f:
+        yaml.safe_dump(config, f)
+
+    (project / "models").mkdir()
+    model = TransformerDecoder(vocab_size=390, max_seq_len=16, embed_dim=16, num_heads=2, ff_dim=32,
+                               num_layers=2, dropout=0.0)
+    model(tf.zeros((1, 1), dtype=tf.int32))
+    model.save(str(project / "models" / "final_model.keras"))
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("COMPOSER_PROJECT_DIR", str(project))
+        sys.modules.pop("api.inference", None)
+        module = importlib.import_module("api.inference")
+    yield module
+    module.renderer.shutdown()
+    sys.modules.pop("api.inference", None)
+
+def track_iter_tokens(monkeypatch, inference):
+    """
+    Wrap the stream's iter_tokens: records the tokens decoded and whether the generator was closed.
+    """
+    state = {"decoded": 0, "closed": False}
+    iter_tokens = inference.iter_tokens
+    def tracked(*args, **kwargs):
+        try:
+            for token in iter_tokens(*args, **kwargs):
+                state["decoded"] += 1
+                yield token
+        finally:
+            state["closed"] = True
+    monkeypatch.setattr(inference, "iter_tokens", tracked)
+    return state
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+def test_stream_events_in_order(inference, monkeypatch):
+    state = track_iter_tokens(monkeypatch, inference)
+    app = FastAPI()
+    app.include_router(inference.router)
+
+    response = TestClient(app).post("/generate/stream", json={"length": 20, "top_k": 5, "seed": 1})
+    assert response.status_code == 200
+    events = parse_events(response.text)
+
+    # 4-token batches, a MIDI fragment every 8 tokens, then done
+    assert [name for name, _ in events] == [
+        "tokens", "tokens", "midi", "tokens", "tokens", "midi", "tokens", "done"]
+    tokens = [token for name, data in events if name == "tokens" for token in data["tokens"]]
+    assert len(tokens) == 20 and [data["num_tokens"] for name, data in events if name == "midi"] == [8, 16]
+    done = events[-1][1]
+    assert done["num_tokens"] == 20 and done["stop_reason"] == "length"
+    assert os.path.exists(done["midi_file_path"])
+    assert state == {"decoded": 20, "closed": True}
+    print("Stream events OK")
+
+def test_stream_stops_decoding_when_client_disconnects(inference, monkeypatch):
+    state = track_iter_tokens(monkeypatch, inference)
+    app = FastAPI()
+    app.include_router(inference.router)
+    cancelled = REGISTRY.get_sample_value("generation_stream_cancelled_total")
+
+    async def run():
+        # Raw ASGI: the client goes away once the first "tokens" event arrives
+        body = json.dumps({"length": 1000, "top_k": 5, "seed": 2}).encode()
+        requests = [{"type": "http.request", "body": body, "more_body": False}]
+        gone = asyncio.Event()
+        events = []
+
+        async def receive():
+            if requests:
+                return requests.pop(0)
+            await gone.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                events.append(message["body"].decode().split("\n", 1)[0])
+                gone.set()
+
+        scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+                 "method": "POST", "scheme": "http", "path": "/generate/stream", "raw_path": b"/generate/stream",
+                 "root_path": "", "query_string": b"", "server": ("test", 80), "client": ("test", 1),
+                 "headers": [(b"content-type", b"application/json")]}
+        await app(scope, receive, send)
+        return events
+
+    events = asyncio.run(run())
+    assert events == ["event: tokens"]
+    # Stopped at the next token, not at the next 4-token batch (nor after 1000)
+    assert state["closed"] and state["decoded"] <= 6
+    assert REGISTRY.get_sample_value("generation_stream_cancelled_total") == cancelled + 1
+    print("Stream disconnect OK")
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-q"])
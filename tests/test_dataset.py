@@ -3,8 +3,11 @@ import sys
 import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from src.datasets.midi_dataset import MidiDataset
+from src.datasets.midi_dataset import MidiDataset, build_dataset, load_lengths, epoch_tokens
+from src.datasets.bucketing import sequence_buckets, assign_buckets
 from src.preprocessing import tokenizer
+from src.preprocessing.token_store import TokenStore, convert_npz, write_token_store
+from src.datasets.packing import SEP_TOKEN, padding_fraction
 
 def create_dummy_dataset(tmp_dir="tmp_dataset_test",npz_file="dataset.npz", num_sequences=10, max_len=10):
     """
@@ -52,6 +55,105 @@ def test_midi_dataset():
     assert not np.array_equal(idx_before, idx_after)  
     print("Shuffle on epoch end OK")
 
+def test_tf_dataset_matches_sequence(tmp_path):
+    sequences = np.arange(10 * 8, dtype=np.int32).reshape(10, 8)
+    np.savez_compressed(tmp_path / "dataset.npz", x=sequences)
+
+    # Same (X, y) shift-by-one batches as the Sequence, in order without shuffling
+    sequence = MidiDataset(str(tmp_path), "dataset.npz", batch_size=4, max_seq_len=8, shuffle=False)
+    dataset = build_dataset(str(tmp_path), "dataset.npz", batch_size=4, shuffle=False)
+    batches = [(X.numpy(), y.numpy()) for X, y in dataset]
+    assert len(batches) == len(sequence)
+    for (X, y), (seq_X, seq_y) in zip(batches, (sequence[i] for i in range(len(sequence)))):
+        np.testing.assert_array_equal(X, seq_X)
+        np.testing.assert_array_equal(y, seq_y)
+    print("tf.data batches match the Sequence")
+
+    # Seeded shuffling is reproducible, reshuffles every epoch and keeps every sequence
+    def epochs(dataset):
+        return [np.concatenate([X.numpy()[:, 0] for X, _ in dataset]).tolist() for _ in range(2)]
+    shuffled = epochs(build_dataset(str(tmp_path), "dataset.npz", batch_size=4, shuffle_buffer=4, seed=7))
+    assert shuffled == epochs(build_dataset(str(tmp_path), "dataset.npz", batch_size=4, shuffle_buffer=4, seed=7))
+    assert shuffled[0] != shuffled[1]
+    assert sorted(shuffled[0]) == sorted(shuffled[1]) == sequences[:, 0].tolist()
+    print("Seeded shuffle OK")
+
+def test_token_store_matches_npz(tmp_path):
+    sequences = np.random.randint(0, 388, size=(10, 8)).astype(np.int32)
+    np.savez_compressed(tmp_path / "train.npz", x=sequences, file_names=np.array([f"{i}.mid" for i in range(10)]))
+    npz_batches = [(X.numpy(), y.numpy()) for X, y in build_dataset(str(tmp_path), "train.npz", 4, shuffle=False)]
+
+    # Converted next to the npz, in several uint16 shards, memory-mapped on open
+    convert_npz(tmp_path / "train.npz", shard_tokens=20)
+    store = TokenStore(tmp_path / "train")
+    assert len(store) == 10 and len(store.shards) == 5
+    assert isinstance(store.shards[0], np.memmap) and store.shards[0].dtype == np.uint16
+    assert store.manifest["names"][3] == "3.mid"
+    np.testing.assert_array_equal(store[np.arange(10)], sequences)
+
+    # Datasets pick the store up in place of the npz and yield the same batches
+    sequence = MidiDataset(str(tmp_path), "train.npz", batch_size=4, max_seq_len=8, shuffle=False)
+    assert isinstance(sequence.data, TokenStore)
+    store_batches = [(X.numpy(), y.numpy()) for X, y in build_dataset(str(tmp_path), "train.npz", 4, shuffle=False)]
+    for (X, y), (store_X, store_y), i in zip(npz_batches, store_batches, range(len(sequence))):
+        np.testing.assert_array_equal(store_X, X)
+        np.testing.assert_array_equal(store_y, y)
+        np.testing.assert_array_equal(sequence[i][0], X)
+
+    # Variable-length sequences are padded to max_seq_len when read
+    store = TokenStore(write_token_store([[1, 2, 3], [4], list(range(12))], tmp_path / "ragged", max_seq_len=6))
+    np.testing.assert_array_equal(store[[0, 1, 2]], [[1, 2, 3, 0, 0, 0], [4, 0, 0, 0, 0, 0], list(range(6))])
+    print("Token store OK")
+
+def test_windows_and_packed_sampling(tmp_path):
+    lengths = [5, 30, 12, 3, 40]
+    pieces = [np.random.randint(1, 388, size=n) for n in lengths]
+    write_token_store(pieces, tmp_path / "train", max_seq_len=16)
+
+    # Random windows: full windows from the long pieces, redrawn every epoch
+    dataset = build_dataset(str(tmp_path), "train.npz", 2, sampling="windows", seed=0)
+    epochs = [np.concatenate([X.numpy() for X, _ in dataset]) for _ in range(2)]
+    assert len(epochs[0]) == padding_fraction(lengths, 16, "windows")[1] == 8
+    assert not np.array_equal(epochs[0], epochs[1])
+
+    # Packed: every piece once, followed by the separator; targets stop at piece boundaries
+    (X, segment_ids), y = next(iter(build_dataset(str(tmp_path), "train.npz", 8, shuffle=False,
+                                                  sampling="packed")))
+    assert X.shape == (padding_fraction(lengths, 16, "packed")[1], 15)
+    rows = np.concatenate([X.numpy(), y.numpy()[:, -1:]], axis=1).ravel()
+    np.testing.assert_array_equal(rows[:6], np.append(pieces[0], SEP_TOKEN))
+    np.testing.assert_array_equal(segment_ids[0, :7], [0] * 6 + [1])
+    assert y[0, 5] == 0 and y[0, 4] == SEP_TOKEN
+
+    fractions = [padding_fraction(lengths, 16, sampling)[0] for sampling in ("pad", "windows", "packed")]
+    assert fractions[2] < fractions[1] < fractions[0]
+    print("Windows and packing OK")
+
+def test_bucketed_batches(tmp_path):
+    lengths = np.random.randint(3, 64, size=30)
+    sequences = np.zeros((30, 64), dtype=np.int32)
+    for row, length in enumerate(lengths):
+        sequences[row, :length] = np.random.randint(1, 388, size=length)
+    np.savez_compressed(tmp_path / "train.npz", x=sequences)
+
+    # Lengths read from the padding, nothing written next to the npz
+    np.testing.assert_array_equal(load_lengths(str(tmp_path), "train.npz"), lengths)
+    assert os.listdir(tmp_path) == ["train.npz"]
+
+    # Each sequence once per epoch, in a batch padded only to its bucket
+    buckets = sequence_buckets(64, min_len=16)
+    for dataset in (build_dataset(str(tmp_path), "train.npz", 4, seed=0, buckets=buckets),
+                    MidiDataset(str(tmp_path), "train.npz", 4, 64, buckets=buckets)):
+        batches = [(np.asarray(X), np.asarray(y)) for X, y in dataset]
+        assert {X.shape[1] + 1 for X, _ in batches} <= set(buckets)
+        rows = sorted(tuple(np.concatenate([X[i], y[i, -1:]])) for X, y in batches for i in range(len(X)))
+        expected = sorted(tuple(row[:bucket]) for row, bucket in zip(sequences, assign_buckets(lengths, buckets)))
+        assert rows == expected
+
+    tokens, padding = epoch_tokens(str(tmp_path), "train.npz", 64, buckets=buckets)
+    assert tokens == lengths.sum() and padding < epoch_tokens(str(tmp_path), "train.npz", 64)[1]
+    print("Bucketed batches OK")
+
 if __name__ == "__main__":
     test_midi_dataset()
     print("All MidiDataset tests passed!")
@@ -1,9 +1,38 @@
+import io
 import os
 import sys
+import time
+import threading
+import numpy as np
+import tensorflow as tf
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from src.utils import load_config
-from src.generation.generate import generate_music
+from src.utils import load_config, evict_oldest_files
+from src.generation.generate import (
+    generate_music, generate_tokens, sample_tokens, sample_variations, encode_seed, midi_bytes)
+from src.generation.model_registry import ModelRegistry, LoadedModel, get_model
+from src.generation.scheduler import BatchScheduler
+from src.generation.graph_generate import filter_logits
+from src.generation.buckets import TRACE_COUNTS
+from src.generation.midi_stream import MidiStreamWriter
+from src.generation.speculative import SpeculativeDecoder, speculative_accept
+from src.generation.tflite_backend import TFLiteModel, export_tflite
+from src.generation import seed_cache as seed_cache_module
+from src.generation import generate as generate_module
+from src.generation.result_cache import ResultCache
+from src.generation.seed_cache import LRUCache, SeedCache
+from src.generation.jobs import JobCancelled, JobManager, QueueFull
+from src.generation.render import AudioRenderer
+from src.generation.stopping import StopCriteria, until_stopped
+import midi_neural_processor.processor as midi_tokenizer
+import pretty_midi
+import soundfile as sf
+from src.generation.sampler import (
+    apply_temperature, top_k_sampling, top_p_sampling, softmax, sample_next_tokens)
+from src.models.transformer_decoder import TransformerDecoder
+from src.models.attention import chunked_causal_attention
+from src.models.precision import set_precision
+from src.training.train_utils import build_optimizer, masked_sparse_categorical_crossentropy
 
 model_path = "models/final_model.h5"
 generated_file = "test.midi"
@@ -11,6 +40,738 @@ generated_file = "test.midi"
 # Config
 config = load_config("config/generation.yaml")
 
+def build_tiny_model(vocab_size=50, max_seq_len=16):
+    """
+    Small randomly initialized decoder for tests.
+    """
+    model = TransformerDecoder(vocab_size=vocab_size, max_seq_len=max_seq_len,
+                               embed_dim=16, num_heads=2, ff_dim=32,
+                               num_layers=2, dropout=0.0)
+    model(tf.zeros((1, 1), dtype=tf.int32))
+    return model
+
+def test_cached_decoding_matches_full_forward():
+    model = build_tiny_model()
+    tokens = np.random.randint(1, 50, size=(2, 12)).astype(np.int32)
+
+    full_logits = model(tokens).numpy()
+
+    logits, cache = model.prefill(tokens[:, :5])
+    np.testing.assert_allclose(logits.numpy(), full_logits[:, :5], atol=1e-4)
+
+    for position in range(5, 12):
+        step_logits, cache = model.decode_step(
+            tokens[:, position], cache, np.full((2,), position, dtype=np.int32))
+        np.testing.assert_allclose(step_logits.numpy(), full_logits[:, position], atol=1e-4)
+    print("Cached decoding OK")
+
+def test_model_registry_reuses_and_reloads(tmp_path):
+    path = str(tmp_path / "tiny.keras")
+    build_tiny_model().save(path)
+
+    registry = ModelRegistry()
+    first = registry.get(path)
+    assert registry.get(path) is first
+
+    # A new checkpoint at the same path is picked up
+    build_tiny_model().save(path)
+    os.utime(path, ns=(first.key[0] + 10**9, first.key[0] + 10**9))
+    second = registry.get(path)
+    assert second is not first
+    assert second.checksum != first.checksum
+
+    # Each precision is its own entry; the global policy is left untouched
+    bf16 = registry.get(path, "mixed_bfloat16")
+    assert bf16 is not second and registry.get(path, "mixed_bfloat16") is bf16
+    assert bf16.model.cache_dtype == "bfloat16" and second.model.cache_dtype == "float32"
+    assert tf.keras.mixed_precision.global_policy().name == "float32"
+    print("Model registry OK")
+
+def test_batch_scheduler_matches_single_requests():
+    model = build_tiny_model()
+    loaded = LoadedModel("tiny", model, None, None)
+    scheduler = BatchScheduler(loaded, max_batch_size=2, max_wait_ms=5)
+
+    # Greedy decoding so batched and single-request outputs must agree;
+    # three requests for two slots forces a join after a row finishes
+    prompts = [[3, 7, 9], [5], [1, 2, 3, 4, 5, 6, 7, 8]]
+    lengths = [20, 6, 11]
+    futures = [scheduler.submit(p, n, top_k=1) for p, n in zip(prompts, lengths)]
+    results = [f.result(timeout=60) for f in futures]
+    scheduler.shutdown()
+
+    for prompt, length, result in zip(prompts, lengths, results):
+        assert result == sample_tokens(loaded, prompt, length, top_k=1)
+
+    # Ids outside the configured vocabulary are replaced, as in iter_tokens
+    scheduler = BatchScheduler(loaded, max_batch_size=4, max_wait_ms=5, vocab_size=10)
+    result = scheduler.submit([3, 7, 9], 30, seed=0).result(timeout=60)
+    scheduler.shutdown()
+    assert all(0 <= token < 10 for token in result[3:])
+    print("Batch scheduler OK")
+
+def test_batch_scheduler_follows_checkpoint_reloads(tmp_path, monkeypatch):
+    path = str(tmp_path / "tiny.keras")
+    build_tiny_model(vocab_size=390, max_seq_len=16).save(path)
+    request_config = {
+        "data": {"max_seq_len": 16, "vocab_size": 390},
+        "generation": {"seed_midi_path": None, "top_k": 1, "seed": 3, "length": 20},
+    }
+    result_cache = ResultCache(cache_dir=str(tmp_path / "results"))
+    monkeypatch.setattr(generate_module, "get_result_cache", lambda config: result_cache)
+    scheduler = BatchScheduler(get_model(path), max_batch_size=2, max_wait_ms=5,
+                               resolve=lambda: get_model(path))
+    try:
+        # Greedy: batched and single requests agree on the same model
+        first, _ = generate_tokens(path, request_config, scheduler=scheduler)
+        assert first == generate_tokens(path, request_config)[0]
+
+        # A new checkpoint: batched requests decode (and are cached) on it
+        old = get_model(path)
+        build_tiny_model(vocab_size=390, max_seq_len=16).save(path)
+        os.utime(path, ns=(old.key[0] + 10**9, old.key[0] + 10**9))
+        second, _ = generate_tokens(path, request_config, scheduler=scheduler)
+        assert scheduler.loaded is get_model(path) and scheduler.loaded is not old
+        assert second == generate_tokens(path, request_config)[0] != first
+        assert result_cache.hits == 0
+
+        # A request for the other model waits for the batch to drain
+        running = scheduler.submit([3, 7, 9], 30, top_k=1, loaded=old)
+        waiting = scheduler.submit([5], 6, top_k=1)
+        assert running.result(timeout=60) == sample_tokens(old, [3, 7, 9], 30, top_k=1)
+        assert waiting.result(timeout=60) == sample_tokens(get_model(path), [5], 6, top_k=1)
+    finally:
+        scheduler.shutdown()
+    print("Scheduler model reload OK")
+
+def test_graph_filter_matches_numpy_sampler():
+    logits = np.random.default_rng(0).standard_normal((3, 50)).astype(np.float32)
+    params = [(1.0, 0, 0.9), (0.7, 5, 1.0), (1.3, 20, 0.5)]
+
+    filtered = filter_logits(
+        tf.constant(logits),
+        tf.constant([p[0] for p in params]),
+        tf.constant([p[1] for p in params]),
+        tf.constant([p[2] for p in params]),
+    ).numpy()
+
+    for row, (temperature, top_k, top_p) in enumerate(params):
+        expected = apply_temperature(logits[row].astype(np.float64), temperature)
+        if top_k:
+            expected = top_k_sampling(expected, top_k)
+        expected = top_p_sampling(expected, top_p)
+        assert np.array_equal(np.isfinite(filtered[row]), np.isfinite(expected))
+
+    # Tied logits: top-k still keeps exactly k tokens
+    tied = np.zeros((2, 50), dtype=np.float32)
+    tied[:, :10] = 1.0
+    filtered = filter_logits(
+        tf.constant(tied), tf.constant([1.0, 1.0]), tf.constant([5, 0]), tf.constant([1.0, 1.0])).numpy()
+    assert np.isfinite(filtered).sum(axis=1).tolist() == [5, 50]
+    assert np.isfinite(top_k_sampling(tied[0], 5)).sum() == 5
+    print("Graph sampling filters OK")
+
+def test_graph_generator_matches_eager_loop():
+    model = build_tiny_model()
+    loaded = LoadedModel("tiny", model, None, None)
+
+    # Greedy, and long enough to re-encode the window on the eager schedule
+    prompt = [4, 8, 15]
+    expected = sample_tokens(loaded, prompt, 10, top_k=1)
+    assert loaded.graph_generator().generate(prompt, 10, top_k=1) == expected
+    for stride in (1, 5, 16):
+        assert (loaded.graph_generator().generate(prompt, 30, top_k=1, stride=stride)
+                == sample_tokens(loaded, prompt, 30, top_k=1, stride=stride))
+    assert len(loaded.graph_generator().generate(list(range(1, 20)), 3, top_k=1)) == 22
+    print("Graph generator OK")
+
+def test_prefill_buckets_bound_retracing():
+    model = build_tiny_model(max_seq_len=64)
+    loaded = LoadedModel("tiny", model, None, None)
+    assert loaded.buckets == [16, 32, 64]
+
+    loaded.warmup()
+    prefill_traces = TRACE_COUNTS["prefill"]
+    decode_traces = TRACE_COUNTS["decode_step"]
+
+    for prompt_len in range(1, 60, 3):
+        prompt = np.random.randint(1, 50, size=prompt_len).tolist()
+        sample_tokens(loaded, prompt, 3)
+
+    assert TRACE_COUNTS["prefill"] == prefill_traces
+    assert TRACE_COUNTS["decode_step"] == decode_traces
+    print("Bucketed prefill OK")
+
+def test_batched_sampler_distribution():
+    rng = np.random.default_rng(0)
+    logits = rng.standard_normal((3, 30)).astype(np.float32)
+    temperature = np.array([1.0, 0.5, 2.0])
+    top_k = np.array([0, 5, 10])
+    top_p = np.array([0.9, 1.0, 0.6])
+
+    draws = np.stack([
+        sample_next_tokens(logits, temperature, top_k, top_p, rng=rng)
+        for _ in range(20000)
+    ])
+
+    for row in range(3):
+        expected = apply_temperature(logits[row].astype(np.float64), temperature[row])
+        if top_k[row]:
+            expected = top_k_sampling(expected, top_k[row])
+        expected = softmax(top_p_sampling(expected, top_p[row]))
+        observed = np.bincount(draws[:, row], minlength=30) / len(draws)
+        assert np.abs(observed - expected).max() < 0.02
+
+    # Seeded generators give reproducible draws
+    first = sample_next_tokens(logits, 1.0, 5, 0.9, rng=np.random.default_rng(7))
+    second = sample_next_tokens(logits, 1.0, 5, 0.9, rng=np.random.default_rng(7))
+    assert np.array_equal(first, second)
+    print("Batched sampler OK")
+
+def test_strided_window_matches_full_recompute():
+    model = build_tiny_model(max_seq_len=16)
+    loaded = LoadedModel("tiny", model, None, None)
+    prompt = [3, 1, 4, 1, 5]
+
+    for stride in (1, 5):
+        # Reference: full forward over the same context the stride schedule keeps
+        generated = list(prompt)
+        start = 0
+        keep = 16 - stride + 1
+        for _ in range(40):
+            if len(generated) - start > 16:
+                start = len(generated) - keep
+            logits = model(np.array([generated[start:]], dtype=np.int32))
+            generated.append(int(np.argmax(logits[0, -1])))
+
+        assert sample_tokens(loaded, prompt, 40, top_k=1, stride=stride) == generated
+    print("Strided context window OK")
+
+def test_midi_stream_writer_matches_decode_midi(tmp_path):
+    tokens = []
+    for i, pitch in enumerate([60, 64, 67, 72]):
+        tokens += [356 + 20 + i, pitch, 256 + 30, 128 + pitch, 256 + 9]
+    tokens += [62, 65, 256 + 99, 256 + 49, 128 + 62, 128 + 65]
+
+    path = str(tmp_path / "stream.mid")
+    with MidiStreamWriter(path) as writer:
+        writer.write(tokens[:7])
+        writer.write(tokens[7:])
+
+    expected = midi_tokenizer.decode_midi(tokens).instruments[0].notes
+    notes = pretty_midi.PrettyMIDI(path).instruments[0].notes
+    assert len(notes) == len(expected)
+    for note, ref in zip(sorted(notes, key=lambda n: (n.start, n.pitch)),
+                         sorted(expected, key=lambda n: (n.start, n.pitch))):
+        assert (note.pitch, note.velocity) == (ref.pitch, ref.velocity)
+        assert abs(note.start - ref.start) < 1e-3 and abs(note.end - ref.end) < 1e-3
+    print("MIDI stream writer OK")
+
+def test_speculative_greedy_matches_plain_decoding():
+    target = LoadedModel("target", build_tiny_model(max_seq_len=32), None, None)
+    draft = LoadedModel("draft", build_tiny_model(max_seq_len=32), None, None)
+    prompt = [3, 1, 4, 1, 5]
+
+    expected = sample_tokens(target, prompt, 40, top_k=1)[len(prompt):]
+    for k in (1, 3):
+        decoder = SpeculativeDecoder(target, draft, num_speculative_tokens=k)
+        # 20 tokens fit the window; 40 forces a re-encode
+        assert list(decoder.iter_tokens(prompt, 20, top_k=1)) == expected[:20]
+        assert len(list(decoder.iter_tokens(prompt, 40, top_k=1))) == 40
+
+    # A draft with another vocabulary or window is rejected up front
+    for mismatched in (build_tiny_model(vocab_size=60, max_seq_len=32), build_tiny_model(max_seq_len=16)):
+        try:
+            SpeculativeDecoder(target, LoadedModel("draft", mismatched, None, None))
+            assert False, "mismatched draft accepted"
+        except ValueError:
+            pass
+    print("Speculative decoding OK")
+
+def test_speculative_accept_follows_target_distribution():
+    rng = np.random.default_rng(0)
+    target = rng.dirichlet(np.ones(6), size=2)
+    draft = rng.dirichlet(np.ones(6), size=1)
+
+    counts = np.zeros(6)
+    for _ in range(20000):
+        drafted = [int(rng.choice(6, p=draft[0]))]
+        counts[speculative_accept(target, draft, drafted, rng)[0]] += 1
+    np.testing.assert_allclose(counts / counts.sum(), target[0], atol=0.02)
+    print("Speculative acceptance OK")
+
+def test_variations_share_prefill_and_match_single_decoding():
+    model = build_tiny_model(max_seq_len=16)
+    loaded = LoadedModel("tiny", model, None, None)
+    prompt = [2, 7, 1, 8]
+
+    # Greedy rows must all equal single-request decoding, across a window re-encode
+    for stride in (1, 4):
+        expected = sample_tokens(loaded, prompt, 30, top_k=1, stride=stride)
+        assert sample_variations(loaded, prompt, 3, 30, top_k=1, stride=stride) == [expected] * 3
+
+    # Sampled rows are independent but reproducible from the seed
+    first = sample_variations(loaded, prompt, 4, 12, seed=3)
+    assert first == sample_variations(loaded, prompt, 4, 12, seed=3)
+    assert len({tuple(row) for row in first}) > 1
+    print("Variations OK")
+
+def test_tflite_export_matches_keras_model(tmp_path):
+    model = build_tiny_model(max_seq_len=16)
+    loaded = LoadedModel("tiny", model, None, None)
+    prompt = [6, 2, 8, 3]
+    expected = sample_tokens(loaded, prompt, 24, top_k=1)
+
+    # Float export decodes exactly like the Keras model, across a window re-encode
+    exported = TFLiteModel(export_tflite(model, str(tmp_path / "float.tflite"), "none"))
+    assert sample_tokens(exported, prompt, 24, top_k=1) == expected
+    assert sample_variations(exported, prompt, 2, 24, top_k=1) == [expected] * 2
+
+    # Requests decoding on the shared interpreter from several threads at once
+    results = [None] * 4
+    def decode(i):
+        results[i] = sample_tokens(exported, prompt, 24, top_k=1)
+    threads = [threading.Thread(target=decode, args=(i,)) for i in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [expected] * len(results)
+
+    # Quantized weights stay close to the float distribution
+    quantized = TFLiteModel(export_tflite(model, str(tmp_path / "dynamic.tflite"), "dynamic"))
+    float_logits, _ = loaded.prefill([prompt])
+    quantized_logits, _ = quantized.prefill([prompt])
+    np.testing.assert_allclose(
+        tf.nn.softmax(float_logits).numpy(), tf.nn.softmax(quantized_logits).numpy(), atol=0.01)
+    print("TFLite export OK")
+
+def test_mixed_precision_model():
+    tokens = np.random.randint(1, 50, size=(2, 12)).astype(np.int32)
+    try:
+        set_precision("mixed_bfloat16")
+        model = build_tiny_model()
+        loaded = LoadedModel("tiny", model, None, None)
+        assert model.cache_dtype == "bfloat16"
+
+        # Logits stay float32; cached decoding agrees with the full pass at bf16 precision
+        full_logits = model(tokens)
+        assert full_logits.dtype == tf.float32
+        logits, cache = loaded.prefill(tokens[:, :5])
+        for position in range(5, 12):
+            np.testing.assert_allclose(
+                logits.numpy(), full_logits[:, position - 1].numpy(), atol=0.1)
+            logits, cache = loaded.decode_step(
+                tokens[:, position], cache, np.full((2,), position, dtype=np.int32))
+
+        # float16 training is loss-scaled and stays finite
+        set_precision("mixed_float16")
+        model = build_tiny_model()
+        optimizer = build_optimizer(1e-3)
+        assert isinstance(optimizer, tf.keras.mixed_precision.LossScaleOptimizer)
+        model.compile(optimizer=optimizer, loss=masked_sparse_categorical_crossentropy)
+        history = model.fit(tokens[:, :-1], tokens[:, 1:], epochs=2, verbose=0)
+        assert np.isfinite(history.history["loss"]).all()
+    finally:
+        set_precision("float32")
+    print("Mixed precision OK")
+
+def test_chunked_attention_matches_dense():
+    tokens = np.random.randint(1, 50, size=(2, 13)).astype(np.int32)
+    dense = build_tiny_model()
+    chunked = TransformerDecoder(vocab_size=50, max_seq_len=16, embed_dim=16, num_heads=2, ff_dim=32,
+                                 num_layers=2, dropout=0.0, attention="chunked", attention_block_size=4)
+    chunked(tf.zeros((1, 1), dtype=tf.int32))
+    chunked.set_weights(dense.get_weights())
+
+    # Same outputs and gradients; 13 tokens leave a partial last block
+    grads = []
+    for model in (dense, chunked):
+        with tf.GradientTape() as tape:
+            loss = masked_sparse_categorical_crossentropy(tokens[:, 1:], model(tokens[:, :-1]))
+        grads.append(tape.gradient(loss, model.trainable_variables))
+    np.testing.assert_allclose(chunked(tokens).numpy(), dense(tokens).numpy(), atol=1e-4)
+    for dense_grad, chunked_grad in zip(*grads):
+        np.testing.assert_allclose(tf.convert_to_tensor(chunked_grad), tf.convert_to_tensor(dense_grad), atol=1e-4)
+
+    # Attention dropout masks are reproduced in the backward pass
+    q, k, v = [tf.random.normal((1, 1, 10, 4), dtype=tf.float64) for _ in range(3)]
+    theoretical, numerical = tf.test.compute_gradient(
+        lambda q: tf.reduce_sum(chunked_causal_attention(q, k, v, 4, 0.3, tf.constant([3, 4])) ** 2), [q])
+    np.testing.assert_allclose(theoretical[0], numerical[0], atol=1e-2)
+    print("Chunked attention OK")
+
+def test_packed_segments_match_separate_pieces():
+    first = np.random.randint(1, 50, size=(1, 7)).astype(np.int32)
+    second = np.random.randint(1, 50, size=(1, 6)).astype(np.int32)
+    packed = np.concatenate([first, second], axis=1)
+    segment_ids = np.array([[0] * 7 + [1] * 6], dtype=np.int32)
+    dense = build_tiny_model()
+    chunked = TransformerDecoder(vocab_size=50, max_seq_len=16, embed_dim=16, num_heads=2, ff_dim=32,
+                                 num_layers=2, dropout=0.0, attention="chunked", attention_block_size=4)
+    chunked(tf.zeros((1, 1), dtype=tf.int32))
+    chunked.set_weights(dense.get_weights())
+
+    # Each piece of a packed row sees neither the other piece nor its offset
+    for model in (dense, chunked):
+        logits = model((packed, segment_ids)).numpy()
+        np.testing.assert_allclose(logits[:, :7], model(first).numpy(), atol=1e-4)
+        np.testing.assert_allclose(logits[:, 7:], model(second).numpy(), atol=1e-4)
+    print("Packed segments OK")
+
+def test_recompute_matches_stored_activations():
+    tokens = np.random.randint(1, 50, size=(2, 13)).astype(np.int32)
+    stored = build_tiny_model()
+    recomputed = TransformerDecoder(vocab_size=50, max_seq_len=16, embed_dim=16, num_heads=2, ff_dim=32,
+                                    num_layers=2, dropout=0.0, recompute=[1])
+    recomputed(tf.zeros((1, 1), dtype=tf.int32))
+    recomputed.set_weights(stored.get_weights())
+    assert [block.recompute for block in recomputed.blocks] == [False, True]
+
+    grads = []
+    for model in (stored, recomputed):
+        with tf.GradientTape() as tape:
+            loss = masked_sparse_categorical_crossentropy(tokens[:, 1:], model(tokens[:, :-1], training=True))
+        grads.append(tape.gradient(loss, model.trainable_variables))
+    for stored_grad, recomputed_grad in zip(*grads):
+        np.testing.assert_allclose(tf.convert_to_tensor(recomputed_grad), tf.convert_to_tensor(stored_grad), atol=1e-5)
+
+    # Dropout masks come from a stateless seed: the recomputation draws the same ones
+    recomputed = TransformerDecoder(vocab_size=50, max_seq_len=16, embed_dim=16, num_heads=2, ff_dim=32,
+                                    num_layers=1, dropout=0.3, recompute=True)
+    recomputed(tf.zeros((1, 1), dtype=tf.int32))
+    block = recomputed.blocks[0]
+    x = tf.random.normal((2, 12, 16))
+    seed = tf.constant([1, 2])
+    grads = []
+    for forward in (lambda x: block._forward(x, True, seed),
+                    tf.recompute_grad(lambda x: block._forward(x, True, seed))):
+        with tf.GradientTape() as tape:
+            tape.watch(x)
+            loss = tf.reduce_sum(forward(x) ** 2)
+        grads.append(tape.gradient(loss, [x] + block.trainable_variables))
+    for stored_grad, recomputed_grad in zip(*grads):
+        np.testing.assert_allclose(tf.convert_to_tensor(recomputed_grad), tf.convert_to_tensor(stored_grad), atol=1e-5)
+    print("Activation recompute OK")
+
+def test_seed_cache_skips_tokenization_and_prefill(tmp_path, monkeypatch):
+    seed_dir = "data/raw/maestro/files"
+    seed_path = os.path.join(seed_dir, sorted(os.listdir(seed_dir))[0])
+    encode_calls = []
+    encode_midi = seed_cache_module.midi_tokenizer.encode_midi
+    monkeypatch.setattr(seed_cache_module.midi_tokenizer, "encode_midi",
+                        lambda path: encode_calls.append(path) or encode_midi(path))
+
+    model = build_tiny_model(vocab_size=390, max_seq_len=16)
+    loaded = LoadedModel("tiny", model, None, "0123456789abcdef" * 4)
+    prefill_calls = []
+    prefill = loaded.prefill
+    loaded.prefill = lambda tokens: prefill_calls.append(1) or prefill(tokens)
+
+    cache = SeedCache(cache_dir=str(tmp_path / "seeds"))
+    key, tokens = cache.tokens(seed_path)
+    prompt = tokens[-8:]
+    expected = sample_tokens(loaded, prompt, 8, top_k=1)
+
+    # Same content under another name, then a fresh process (disk tier only)
+    copy_path = str(tmp_path / "renamed.mid")
+    with open(seed_path, "rb") as src, open(copy_path, "wb") as dst:
+        dst.write(src.read())
+    for seed_cache in (cache, cache, SeedCache(cache_dir=str(tmp_path / "seeds"))):
+        assert seed_cache.tokens(copy_path) == (key, tokens)
+        state = seed_cache.prefix_state(key, loaded, prompt)
+        prefill_calls.clear()
+        assert sample_tokens(loaded, prompt, 8, top_k=1, prefix_state=state) == expected
+        assert prefill_calls == []
+    assert encode_calls == [seed_path]
+
+    # The same checkpoint in another precision does not reuse the float32 state
+    try:
+        set_precision("mixed_bfloat16")
+        bf16 = LoadedModel("tiny", build_tiny_model(vocab_size=390, max_seq_len=16), None, loaded.checksum)
+    finally:
+        set_precision("float32")
+    logits, bf16_cache = cache.prefix_state(key, bf16, prompt)
+    assert bf16_cache[0][0].dtype == tf.bfloat16
+    assert len([name for name in os.listdir(tmp_path / "seeds") if name.endswith(".state.npz")]) == 2
+
+    # Memory tier evicts least recently used entries past its byte budget
+    lru = LRUCache(max_bytes=10)
+    lru.put("a", 1, 4)
+    lru.put("b", 2, 4)
+    lru.get("a")
+    lru.put("c", 3, 4)
+    assert lru.get("a") == 1 and lru.get("b") is None
+    print("Seed cache OK")
+
+def test_eviction_skips_files_removed_by_another_worker(tmp_path, monkeypatch):
+    for i, name in enumerate(["a.npz", "b.npz", "c.npz"]):
+        (tmp_path / name).write_bytes(b"x" * 10)
+        os.utime(tmp_path / name, (i, i))
+
+    # "gone.npz" is listed, then removed by another worker before its stat
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: listdir(path) + ["gone.npz"])
+    evict_oldest_files(str(tmp_path), 20, ".npz")
+    assert sorted(listdir(tmp_path)) == ["b.npz", "c.npz"]
+    print("Cache eviction OK")
+
+def test_job_manager_progress_cancel_and_limits():
+    release = threading.Event()
+
+    def runner(params, job):
+        # Stand-in for generation: reports progress until released
+        for done in range(1, 1000):
+            job.report(done, 1000, stage="generating")
+            if release.wait(0.01) and done >= params["tokens"]:
+                return {"tokens": done}
+        raise RuntimeError("never released")
+
+    def wait_for(job, statuses=("succeeded", "failed", "cancelled")):
+        for _ in range(500):
+            if job.status in statuses:
+                return job
+            time.sleep(0.01)
+        raise AssertionError(f"job still {job.status}")
+
+    manager = JobManager(runner, max_workers=1, max_queue=1, ttl_seconds=0.2, retry_after_seconds=7)
+    try:
+        running = manager.submit({"tokens": 5})
+        wait_for(running, ("running",))
+        queued = manager.submit({"tokens": 5})
+        try:
+            manager.submit({"tokens": 5})
+            assert False, "queue limit not enforced"
+        except QueueFull as e:
+            assert e.retry_after == 7
+
+        # Queued job never starts, running job stops at its next report
+        assert manager.cancel(queued.id).status == "cancelled"
+        assert running.progress > 0 and running.stage == "generating"
+        manager.cancel(running.id)
+        assert wait_for(running).status == "cancelled"
+
+        done = manager.submit({"tokens": 3})
+        release.set()
+        assert wait_for(done).status == "succeeded"
+        assert done.result == {"tokens": 3} and done.progress == 1.0
+        assert manager.get(done.id) is done
+
+        # Finished records expire after ttl_seconds
+        time.sleep(0.3)
+        assert manager.get(done.id) is None and manager.get(running.id) is None
+    finally:
+        release.set()
+        manager.shutdown()
+    print("Job manager OK")
+
+def test_cancel_running_job_on_batching_path():
+    model = build_tiny_model()
+    loaded = LoadedModel("tiny", model, None, None)
+    scheduler = BatchScheduler(loaded, max_batch_size=2, max_wait_ms=5)
+
+    def runner(params, job):
+        # Same hook run_generation threads through generate_tokens to the scheduler
+        progress = lambda done, total: job.report(done, total, stage="generating")
+        return scheduler.submit([3, 7, 9], params["tokens"], top_k=1, progress=progress).result()
+
+    manager = JobManager(runner, max_workers=1)
+    try:
+        job = manager.submit({"tokens": 100000})
+        for _ in range(500):
+            if job.progress > 0:
+                break
+            time.sleep(0.01)
+        assert job.status == "running" and job.stage == "generating"
+
+        # Cancelled mid-decode: the row leaves the batch at the next step
+        manager.cancel(job.id)
+        for _ in range(500):
+            if job.status == "cancelled":
+                break
+            time.sleep(0.01)
+        assert job.status == "cancelled" and job.progress < 1.0
+        assert not scheduler._rows
+        assert scheduler.submit([5], 4, top_k=1).result(timeout=60) == sample_tokens(loaded, [5], 4, top_k=1)
+    finally:
+        manager.shutdown()
+        scheduler.shutdown()
+
+    # Batched variations stop at the first progress report that raises
+    reports = []
+    def cancel_after_three(done, total):
+        reports.append(done)
+        if done == 3:
+            raise JobCancelled("variations")
+    try:
+        sample_variations(loaded, [3, 7, 9], 2, 20, progress=cancel_after_three)
+        assert False, "variations not cancelled"
+    except JobCancelled:
+        assert reports == [1, 2, 3]
+    print("Batched job cancellation OK")
+
+def test_chunked_render_matches_single_pass(tmp_path):
+    seed_dir = "data/raw/maestro/files"
+    midi_data = pretty_midi.PrettyMIDI(os.path.join(seed_dir, sorted(os.listdir(seed_dir))[0]))
+    for instrument in midi_data.instruments:
+        instrument.notes = [note for note in instrument.notes if note.start < 20]
+    midi_path = str(tmp_path / "seed.mid")
+    midi_data.write(midi_path)
+
+    single = AudioRenderer(str(tmp_path / "single"), synth="sine", chunk_seconds=1000, max_workers=1)
+    chunked = AudioRenderer(str(tmp_path / "chunked"), synth="sine", chunk_seconds=3, max_workers=2)
+    try:
+        midi_data = pretty_midi.PrettyMIDI(midi_path)
+        expected = single.synthesize(midi_data)
+        audio = chunked.synthesize(midi_data)
+        assert audio.shape == expected.shape
+        np.testing.assert_allclose(audio, expected, atol=1e-9)
+        assert np.abs(audio).max() == 1.0
+
+        # Cached by content: a second render (same or renamed file) reuses the WAV
+        wav_path = chunked.render(midi_path)
+        mtime = os.path.getmtime(wav_path)
+        copy_path = str(tmp_path / "renamed.mid")
+        with open(midi_path, "rb") as src, open(copy_path, "wb") as dst:
+            dst.write(src.read())
+        assert chunked.render(copy_path) == wav_path
+        assert os.listdir(str(tmp_path / "chunked")) == [os.path.basename(wav_path)]
+        assert os.path.getmtime(wav_path) >= mtime
+    finally:
+        single.shutdown()
+        chunked.shutdown()
+    print("Chunked render OK")
+
+def test_in_memory_seed_and_outputs(tmp_path):
+    seed_dir = "data/raw/maestro/files"
+    seed_path = os.path.join(seed_dir, sorted(os.listdir(seed_dir))[0])
+    with open(seed_path, "rb") as f:
+        seed = f.read()
+
+    # Seed bytes encode like the file, and share its seed cache entry
+    tokens = encode_seed(seed, 64, 390)
+    assert tokens == encode_seed(seed_path, 64, 390)
+    cache = SeedCache()
+    assert cache.tokens(seed) == cache.tokens(seed_path)
+
+    data = midi_bytes(tokens)
+    midi_data = pretty_midi.PrettyMIDI(io.BytesIO(data))
+    assert sorted(note.pitch for note in midi_data.instruments[0].notes) == \
+        sorted(note.pitch for note in midi_tokenizer.decode_midi(tokens).instruments[0].notes)
+
+    renderer = AudioRenderer(str(tmp_path / "audio"), fs=8000, synth="sine", max_workers=1)
+    try:
+        for audio_format in ("ogg", "flac"):
+            audio, fs = sf.read(io.BytesIO(renderer.audio_bytes(midi_data, audio_format)))
+            assert fs == 8000 and len(audio) >= midi_data.get_end_time() * fs
+        assert os.listdir(str(tmp_path / "audio")) == []
+    finally:
+        renderer.shutdown()
+    print("In-memory request path OK")
+
+def test_inline_generation_leaves_cache_dirs_empty(tmp_path, monkeypatch):
+    seed_dir = "data/raw/maestro/files"
+    with open(os.path.join(seed_dir, sorted(os.listdir(seed_dir))[0]), "rb") as f:
+        seed = f.read()
+    path = str(tmp_path / "tiny.keras")
+    build_tiny_model(vocab_size=390, max_seq_len=16).save(path)
+    request_config = {
+        "data": {"max_seq_len": 16, "vocab_size": 390},
+        "generation": {"seed_midi_path": seed, "seed": 5, "length": 4},
+        "seed_cache": {"enabled": True, "cache_dir": str(tmp_path / "seeds")},
+        "result_cache": {"enabled": True, "cache_dir": str(tmp_path / "results")},
+    }
+    monkeypatch.setattr("src.generation.seed_cache._seed_cache", None)
+    monkeypatch.setattr("src.generation.result_cache._result_cache", None)
+
+    # Inline requests (disk_cache=False) use the memory tiers only
+    inline = generate_tokens(path, request_config, disk_cache=False)
+    assert os.listdir(tmp_path / "seeds") == [] and os.listdir(tmp_path / "results") == []
+    assert generate_tokens(path, request_config, disk_cache=False) == inline
+    assert generate_module.get_result_cache(request_config).memory.num_bytes > 0
+
+    # Other requests still persist their results
+    generate_tokens(path, {**request_config, "generation": {**request_config["generation"], "seed": 6}})
+    assert os.listdir(tmp_path / "results")
+    print("Inline generation caches OK")
+
+def test_seeded_requests_are_reproducible_and_cached(tmp_path, monkeypatch):
+    path = str(tmp_path / "tiny.keras")
+    build_tiny_model(vocab_size=390, max_seq_len=16).save(path)
+    request_config = {
+        "data": {"max_seq_len": 16, "vocab_size": 390},
+        "generation": {"seed_midi_path": None, "top_k": 20, "temperature": 1.0, "seed": 11, "length": 15},
+    }
+    result_cache = ResultCache(cache_dir=str(tmp_path / "results"))
+    monkeypatch.setattr(generate_module, "get_result_cache", lambda config: result_cache)
+    decode_calls = []
+    iter_tokens = generate_module.iter_tokens
+    monkeypatch.setattr(generate_module, "iter_tokens",
+                        lambda *args, **kwargs: decode_calls.append(1) or iter_tokens(*args, **kwargs))
+
+    # Same seed, same result, whatever the global numpy state
+    np.random.seed(0)
+    first = generate_tokens(path, request_config)
+    np.random.seed(1)
+    assert generate_tokens(path, request_config) == first
+    assert decode_calls == [1] and result_cache.hits == 1
+
+    # A fresh process finds the result on disk; other parameters miss
+    result_cache.memory.clear()
+    assert generate_tokens(path, request_config) == first
+    other = {**request_config, "generation": {**request_config["generation"], "seed": 12}}
+    generate_tokens(path, other)
+    assert decode_calls == [1, 1] and result_cache.hits == 2
+
+    # Unseeded requests are neither looked up nor stored
+    unseeded = {**request_config, "generation": {**request_config["generation"], "seed": None}}
+    generate_tokens(path, unseeded)
+    assert result_cache.hits + result_cache.misses == 4
+
+    # Entries expire after ttl_seconds
+    result_cache.ttl_seconds = 0
+    time.sleep(0.01)
+    generate_tokens(path, request_config)
+    assert len(decode_calls) == 4
+    print("Seeded result cache OK")
+
+def test_generation_stops_at_first_limit(tmp_path):
+    time_shift = midi_tokenizer.START_IDX["time_shift"]
+    half_second = time_shift + 49
+
+    # Musical duration is summed from time-shift tokens; the EOS token is dropped
+    criteria = StopCriteria(10, max_duration=1.0)
+    assert list(until_stopped(iter([60, half_second, 60, half_second, 60]), criteria)) == [60, half_second, 60, half_second]
+    assert criteria.stop_reason == "duration" and criteria.duration == 1.0
+    criteria = StopCriteria(10, eos_token=389)
+    assert list(until_stopped(iter([60, 389, 61]), criteria)) == [60]
+    assert criteria.stop_reason == "end_of_sequence"
+    criteria = StopCriteria(10, deadline=time.monotonic())
+    assert list(until_stopped(iter([60, 61]), criteria)) == [60] and criteria.stop_reason == "deadline"
+
+    # The requested length is honored, capped by max_new_tokens
+    path = str(tmp_path / "tiny.keras")
+    build_tiny_model(vocab_size=390, max_seq_len=16).save(path)
+    request_config = {
+        "data": {"max_seq_len": 16, "vocab_size": 390},
+        "generation": {"seed_midi_path": None, "seed": 3, "length": 7, "max_new_tokens": 100},
+    }
+    tokens, stop_reason = generate_tokens(path, request_config)
+    prompt = len(generate_tokens(path, {**request_config, "generation": {
+        **request_config["generation"], "length": 0}})[0])
+    assert len(tokens) - prompt == 7 and stop_reason == "length"
+    request_config["generation"]["max_new_tokens"] = 5
+    assert len(generate_tokens(path, request_config)[0]) - prompt == 5
+
+    # Every variation stops on its own
+    request_config["generation"].update(max_new_tokens=100, length=100, max_duration=0.5)
+    results = generate_module.generate_variations(path, {**request_config, "output": {"midi_dir": str(tmp_path)}},
+                                                  ["a.midi", "b.midi"])
+    for _, generated, stop_reason in results:
+        assert stop_reason == "duration"
+        assert sum(0.01 * (t - time_shift + 1) for t in generated if time_shift <= t < time_shift + 100) >= 0.5
+    print("Stop criteria OK")
+
 if __name__ == "__main__":
     try: 
         generate_music(model_path, config, generated_file)
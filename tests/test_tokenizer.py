@@ -0,0 +1,73 @@
+import os
+import sys
+import numpy as np
+import pretty_midi
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.preprocessing import tokenizer as tokenizer_module
+from src.preprocessing.tokenizer import CorpusTokenizer, encode_midi_task, save_to_npz, save_to_token_store
+from src.preprocessing.token_store import TokenStore
+
+def write_midi(path, pitches):
+    """
+    Small piano MIDI file with one note per pitch.
+    """
+    midi = pretty_midi.PrettyMIDI()
+    piano = pretty_midi.Instrument(program=0)
+    for i, pitch in enumerate(pitches):
+        piano.notes.append(pretty_midi.Note(velocity=80, pitch=pitch, start=i * 0.25, end=i * 0.25 + 0.2))
+    midi.instruments.append(piano)
+    midi.write(str(path))
+
+def test_corpus_tokenizer_is_incremental(tmp_path):
+    corpus = tmp_path / "midi"
+    corpus.mkdir()
+    for i in range(4):
+        write_midi(corpus / f"{i}.mid", [60 + i, 64 + i, 67 + i])
+    (corpus / "broken.mid").write_bytes(b"not a midi file")
+
+    # Parallel first run: every file tokenized, in name order; failures reported
+    save_to_token_store(str(corpus), tmp_path / "tokens" / "train", max_workers=2)
+    store = TokenStore(tmp_path / "tokens" / "train")
+    assert store.manifest["names"] == ["0.mid", "1.mid", "2.mid", "3.mid"]
+    for i in range(4):
+        np.testing.assert_array_equal(store[i], encode_midi_task(str(corpus / f"{i}.mid")))
+
+    # Re-runs only tokenize new and changed files
+    tokenizer = CorpusTokenizer(tmp_path / "tokens" / ".token_cache", max_workers=2)
+    assert len(list(tokenizer.tokenize(str(corpus)))) == 4
+    assert tokenizer.stats["cached"] == 4 and tokenizer.stats["tokenized"] == 0
+    assert [name for name, _ in tokenizer.stats["failures"]] == ["broken.mid"]
+
+    write_midi(corpus / "1.mid", [50, 52])
+    write_midi(corpus / "4.mid", [70])
+    tokens = dict(tokenizer.tokenize(str(corpus)))
+    assert tokenizer.stats["cached"] == 3 and tokenizer.stats["tokenized"] == 2
+    np.testing.assert_array_equal(tokens["1.mid"], encode_midi_task(str(corpus / "1.mid")))
+    print("Incremental tokenization OK")
+
+def test_save_to_npz_ignores_files_added_while_running(tmp_path, monkeypatch):
+    corpus = tmp_path / "midi"
+    corpus.mkdir()
+    for i in range(3):
+        write_midi(corpus / f"{i}.mid", [60 + i, 64 + i])
+
+    # A file lands in the folder right after it is listed
+    listed = tokenizer_module.midi_files
+    def midi_files(input_dir):
+        names = listed(input_dir)
+        write_midi(corpus / f"new_{len(names)}.mid", [72])
+        return names
+    monkeypatch.setattr(tokenizer_module, "midi_files", midi_files)
+
+    save_to_npz(str(corpus), str(tmp_path / "tokens"), "train.npz", max_seq_len=16, max_workers=1)
+    data = np.load(tmp_path / "tokens" / "train.npz")
+    assert list(data["file_names"]) == ["0.mid", "1.mid", "2.mid"]
+    assert data["x"].shape == (3, 16)
+    print("npz snapshot OK")
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        test_corpus_tokenizer_is_incremental(Path(tmp_dir))